@@ -0,0 +1,282 @@
+"""Benchmarks, run these from the shell against a staging db / redis.
+
+> bench_pop_pvp_queue(user_id=21)
+> bench_ticket_drop(rows=1000000)
+> bench_dungeon_stages()
+> bench_profanity(lines=10000)
+> bench_mass_inbox(users=1000000)
+"""
+import time
+import tracemalloc
+
+from better_profanity import Profanity
+from django.db import connection
+from django.db.transaction import atomic
+from django_redis import get_redis_connection
+
+from battlegame import cron
+from battlegame.gameanalytics import percentile
+from playerdata import bulk_insert, constants, dungeon_gen, profanity_filter, pvp_queue
+from playerdata.models import *
+
+
+# Counts the requests sent to redis through `r`, pipelines count as one
+class RedisRoundTripCounter:
+    def __init__(self, r):
+        self.r = r
+        self.count = 0
+
+    def __enter__(self):
+        execute_command = self.r.execute_command
+        pipeline = self.r.pipeline
+
+        def counted_execute_command(*args, **kwargs):
+            self.count += 1
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe_execute = pipe.execute
+
+            def counted_execute(*execute_args, **execute_kwargs):
+                self.count += 1
+                return pipe_execute(*execute_args, **execute_kwargs)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        self.r.execute_command = counted_execute_command
+        self.r.pipeline = counted_pipeline
+        return self
+
+    def __exit__(self, *args):
+        del self.r.execute_command
+        del self.r.pipeline
+
+
+def print_latencies(name, latencies, round_trips=None):
+    line = "%s: n=%d p50=%.3fms p99=%.3fms total=%.3fs" % (name, len(latencies),
+                                                           percentile(latencies, 50) * 1000,
+                                                           percentile(latencies, 99) * 1000,
+                                                           sum(latencies))
+    if round_trips is not None:
+        line += " round_trips/op=%.2f" % (round_trips / len(latencies))
+    print(line)
+
+
+# The pop sequence before it was moved into a lua script, without the refill
+def _legacy_pop_pvp_queue(r, opponent_queue_key, recently_seen_key):
+    r.llen(opponent_queue_key)
+    opponent_id = r.lpop(opponent_queue_key)
+    r.rpush(recently_seen_key, opponent_id)
+
+    if r.llen(recently_seen_key) > pvp_queue.RECENTLY_SEEN_QUEUE_LIMIT:
+        r.lpop(recently_seen_key)
+
+    r.expire(opponent_queue_key, pvp_queue.QUEUE_EXPIRY_SECONDS)
+    r.expire(recently_seen_key, pvp_queue.QUEUE_EXPIRY_SECONDS)
+    return int(r.lindex(opponent_queue_key, 0))
+
+
+def bench_pop_pvp_queue(user_id, iterations=1000):
+    user = User.objects.select_related('userinfo', 'userstats').get(id=user_id)
+    r = get_redis_connection("default")
+    opponent_queue_key = pvp_queue.build_opponent_queue_key(user.id)
+    recently_seen_key = pvp_queue.build_recently_seen_key(user.id)
+
+    def run(name, pop):
+        # fill the queue up front so neither side pays for a refill
+        r.delete(opponent_queue_key, recently_seen_key)
+        r.rpush(opponent_queue_key, *range(1, iterations + 2))
+
+        latencies = []
+        with RedisRoundTripCounter(r) as counter:
+            for _ in range(iterations):
+                start = time.perf_counter()
+                pop()
+                latencies.append(time.perf_counter() - start)
+        print_latencies(name, latencies, counter.count)
+
+    run("legacy pop", lambda: _legacy_pop_pvp_queue(r, opponent_queue_key, recently_seen_key))
+    run("lua pop", lambda: pvp_queue.pop_pvp_queue(user))
+
+    r.delete(opponent_queue_key, recently_seen_key)
+
+
+# Synthetic stand in for the inventory table, so the cron benchmarks don't need
+# a million real users
+class BenchInventory(models.Model):
+    daily_dungeon_ticket = models.IntegerField()
+
+    class Meta:
+        managed = False
+        db_table = 'bench_inventory'
+        app_label = 'playerdata'
+
+
+def _reset_bench_inventory(rows):
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_inventory")
+        cursor.execute("CREATE UNLOGGED TABLE bench_inventory (id integer PRIMARY KEY, daily_dungeon_ticket integer NOT NULL)")
+        cursor.execute("INSERT INTO bench_inventory SELECT i, i %% (%s + 1) FROM generate_series(1, %s) AS i",
+                       [cron.MAX_DAILY_DUNGEON_TICKET, rows])
+
+
+# daily_dungeon_ticket_drop before it was moved to set based updates
+@atomic
+def _legacy_ticket_drop():
+    to_inc = BenchInventory.objects.filter(daily_dungeon_ticket__lt=cron.MAX_DAILY_DUNGEON_TICKET)
+    for inv in to_inc:
+        inv.daily_dungeon_ticket += 1
+    BenchInventory.objects.bulk_update(to_inc, ['daily_dungeon_ticket'])
+
+
+def _chunked_ticket_drop(chunk_size):
+    cron.clear_cron_checkpoint("bench_ticket_drop")
+    cron.run_in_chunks("bench_ticket_drop",
+                       BenchInventory.objects.filter(daily_dungeon_ticket__lt=cron.MAX_DAILY_DUNGEON_TICKET),
+                       cron.increment_chunk('daily_dungeon_ticket', cron.MAX_DAILY_DUNGEON_TICKET),
+                       chunk_size=chunk_size)
+
+
+def bench_ticket_drop(rows=1000000, chunk_size=10000):
+    def run(name, drop):
+        _reset_bench_inventory(rows)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        drop()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT max(daily_dungeon_ticket), sum(daily_dungeon_ticket) FROM bench_inventory")
+            max_tickets, total_tickets = cursor.fetchone()
+        print("%s: rows=%d wall=%.3fs peak_mem=%.1fMB max=%d sum=%d" % (name, rows, elapsed, peak / 1024 / 1024,
+                                                                      max_tickets, total_tickets))
+
+    run("legacy bulk_update", _legacy_ticket_drop)
+    run("chunked set based update", lambda: _chunked_ticket_drop(chunk_size))
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE bench_inventory")
+
+
+# Generates every campaign and tower stage, first uncached the way every
+# DungeonStageView call used to, then from the stage cache
+def bench_dungeon_stages():
+    for dungeon_type in [constants.DungeonType.CAMPAIGN.value, constants.DungeonType.TOWER.value]:
+        name = constants.DungeonType(dungeon_type).name.lower()
+        stage_nums = range(1, constants.MAX_DUNGEON_STAGE[dungeon_type] + 1)
+
+        def run(run_name, generate):
+            latencies = []
+            for stage_num in stage_nums:
+                start = time.perf_counter()
+                generate(stage_num)
+                latencies.append(time.perf_counter() - start)
+            print_latencies("%s %s" % (name, run_name), latencies)
+
+        def uncached(stage_num):
+            dungeon_gen.dungeon_stages_cache.invalidate()
+            dungeon_gen.stage_generator(stage_num, dungeon_type)
+
+        run("uncached", uncached)
+        dungeon_gen.dungeon_stages_cache.invalidate()
+        run("cold cache", lambda stage_num: dungeon_gen.stage_generator(stage_num, dungeon_type))
+        run("warm cache", lambda stage_num: dungeon_gen.stage_generator(stage_num, dungeon_type))
+
+
+# Censors the most recent chat lines with the library's own word matching and
+# with the compiled word set, and checks they agree
+def bench_profanity(lines=10000):
+    corpus = list(ChatMessage.objects.order_by('-time_send').values_list('message', flat=True)[:lines])
+    library = Profanity()
+    library.load_censor_words(whitelist_words=list(profanity_filter.WHITELIST_WORDS))
+
+    def run(name, censor):
+        latencies = []
+        censored = []
+        for line in corpus:
+            start = time.perf_counter()
+            censored.append(censor(line))
+            latencies.append(time.perf_counter() - start)
+        print_latencies(name, latencies)
+        return censored
+
+    expected = run("better_profanity", library.censor)
+    actual = run("compiled", profanity_filter.profanity.censor)
+    print("mismatches: %d" % sum(1 for e, a in zip(expected, actual) if e != a))
+
+
+# Synthetic stand ins for User and Mail, so the mass inbox benchmark doesn't
+# need a million real users
+class BenchUser(models.Model):
+    class Meta:
+        managed = False
+        db_table = 'bench_user'
+        app_label = 'playerdata'
+
+
+class BenchMail(models.Model):
+    receiver_id = models.IntegerField()
+    message = models.TextField()
+    time_send = models.DateTimeField(auto_now_add=True)
+    has_unclaimed_reward = models.BooleanField(default=False)
+
+    class Meta:
+        managed = False
+        db_table = 'bench_mail'
+        app_label = 'playerdata'
+
+
+def _reset_bench_mail(users):
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_user, bench_mail")
+        cursor.execute("CREATE UNLOGGED TABLE bench_user (id integer PRIMARY KEY)")
+        cursor.execute("INSERT INTO bench_user SELECT generate_series(1, %s)", [users])
+        cursor.execute("CREATE UNLOGGED TABLE bench_mail (id serial PRIMARY KEY, receiver_id integer NOT NULL, "
+                       "message text NOT NULL, time_send timestamp with time zone NOT NULL, "
+                       "has_unclaimed_reward boolean NOT NULL)")
+
+
+# send_inbox to 'all' before it streamed, one list and one bulk_create
+@atomic
+def _legacy_mass_inbox(message):
+    mails = [BenchMail(receiver_id=user_id, message=message, has_unclaimed_reward=True)
+             for user_id in BenchUser.objects.values_list('id', flat=True)]
+    BenchMail.objects.bulk_create(mails)
+
+
+def _streamed_mass_inbox(message, batch_size):
+    user_ids = BenchUser.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    bulk_insert.copy_bulk_create(BenchMail,
+                                 (BenchMail(receiver_id=user_id, message=message, has_unclaimed_reward=True) for user_id in user_ids),
+                                 batch_size=batch_size)
+
+
+def bench_mass_inbox(users=1000000, batch_size=bulk_insert.COPY_BATCH_SIZE):
+    message = "Thanks for playing!\n\tBattle on"
+
+    def run(name, send):
+        _reset_bench_mail(users)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        send()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*), count(DISTINCT receiver_id) FROM bench_mail WHERE message = %s", [message])
+            mails, receivers = cursor.fetchone()
+        print("%s: users=%d wall=%.3fs peak_mem=%.1fMB mails=%d receivers=%d" % (name, users, elapsed, peak / 1024 / 1024,
+                                                                             mails, receivers))
+
+    run("legacy bulk_create", lambda: _legacy_mass_inbox(message))
+    run("streamed copy", lambda: _streamed_mass_inbox(message, batch_size))
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE bench_user, bench_mail")
@@ -1,12 +1,17 @@
+import functools
 import statistics
+from time import perf_counter
 
 import requests
+from django.db.models import F, Max, Min
+from django.db.models.functions import Least
 from django.db.transaction import atomic
 from sentry_sdk import capture_exception
 from django_redis import get_redis_connection
 from datetime import timedelta
+from mainsocket import badges, notifications
 from playerdata import tier_system, relic_shop, refunds, base, resource_shop, server, regal_rewards, activity_points, \
-    leaderboards, clan_season
+    leaderboards, clan_season, purchase_queue
 from playerdata.antihacking import MatchValidator
 from playerdata.constants import TOURNEY_SIZE
 from playerdata.daily_dungeon import daily_dungeon_team_gen_cron
@@ -29,6 +34,11 @@ To check what jobs are actually scheduled on crontab: `crontab -l`
 Double check that crontab on the server is running on UTC timezone
 """
 
+def cron_logger(s):
+    # TODO: we should definately just use the logging package.
+    print("[%s] %s" % (datetime.now().strftime("%d/%m/%Y %H:%M:%S"), s))
+
+
 def cron(uuid=None, retries=0):
     def notify_success():
         if uuid is not None and not settings.DEVELOPMENT:
@@ -37,10 +47,6 @@ def cron(uuid=None, retries=0):
             except requests.RequestException as e:
                 cron_logger("Failed to ping hc: %s" % e)
 
-    def cron_logger(s):
-        # TODO: we should definately just use the logging package.
-        print("[%s] %s" % (datetime.now().strftime("%d/%m/%Y %H:%M:%S"), s))
-
     def inner(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -60,6 +66,49 @@ def cron(uuid=None, retries=0):
     return inner
 
 
+CRON_CHUNK_SIZE = 1000
+
+
+def clear_cron_checkpoint(name):
+    CronCheckpoint.objects.filter(name=name, day=datetime.utcnow().date()).delete()
+
+
+def run_in_chunks(name, queryset, process_chunk, chunk_size=CRON_CHUNK_SIZE):
+    """Calls process_chunk on queryset in primary key ranges of chunk_size,
+    each in its own short transaction.
+
+    The end of each range is checkpointed for the day in the same transaction
+    as the range, so a retry (or a manual rerun on the same day) resumes after
+    the last committed one instead of redoing or re-locking the whole table.
+    """
+    today = datetime.utcnow().date()
+    CronCheckpoint.objects.filter(day__lt=today).delete()
+
+    bounds = queryset.aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    if bounds['min_pk'] is None:
+        return
+
+    start = bounds['min_pk']
+    checkpoint = CronCheckpoint.objects.filter(name=name, day=today).first()
+    if checkpoint is not None:
+        start = max(start, checkpoint.next_pk)
+        cron_logger("%s: resuming from pk %d" % (name, start))
+
+    total_start_time = perf_counter()
+    while start <= bounds['max_pk']:
+        end = start + chunk_size
+        chunk_start_time = perf_counter()
+
+        with atomic():
+            process_chunk(queryset.filter(pk__gte=start, pk__lt=end))
+            CronCheckpoint.objects.update_or_create(name=name, day=today, defaults={'next_pk': end})
+
+        cron_logger("%s: pk [%d, %d) took %.3fs" % (name, start, end, perf_counter() - chunk_start_time))
+        start = end
+
+    cron_logger("%s: done in %.3fs" % (name, perf_counter() - total_start_time))
+
+
 @cron(uuid="75a7e314-2bb2-48e8-b319-1f813dd86999")
 def daily_quests_cron():
     # remove top 3 from daily
@@ -101,19 +150,29 @@ def daily_clean_matches_cron():
     MatchReplay.objects.filter(uploaded_at__lte=timezone.now() - timedelta(days=14)).delete()
 
 
+def _reset_daily_wins_chunk(user_stats):
+    base.user_lock_related_users(user_stats)
+    user_ids = list(user_stats.values_list('user_id', flat=True))
+    user_stats.update(daily_wins=0, daily_games=0)
+    # update() skips the post_save that drops cached profiles
+    invalidate_userinfo_snapshots(user_ids)
+
+
+def _reset_pvp_skips_chunk(user_stats):
+    base.user_lock_related_users(user_stats)
+    user_stats = list(user_stats)
+    for stat in user_stats:
+        stat.pvp_skips = skip_cap(stat.user.userinfo)
+    UserStats.objects.bulk_update(user_stats, ['pvp_skips'])
+
+
 @cron(uuid="cb651e8b-e227-4be1-a786-acd6fcac037c")
 def reset_daily_wins_cron():
-    with atomic():
-        user_stats = UserStats.objects.filter(daily_wins__gt=0, daily_games__gt=0)
-        base.user_lock_related_users(user_stats)
-        user_stats.update(daily_wins=0, daily_games=0)
+    run_in_chunks("reset_daily_wins", UserStats.objects.filter(daily_wins__gt=0, daily_games__gt=0),
+                  _reset_daily_wins_chunk)
 
-    with atomic():
-        user_stats = UserStats.objects.filter(num_games__gt=0).select_related('user__userinfo').exclude(user__userinfo__isnull=True)
-        base.user_lock_related_users(user_stats)
-        for stat in user_stats:
-            stat.pvp_skips = skip_cap(stat.user.userinfo)
-        UserStats.objects.bulk_update(user_stats, ['pvp_skips'])
+    user_stats = UserStats.objects.filter(num_games__gt=0).select_related('user__userinfo').exclude(user__userinfo__isnull=True)
+    run_in_chunks("reset_pvp_skips", user_stats, _reset_pvp_skips_chunk)
     update_redis_player_elos()
 
 
@@ -126,22 +185,30 @@ MAX_DAILY_DUNGEON_TICKET = 5
 MAX_DAILY_DUNGEON_GOLDEN_TICKET = 3
 
 
+# Set based increment of `field` on every row in the chunk, capped at `cap`
+def increment_chunk(field, cap=None):
+    value = F(field) + 1
+    if cap is not None:
+        value = Least(value, cap)
+
+    def process_chunk(queryset):
+        queryset.update(**{field: value})
+
+    return process_chunk
+
+
 @cron(uuid="8c7cdffd-d2bb-4fff-8a12-57666965db8c")
-@atomic
 def daily_dungeon_golden_ticket_drop():
-    to_inc = Inventory.objects.filter(daily_dungeon_golden_ticket__lt=MAX_DAILY_DUNGEON_GOLDEN_TICKET)
-    for inv in to_inc:
-        inv.daily_dungeon_golden_ticket += 1
-    Inventory.objects.bulk_update(to_inc, ['daily_dungeon_golden_ticket'])
+    run_in_chunks("daily_dungeon_golden_ticket_drop",
+                  Inventory.objects.filter(daily_dungeon_golden_ticket__lt=MAX_DAILY_DUNGEON_GOLDEN_TICKET),
+                  increment_chunk('daily_dungeon_golden_ticket', MAX_DAILY_DUNGEON_GOLDEN_TICKET))
 
 
 @cron(uuid="f7ca56fc-0970-4ba7-9b18-80fa81833e3e")
-@atomic
 def daily_dungeon_ticket_drop():
-    to_inc = Inventory.objects.filter(daily_dungeon_ticket__lt=MAX_DAILY_DUNGEON_TICKET)
-    for inv in to_inc:
-        inv.daily_dungeon_ticket += 1
-    Inventory.objects.bulk_update(to_inc, ['daily_dungeon_ticket'])
+    run_in_chunks("daily_dungeon_ticket_drop",
+                  Inventory.objects.filter(daily_dungeon_ticket__lt=MAX_DAILY_DUNGEON_TICKET),
+                  increment_chunk('daily_dungeon_ticket', MAX_DAILY_DUNGEON_TICKET))
 
 
 @cron(uuid="b843e92a-fb04-4332-831f-e086cc4ffe5e")
@@ -189,11 +256,7 @@ def update_clan_leaderboards_cron():
 
 @cron(uuid="fcdb9373-7a08-4bd6-a0ce-5070c0259f0d")
 def grass_event_token_drop_cron():
-    grass_events = GrassEvent.objects.all()
-    for event in grass_events:
-        event.tickets += 1
-
-    GrassEvent.objects.bulk_update(grass_events, ['tickets'])
+    run_in_chunks("grass_event_token_drop", GrassEvent.objects.all(), increment_chunk('tickets'))
 
 
 @cron(uuid="6732858b-80ab-4d3f-88c1-c0a45f7a629e")
@@ -412,61 +475,98 @@ def expire_creator_codes():
     CreatorCodeTracker.objects.filter(created_time__lt=expiretime).update(is_expired=True)
 
 
+# Reads and clears every hash in keys atomically, in a single round trip.
+# Returns {key: {field: int}}, empty for hashes that don't exist.
+def drain_redis_counters(r, keys):
+    pipe = r.pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+        pipe.delete(key)
+    results = pipe.execute()
+
+    return {key: {field.decode(): int(count) for field, count in counters.items()}
+            for key, counters in zip(keys, results[::2])}
+
+
+QUICKPLAY_USAGE_BUCKET_ARRAYS = {
+    'games': 'num_games_buckets',
+    'wins': 'num_wins_buckets',
+    'defense_games': 'num_defense_games_buckets',
+    'defense_wins': 'num_defense_wins_buckets',
+}
+
+
 # Regularly save quickplay usage numbers from redis to the db.
+@atomic
 def push_quickplay_usage_to_db():
     r = get_redis_connection("default")
+    all_usage = {get_redis_quickplay_usage_key(usage.char_type_id): usage
+                 for usage in BaseCharacterUsage.objects.select_for_update()}
+    all_counters = drain_redis_counters(r, list(all_usage.keys()))
+
     # Increment every base character usage object by what we have stored
-    all_usage = BaseCharacterUsage.objects.all()
-    for single_usage in all_usage:
-        redis_key = get_redis_quickplay_usage_key(single_usage.char_type.char_type)
-
-        for index in range(0, len(single_usage.num_games_buckets)):
-            redis_bucket_key = f"{redis_key}_{index}"
-            games = r.get(f"{redis_bucket_key}_games")
-            if games == 0:
-                continue
-            wins = r.get(f"{redis_bucket_key}_wins")
-            def_games = r.get(f"{redis_bucket_key}_defense_games")
-            def_wins = r.get(f"{redis_bucket_key}_defense_wins")
-            if games is not None:
-                single_usage.num_games_buckets[index] += int(games)
-            if wins is not None:
-                single_usage.num_wins_buckets[index] += int(wins)
-            if def_games is not None:
-                single_usage.num_defense_games_buckets[index] += int(def_games)
-            if def_wins is not None:
-                single_usage.num_defense_wins_buckets[index] += int(def_wins)
-            # Also clear redis after recording.
-            r.set(f"{redis_bucket_key}_games", 0)
-            r.set(f"{redis_bucket_key}_wins", 0)
-            r.set(f"{redis_bucket_key}_defense_games", 0)
-            r.set(f"{redis_bucket_key}_defense_wins", 0)
-
-    BaseCharacterUsage.objects.bulk_update(all_usage, ['num_games_buckets', 'num_wins_buckets',
-                                                       'num_defense_games_buckets', 'num_defense_wins_buckets'])
+    updated_usage = []
+    for redis_key, counters in all_counters.items():
+        if not counters:
+            continue
+
+        single_usage = all_usage[redis_key]
+        for field, count in counters.items():
+            # fields are "{bucket}_{stat}", see save_usage_into_redis
+            bucket, stat = field.split('_', 1)
+            buckets = getattr(single_usage, QUICKPLAY_USAGE_BUCKET_ARRAYS[stat])
+            if int(bucket) < len(buckets):
+                buckets[int(bucket)] += count
+        updated_usage.append(single_usage)
+
+    BaseCharacterUsage.objects.bulk_update(updated_usage, list(QUICKPLAY_USAGE_BUCKET_ARRAYS.values()))
 
 
 # Regularly save dungeon winrate numbers from redis to the db.
+@atomic
 def push_dungeon_games_to_db():
     r = get_redis_connection("default")
-    # Increment every base character usage object by what we have stored
-    all_stats = DungeonStats.objects.all()
-    for stage_stats in all_stats:
-        redis_key = get_redis_dungeon_winrate_key(stage_stats.dungeon_type, stage_stats.stage)
+    all_stats = {get_redis_dungeon_winrate_key(stage_stats.dungeon_type, stage_stats.stage): stage_stats
+                 for stage_stats in DungeonStats.objects.select_for_update()}
+    all_counters = drain_redis_counters(r, list(all_stats.keys()))
 
-        games = r.get(f"{redis_key}_games")
-        if games == 0:
+    updated_stats = []
+    for redis_key, counters in all_counters.items():
+        if not counters:
             continue
-        wins = r.get(f"{redis_key}_wins")
 
-        if games is not None:
-            stage_stats.games += int(games)
-        if wins is not None:
-            stage_stats.wins += int(wins)
-        r.set(f"{redis_key}_games", 0)
-        r.set(f"{redis_key}_wins", 0)
+        stage_stats = all_stats[redis_key]
+        stage_stats.games += counters.get('games', 0)
+        stage_stats.wins += counters.get('wins', 0)
+        updated_stats.append(stage_stats)
+
+    DungeonStats.objects.bulk_update(updated_stats, ['wins', 'games'])
+
+
+# Verifies queued receipts the store couldn't answer for, and any a web
+# worker died holding, see `playerdata.purchase_queue`
+def retry_pending_purchases_cron():
+    start_time = perf_counter()
+    retried = purchase_queue.retry_pending_purchases()
+    cron_logger("retry_pending_purchases: %d receipts in %.3fs" % (retried, perf_counter() - start_time))
+
+
+# Recounts the stored badge counts of everyone who connected today, see
+# `mainsocket.badges`
+def reconcile_badge_counts_cron():
+    r = get_redis_connection("default")
+    start_time = perf_counter()
+    user_ids = []
+    drifted = 0
+
+    for key in r.scan_iter(match=notifications.badge_counts_key('*'), count=CRON_CHUNK_SIZE):
+        user_ids.append(int(key.decode().rsplit('_', 1)[1]))
+        if len(user_ids) >= CRON_CHUNK_SIZE:
+            drifted += badges.reconcile_badge_counts(user_ids)
+            user_ids = []
+    drifted += badges.reconcile_badge_counts(user_ids)
 
-    DungeonStats.objects.bulk_update(all_stats, ['wins', 'games'])
+    cron_logger("reconcile_badge_counts: corrected %d users in %.3fs" % (drifted, perf_counter() - start_time))
 
 
 # We will automatically simulate reported matches.
@@ -487,7 +587,7 @@ def process_hacker_alerts():
             report.skip_simulation = True
             updated_reports.append(report)
             continue
-        if ServerStatus.latest_version() != reported_match.version:
+        if server.latest_version() != reported_match.version:
             report.skip_simulation = True
             updated_reports.append(report)
             continue
@@ -1,10 +1,11 @@
 import math
 import collections
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, JsonResponse
 
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from battlegame.figures import *
+from playerdata import constants, server, statusupdate
 from playerdata.admin import HackerAlertAdmin, UserInfoAdmin, BaseCharacterUsageAdmin, DungeonStatsAdmin
 from playerdata.models import *
 
@@ -138,22 +139,17 @@ def get_single_character_stat_changes(p, a):
 # Mostly duplicate of equivalent action in admin tool, but changed for formatting output.  Can't reuse this in admin because of a circular import.
 def get_character_ability_changes(v=None):
     if v is None:
-        v = ServerStatus.latest_version()
+        v = server.latest_version()
     changed = BaseCharacterAbility2.objects.filter(version=v)
 
-    previous = {}
-    for a in BaseCharacterAbility2.objects.all():
-        if version.parse(a.version) >= version.parse(v):
-            continue
-        if a.char_type not in previous or version.parse(a.version) > version.parse(previous[a.char_type].version):
-            previous[a.char_type] = a
+    previous = {p.char_type_id: p for p in base_character_ability_index.active_under_version(v, inclusive=False)}
 
     changes = {}
     for a in changed:
-        if a.char_type not in previous:
+        if a.char_type_id not in previous:
             changes[a.char_type.name] = ['NEW CHARACTER: %s' % a.char_type.name]
         else:
-            p = previous[a.char_type]
+            p = previous[a.char_type_id]
             char_diff = get_single_character_ability_changes(p, a)
             if char_diff is None:
                 continue
@@ -164,22 +160,17 @@ def get_character_ability_changes(v=None):
 # Mostly duplicate of equivalent action in admin tool, but changed for formatting output.  Can't reuse this in admin because of a circular import.
 def get_character_stat_changes(v=None):
     if v is None:
-        v = ServerStatus.latest_version()
+        v = server.latest_version()
     changed = BaseCharacterStats.objects.filter(version=v)
 
-    previous = {}
-    for a in BaseCharacterStats.objects.all():
-        if version.parse(a.version) >= version.parse(v):
-            continue
-        if a.char_type not in previous or version.parse(a.version) > version.parse(previous[a.char_type].version):
-            previous[a.char_type] = a
+    previous = {p.char_type_id: p for p in base_character_stats_index.active_under_version(v, inclusive=False)}
 
     changes = {}
     for a in changed:
-        if a.char_type not in previous:
+        if a.char_type_id not in previous:
             changes[a.char_type.name] = ['NEW CHARACTER: %s' % a.char_type.name]
         else:
-            p = previous[a.char_type]
+            p = previous[a.char_type_id]
             char_diff = get_single_character_stat_changes(p, a)
             if char_diff is None:
                 continue
@@ -225,6 +216,56 @@ def get_base_character_usage_view(request):
     return BaseCharacterUsageAdmin.generate_base_character_usage_report(BaseCharacterUsageAdmin, request, BaseCharacterUsage.objects.all())
 
 
+def win_rate(wins, games):
+    return wins / games if games > 0 else None
+
+
+# Flushed usage from the db plus what's still pending in redis, per character
+# and elo bucket
+def get_live_usage(char_types=None):
+    all_usage = BaseCharacterUsage.objects.select_related('char_type')
+    if char_types:
+        all_usage = all_usage.filter(char_type_id__in=char_types)
+    all_usage = list(all_usage)
+    pending_usage = statusupdate.get_pending_quickplay_usage([usage.char_type_id for usage in all_usage])
+
+    live_usage = {}
+    for usage in all_usage:
+        pending = pending_usage[usage.char_type_id]
+        buckets = []
+        for bucket in range(len(usage.num_games_buckets)):
+            games = usage.num_games_buckets[bucket] + pending.get(f"{bucket}_games", 0)
+            wins = usage.num_wins_buckets[bucket] + pending.get(f"{bucket}_wins", 0)
+            defense_games = usage.num_defense_games_buckets[bucket] + pending.get(f"{bucket}_defense_games", 0)
+            defense_wins = usage.num_defense_wins_buckets[bucket] + pending.get(f"{bucket}_defense_wins", 0)
+            if games == 0 and defense_games == 0:
+                continue
+
+            buckets.append({'bucket': bucket,
+                            'min_elo': bucket * constants.USAGE_BUCKET_ELO_SIZE,
+                            'games': games,
+                            'wins': wins,
+                            'win_rate': win_rate(wins, games),
+                            'defense_games': defense_games,
+                            'defense_wins': defense_wins,
+                            'defense_win_rate': win_rate(defense_wins, defense_games)})
+
+        live_usage[usage.char_type_id] = {'name': usage.char_type.name, 'buckets': buckets}
+    return live_usage
+
+
+# Filter with ?char_type=1&char_type=2
+@login_required(login_url='/admin/')
+def get_live_usage_view(request):
+    if not request.user.is_superuser:
+        return HttpResponse()
+    try:
+        char_types = [int(char_type) for char_type in request.GET.getlist('char_type')]
+    except ValueError:
+        return JsonResponse({'status': False, 'reason': 'char_type must be an integer'}, status=400)
+    return JsonResponse(get_live_usage(char_types))
+
+
 @login_required(login_url='/admin/')
 def get_graph_view(request, name=None):
     if not request.user.is_superuser:
@@ -248,7 +289,7 @@ def get_hacker_report_view(request):
 
 @login_required(login_url='/admin/')
 def get_latest_character_changes_view(request):
-    return get_character_changes_view(request, v=ServerStatus.latest_version())
+    return get_character_changes_view(request, v=server.latest_version())
 
 
 @login_required(login_url='/admin/')
@@ -4,7 +4,7 @@ import secrets
 from django.contrib.auth import get_user_model
 from django.db import transaction
 
-from playerdata import formulas, matcher, rolls, leaderboards, grass_event, level_booster
+from playerdata import bulk_insert, formulas, matcher, rolls, leaderboards, grass_event, level_booster
 from playerdata.models import *
 from playerdata.questupdater import QuestUpdater
 
@@ -218,19 +218,17 @@ def backfill_rotating_mode():
 
 
 # Send an inbox message to userid_list
-# if userid_list = ['all'] then it sends to all users
+# if userid_list = ['all'] then it's sent as a single BroadcastMail, for everyone who has an account now
 #
 # Usage:
 # > python manage.py shell_plus
 #
 # > send_inbox("Welcome", "heya welcome to the game!", [349, 348])  # Sends a basic mail to the userid_list inboxes
 # > send_inbox("Welcome","heya welcome to the game!", ['all'], 500) # Sends mail to all users and also creates a gem reward of 500
-
-@transaction.atomic
+#
+# Mails to a list are written in batches that commit on their own, progress
+# is printed with the last user id written.
 def send_inbox(title, message, userid_list, gems=0, sender_id=10506):
-    if userid_list == ['all']:
-        userid_list = User.objects.values_list('id', flat=True)
-
     basecode = None
     if gems != 0:
         curr_time = datetime.now(timezone.utc)
@@ -240,21 +238,34 @@ def send_inbox(title, message, userid_list, gems=0, sender_id=10506):
 
     sender = User.objects.get(id=sender_id)
     pfp_id = sender.userinfo.profile_picture
+
+    if userid_list == ['all']:
+        BroadcastMail.objects.create(title=title, message=message, sender_id=sender_id,
+                                     code=basecode, sender_profile_picture_id=pfp_id)
+        return
+
     has_unclaimed_reward = basecode is not None
+    last_userid = None
+
+    def mails():
+        nonlocal last_userid
+        for userid in userid_list:
+            last_userid = userid
+            yield Mail(title=title, message=message,
+                       sender_id=sender_id, receiver_id=userid,
+                       code=basecode, sender_profile_picture_id=pfp_id,
+                       has_unclaimed_reward=has_unclaimed_reward)
 
-    mails = []
-    for userid in userid_list:
-        mails.append(Mail(title=title, message=message,
-                          sender_id=sender_id, receiver_id=userid,
-                          code=basecode, sender_profile_picture_id=pfp_id,
-                          has_unclaimed_reward=has_unclaimed_reward))
+    def report(rows_written, elapsed):
+        print("send_inbox: %d mails in %.1fs, last user id %s" % (rows_written, elapsed, last_userid))
 
-    Mail.objects.bulk_create(mails)
+    bulk_insert.copy_bulk_create(Mail, mails(), report=report)
 
 
 @transaction.atomic
 def generate_bots_bulk(start_elo, end_elo, num_bots_per_elo_range):
     matcher.generate_bots_bulk(start_elo, end_elo, num_bots_per_elo_range)
+    update_redis_player_elos()
 
 
 # Creates a test user account with full resources and all characters
@@ -373,6 +384,13 @@ def update_redis_player_elos():
 
     leaderboards.bulk_update_redis_ranking(users_dict, leaderboards.pvp_ranking_key())
 
+    bots_dict = {}
+    for userinfo in UserInfo.objects.filter(is_bot=True):
+        bots_dict[userinfo.user_id] = userinfo.elo
+
+    if bots_dict:
+        leaderboards.bulk_update_redis_ranking(bots_dict, leaderboards.pvp_bot_ranking_key())
+
 
 @transaction.atomic()
 def reset_grass_event():
@@ -31,6 +31,11 @@ DEBUG = config('DEVELOPMENT', False)
 
 SERVICE_ACCOUNT_FILE = '/home/battlegame/battlegame/.google-service-account.json'
 
+# Receipt validation endpoints, pointed at a fake store in tests
+GOOGLE_DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/androidpublisher/v3/rest'
+APPLE_VERIFY_RECEIPT_URL = 'https://buy.itunes.apple.com/verifyReceipt'
+APPLE_SANDBOX_VERIFY_RECEIPT_URL = 'https://sandbox.itunes.apple.com/verifyReceipt'
+
 DEVELOPMENT = config('DEVELOPMENT', False)
 
 ALLOWED_HOSTS = ['salutationstudio.com', 'www.salutationstudio.com', 'localhost']
@@ -174,10 +179,14 @@ STATICFILES_DIRS = [
 ]
 
 
+# Resets process-wide caches between tests
+TEST_RUNNER = 'battlegame.test_runner.TestRunner'
+
+
 # Rest framework files
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'playerdata.authentication.CachedTokenAuthentication',
     ],
 }
 
@@ -226,6 +235,12 @@ CRONJOBS = [
 
     # Hourly at HH:02
     ('2 * * * *', 'battlegame.cron.process_hacker_alerts', '>> /tmp/process_hacker_alerts.log'),
+
+    # Hourly at HH:30
+    ('30 * * * *', 'battlegame.cron.reconcile_badge_counts_cron', '>> /tmp/reconcile_badge_counts_cron.log'),
+
+    # Every minute
+    ('* * * * *', 'battlegame.cron.retry_pending_purchases_cron', '>> /tmp/retry_pending_purchases_cron.log'),
 ]
 
 # Monitoring
@@ -0,0 +1,39 @@
+import unittest
+
+from django.test.runner import DiscoverRunner, ParallelTestSuite, RemoteTestResult, RemoteTestRunner
+
+from playerdata.config_cache import ConfigCache
+
+
+class ConfigCacheResetResultMixin:
+    """Empties every ConfigCache around each test. A TestCase rolls its rows
+    back, but values cached from them would otherwise outlive it."""
+
+    def startTest(self, test):
+        ConfigCache.invalidate_all()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        ConfigCache.invalidate_all()
+
+
+class ConfigCacheResetRemoteTestResult(ConfigCacheResetResultMixin, RemoteTestResult):
+    pass
+
+
+class ConfigCacheResetRemoteTestRunner(RemoteTestRunner):
+    resultclass = ConfigCacheResetRemoteTestResult
+
+
+# --parallel runs tests in worker processes, each with its own caches
+class ConfigCacheResetParallelTestSuite(ParallelTestSuite):
+    runner_class = ConfigCacheResetRemoteTestRunner
+
+
+class TestRunner(DiscoverRunner):
+    parallel_test_suite = ConfigCacheResetParallelTestSuite
+
+    def get_resultclass(self):
+        resultclass = super().get_resultclass() or unittest.TextTestResult
+        return type('ConfigCacheReset' + resultclass.__name__, (ConfigCacheResetResultMixin, resultclass), {})
@@ -1,17 +1,17 @@
 from channels.auth import AuthMiddlewareStack
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, User
 import rest_framework.exceptions
-from rest_framework.authtoken.models import Token
+
+from playerdata.authentication import get_user_id_for_token
 
 
 @database_sync_to_async
 def get_user(token_key):
-    try:
-        token = Token.objects.get(key=token_key)
-        return token.user
-    except Token.DoesNotExist:
+    user_id = get_user_id_for_token(token_key)
+    if user_id is None:
         return AnonymousUser()
+    return User.objects.filter(id=user_id).first() or AnonymousUser()
 
 
 class TokenAuthMiddleware:
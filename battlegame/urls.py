@@ -27,6 +27,7 @@ from playerdata import moevasion
 from playerdata import matcher
 from playerdata import statusupdate
 from playerdata import purchases
+from playerdata import purchase_queue
 from playerdata import social
 from playerdata import dungeon
 from playerdata import quest
@@ -179,6 +180,8 @@ urlpatterns = [
     path('purchase/collectbonus/', purchases.CollectBonusGems.as_view()),
     path('purchase/cancel/sub/', purchases.CancelSubscriptionView.as_view()),
     path('validate/', purchases.ValidateView.as_view()),
+    path('validate/queue/', purchase_queue.QueueValidateView.as_view()),
+    path('validate/queue/<int:pending_id>', purchase_queue.PendingPurchaseView.as_view()),
     path('purchaseitem/', purchases.PurchaseItemView.as_view()),
     path('purchase/', purchases.PurchaseView.as_view()),
     path('deals/', purchases.GetDeals.as_view()),
@@ -232,6 +235,7 @@ urlpatterns = [
     path('stats/graph/<str:name>', gameanalytics.get_graph_view),
     path('stats/defensereport/', gameanalytics.get_defense_placement_report_view),
     path('stats/baseusagereport/', gameanalytics.get_base_character_usage_view),
+    path('stats/liveusage/', gameanalytics.get_live_usage_view),
     path('stats/dungeonreport/', gameanalytics.get_dungeon_table_view),
     path('stats/hackerreport/', gameanalytics.get_hacker_report_view),
     path('stats/progressreport/', gameanalytics.get_player_progress_by_level_report),
@@ -1,23 +1,18 @@
 # chat/consumers.py
 import json
 from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
-from rest_marshmallow import Schema, fields
-from better_profanity import profanity
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
+from django.utils.dateparse import parse_datetime
 
 from playerdata import constants
 from playerdata.models import ChatMessage
 from playerdata.models import Chat
 from playerdata.models import ChatLastReadMessage
+from playerdata.profanity_filter import profanity
 from playerdata.questupdater import QuestUpdater
-
-profanity.load_censor_words(whitelist_words=['omg', 'omfg', 'lmao', 'lmfao', 'god', 'goddamn', 'goddammit', 'goddamned',
-                                             'pee', 'poop', 'suck', 'sucked', 'crap', 'turd', 'piss', 'ugly', 'vulgar',
-                                             'womb', 'virgin', 'retard', 'moron', 'doofus', 'dummy', 'douche',
-                                             'douchebag', 'gay', 'lesbian', 'damn', 'fart', 'fat', 'hell', 'quicky',
-                                             'sexual', 'wtf', 'kill', 'jerk', 'vomit', 'vulgar', 'vodka', 'wang',
-                                             'weirdo', 'xx', 'xxx', 'urinal', 'urine', 'unwed', 'thug', 'stupid',
-                                             'strip', 'steamy', 'sissy', 'seduce', 'pot'])
+from .history import MessageSchema, get_recent_messages, push_chat_history
+from .writer import PendingMessage, chat_writer
 
 
 def censor_referral(message: str):
@@ -30,14 +25,41 @@ def censor_referral(message: str):
     return message
 
 
-class MessageSchema(Schema):
-    message = fields.Str()
-    # TODO: this is quite expensive, should not be in here
-    sender = fields.Str(attribute='sender.userinfo.name')
-    sender_id = fields.Int(attribute='sender_id')
-    sender_profile_picture_id = fields.Int(attribute='sender_profile_picture_id')
-    time_send = fields.DateTime()
-    replay_id = fields.Int(attribute='replay_id')
+def clean_message(message: str):
+    return censor_referral(profanity.censor(message))
+
+
+# Returns the `msgs` response for a history request. The first page comes
+# from the cached recent history, older pages from the db.
+def get_message_history(chat, user, latest_timestamp):
+    if not latest_timestamp:
+        msgs = get_recent_messages(chat.id)
+    else:
+        old_message_set = ChatMessage.objects.filter(chat=chat, time_send__lt=latest_timestamp) \
+                              .order_by('-time_send').select_related('sender__userinfo')[:30]
+        msgs = MessageSchema(old_message_set, many=True).data
+
+    last_read_msg = ChatLastReadMessage.objects.filter(chat=chat, user=user).first()
+
+    if not last_read_msg:
+        show_badge = 'true'
+    elif not msgs:
+        show_badge = 'false'
+    else:
+        show_badge = not latest_timestamp and (parse_datetime(msgs[0]['time_send']) > last_read_msg.time_send)
+
+    return {
+        'message_type': 'msgs',
+        'msgs': msgs,
+        'show_badge': show_badge
+    }
+
+
+def set_last_read(chat, user, latest_timestamp):
+    ChatLastReadMessage.objects.update_or_create(chat=chat,
+                                                 user=user,
+                                                 defaults={"time_send": latest_timestamp}
+                                                 )
 
 
 class ChatConsumer(WebsocketConsumer):
@@ -77,8 +99,7 @@ class ChatConsumer(WebsocketConsumer):
         message_type = text_data_json['message_type']
 
         if message_type == 'msg':
-            message = profanity.censor(text_data_json['message'])
-            message = censor_referral(message)
+            message = clean_message(text_data_json['message'])
 
             pfp_id = self.user.userinfo.profile_picture
             replay_id = -1
@@ -101,6 +122,7 @@ class ChatConsumer(WebsocketConsumer):
             # save to db
             chat_message = ChatMessage.objects.create(chat=self.chat, message=message, sender=self.user,
                                                       sender_profile_picture_id=pfp_id, replay_id=replay_id)
+            push_chat_history([chat_message])
             ChatLastReadMessage.objects.update_or_create(chat=self.chat,
                                                          user=self.user,
                                                          defaults={"time_send": chat_message.time_send}
@@ -110,37 +132,10 @@ class ChatConsumer(WebsocketConsumer):
 
         elif message_type == 'req':
             latest_timestamp = text_data_json['latest_timestamp']
-
-            if not latest_timestamp:
-                old_message_set_partial = ChatMessage.objects.filter(chat=self.chat)
-            else:
-                old_message_set_partial = ChatMessage.objects.filter(chat=self.chat, time_send__lt=latest_timestamp)
-
-            old_message_set = old_message_set_partial.order_by('-time_send').select_related('sender__userinfo')[:30]
-            old_message_json = MessageSchema(old_message_set, many=True)
-
-            last_read_msg = ChatLastReadMessage.objects.filter(chat=self.chat, user=self.user).first()
-            latest_msg = old_message_set.first()
-
-            if not last_read_msg:
-                show_badge = 'true'
-            elif not latest_msg:
-                show_badge = 'false'
-            else:
-                show_badge = not latest_timestamp and (latest_msg.time_send > last_read_msg.time_send)
-
-            self.send(text_data=json.dumps({
-                'message_type': 'msgs',
-                'msgs': old_message_json.data,
-                'show_badge': show_badge
-            }))
+            self.send(text_data=json.dumps(get_message_history(self.chat, self.user, latest_timestamp)))
 
         elif message_type == 'last_read':
-            latest_timestamp = text_data_json['latest_timestamp']
-            ChatLastReadMessage.objects.update_or_create(chat=self.chat,
-                                                         user=self.user,
-                                                         defaults={"time_send": latest_timestamp}
-                                                         )
+            set_last_read(self.chat, self.user, text_data_json['latest_timestamp'])
 
     # Receive message from room group
     def chat_message(self, event):
@@ -157,3 +152,88 @@ class ChatConsumer(WebsocketConsumer):
             'sender_profile_picture_id': sender_profile_picture_id,
             'replay_id': replay_id
         }))
+
+
+class AsyncChatConsumer(AsyncWebsocketConsumer):
+    """ChatConsumer that fans messages out as soon as they arrive and leaves
+    saving them to chat_writer, so a busy room doesn't hold up the worker."""
+
+    @database_sync_to_async
+    def load_chat(self):
+        self.chat = Chat.objects.filter(id=int(self.room_name)).first()
+        if self.chat:
+            self.sender_name = self.user.userinfo.name
+            self.sender_profile_picture_id = self.user.userinfo.profile_picture
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        self.room_group_name = 'chat_%s' % self.room_name
+
+        if not self.room_name.isdigit():
+            raise Exception('<h1>room ' + self.room_name + ' must be an int</h1>')
+
+        await self.load_chat()
+        if not self.chat:
+            raise Exception('<h1>room ' + self.room_name + ' not found</h1>')
+
+        # Join room group
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        # Leave room group
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
+        )
+
+    # Receive message from WebSocket
+    async def receive(self, text_data):
+        text_data_json = json.loads(text_data)
+        message_type = text_data_json['message_type']
+
+        if message_type == 'msg':
+            message = clean_message(text_data_json['message'])
+            replay_id = text_data_json.get('replay_id', -1)
+
+            # Send message to room group
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'chat_message',
+                    'message': message,
+                    'sender_id': self.user.id,
+                    'sender': self.sender_name,
+                    'sender_profile_picture_id': self.sender_profile_picture_id,
+                    'replay_id': replay_id
+                }
+            )
+
+            chat_writer.put(PendingMessage(
+                ChatMessage(chat=self.chat, message=message, sender=self.user,
+                            sender_profile_picture_id=self.sender_profile_picture_id, replay_id=replay_id),
+                self.user))
+
+        elif message_type == 'req':
+            latest_timestamp = text_data_json['latest_timestamp']
+            history = await database_sync_to_async(get_message_history)(self.chat, self.user, latest_timestamp)
+            await self.send(text_data=json.dumps(history))
+
+        elif message_type == 'last_read':
+            await database_sync_to_async(set_last_read)(self.chat, self.user, text_data_json['latest_timestamp'])
+
+    # Receive message from room group
+    async def chat_message(self, event):
+        # Send message to WebSocket
+        await self.send(text_data=json.dumps({
+            'message': event['message'],
+            'sender_id': event['sender_id'],
+            'sender': event['sender'],
+            'sender_profile_picture_id': event['sender_profile_picture_id'],
+            'replay_id': event['replay_id']
+        }))
@@ -0,0 +1,88 @@
+# chat/history.py
+import json
+
+from django.db import transaction
+from django_redis import get_redis_connection
+from rest_marshmallow import Schema, fields
+
+from playerdata.models import ChatMessage
+
+CHAT_HISTORY_SIZE = 30
+CHAT_HISTORY_EXPIRY_SECONDS = 86400
+
+# Only pushes onto a room that's already cached, so a partial list is never
+# mistaken for the full recent history. Bumping the version stops a reader
+# that queried before these messages were saved from caching its old page.
+PUSH_CHAT_HISTORY_LUA = """
+redis.call('INCR', KEYS[2])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('LPUSH', KEYS[1], unpack(ARGV, 3))
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+FILL_CHAT_HISTORY_LUA = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if #ARGV > 2 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+class MessageSchema(Schema):
+    message = fields.Str()
+    # TODO: this is quite expensive, should not be in here
+    sender = fields.Str(attribute='sender.userinfo.name')
+    sender_id = fields.Int(attribute='sender_id')
+    sender_profile_picture_id = fields.Int(attribute='sender_profile_picture_id')
+    time_send = fields.DateTime()
+    replay_id = fields.Int(attribute='replay_id')
+
+
+def chat_history_key(chat_id):
+    return "chat_history_%d" % chat_id
+
+
+def chat_history_version_key(chat_id):
+    return "chat_history_version_%d" % chat_id
+
+
+# Adds saved messages, oldest first, to their room's cached history once the
+# current transaction commits
+def push_chat_history(messages):
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(json.dumps(MessageSchema(message).data))
+
+    def push():
+        r = get_redis_connection("default")
+        push_script = r.register_script(PUSH_CHAT_HISTORY_LUA)
+        for chat_id, serialized in by_chat.items():
+            push_script(keys=[chat_history_key(chat_id), chat_history_version_key(chat_id)],
+                        args=[CHAT_HISTORY_SIZE, CHAT_HISTORY_EXPIRY_SECONDS] + serialized)
+
+    transaction.on_commit(push)
+
+
+def get_recent_messages(chat_id):
+    """The last CHAT_HISTORY_SIZE messages in a room, serialized with
+    MessageSchema, newest first."""
+    r = get_redis_connection("default")
+    cached = r.lrange(chat_history_key(chat_id), 0, CHAT_HISTORY_SIZE - 1)
+    if cached:
+        return [json.loads(message) for message in cached]
+
+    version = r.get(chat_history_version_key(chat_id)) or b''
+    messages = ChatMessage.objects.filter(chat_id=chat_id).order_by('-time_send').select_related('sender__userinfo')[:CHAT_HISTORY_SIZE]
+    serialized = MessageSchema(messages, many=True).data
+
+    fill_script = r.register_script(FILL_CHAT_HISTORY_LUA)
+    fill_script(keys=[chat_history_key(chat_id), chat_history_version_key(chat_id)],
+                args=[version, CHAT_HISTORY_EXPIRY_SECONDS] + [json.dumps(message) for message in serialized])
+    return serialized
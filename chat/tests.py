@@ -1,3 +1,117 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django_redis import get_redis_connection
+
+from chat import history, routing
+from chat.writer import ChatWriter, PendingMessage, write_messages
+from playerdata.models import Chat, ChatLastReadMessage, ChatMessage, User
+
+
+class WriteMessagesTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.chat = Chat.objects.get(id=1)
+
+    def pending(self, message):
+        return PendingMessage(ChatMessage(chat=self.chat, message=message, sender=self.u), self.u)
+
+    def test_write_batch(self):
+        num_messages = ChatMessage.objects.filter(chat=self.chat).count()
+        ChatLastReadMessage.objects.filter(chat=self.chat, user=self.u).delete()
+
+        write_messages([self.pending('hi'), self.pending('hello')])
+
+        self.assertEqual(ChatMessage.objects.filter(chat=self.chat).count(), num_messages + 2)
+        latest = ChatMessage.objects.filter(chat=self.chat, sender=self.u).latest('time_send')
+        last_read = ChatLastReadMessage.objects.get(chat=self.chat, user=self.u)
+        self.assertEqual(last_read.time_send, latest.time_send)
+
+    def test_updates_last_read(self):
+        write_messages([self.pending('hi')])
+        first_read = ChatLastReadMessage.objects.get(chat=self.chat, user=self.u).time_send
+
+        write_messages([self.pending('hello')])
+        self.assertGreater(ChatLastReadMessage.objects.get(chat=self.chat, user=self.u).time_send, first_read)
+
+
+# database_sync_to_async runs on another thread, so the writes have to be committed
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatWriterTestCase(TransactionTestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        router = URLRouter(routing.websocket_urlpatterns)
+        self.application = lambda scope: router(dict(scope, user=self.u))
+
+    async def send_message(self, writer, message):
+        communicator = WebsocketCommunicator(self.application, '/ws/chat/1/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        await communicator.send_json_to({'message_type': 'msg', 'message': message})
+        self.assertEqual((await communicator.receive_json_from())['message'], message)
+
+        saved = database_sync_to_async(ChatMessage.objects.filter(chat_id=1, message=message).exists)
+        for _ in range(50):
+            if await saved():
+                break
+            await asyncio.sleep(0.1)
+
+        await communicator.disconnect()
+        writer.task.cancel()
+
+    def test_retries_failed_batch(self):
+        attempts = []
+
+        def flaky_write(pending):
+            attempts.append(len(pending))
+            if len(attempts) == 1:
+                raise OperationalError('deadlock detected')
+            write_messages(pending)
+
+        writer = ChatWriter()
+        with mock.patch('chat.consumers.chat_writer', writer), \
+                mock.patch('chat.writer.write_messages', flaky_write), \
+                mock.patch('chat.writer.FLUSH_DELAY_SECONDS', 0), \
+                mock.patch('chat.writer.WRITE_RETRY_DELAYS_SECONDS', (0,)):
+            async_to_sync(self.send_message)(writer, 'hello from the socket')
+
+        self.assertEqual(attempts, [1, 1])
+        self.assertEqual(ChatMessage.objects.filter(chat_id=1, sender=self.u, message='hello from the socket').count(), 1)
+
+
+class RecentMessagesTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.r = get_redis_connection("default")
+        self.r.delete(history.chat_history_key(1), history.chat_history_version_key(1))
+
+    def tearDown(self):
+        self.r.delete(history.chat_history_key(1), history.chat_history_version_key(1))
+
+    def test_cached_first_page(self):
+        messages = history.get_recent_messages(1)
+        self.assertEqual(len(messages), min(history.CHAT_HISTORY_SIZE, ChatMessage.objects.filter(chat_id=1).count()))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(history.get_recent_messages(1), messages)
+
+    def test_stale_fill_rejected(self):
+        version = self.r.get(history.chat_history_version_key(1)) or b''
+        self.r.incr(history.chat_history_version_key(1))
+
+        fill_script = self.r.register_script(history.FILL_CHAT_HISTORY_LUA)
+        self.assertEqual(fill_script(keys=[history.chat_history_key(1), history.chat_history_version_key(1)],
+                                     args=[version, history.CHAT_HISTORY_EXPIRY_SECONDS, '{}']), 0)
+        self.assertFalse(self.r.exists(history.chat_history_key(1)))
@@ -0,0 +1,108 @@
+# chat/writer.py
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
+
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.db import transaction
+from prometheus_client import Gauge
+from sentry_sdk import capture_exception
+
+from playerdata import constants
+from playerdata.models import ChatLastReadMessage, ChatMessage
+from playerdata.questupdater import QuestUpdater
+from .history import push_chat_history
+
+GLOBAL_CHAT_ID = 1
+MAX_BATCH_SIZE = 200
+# Waiting a little after the first message lets a burst land in one batch
+FLUSH_DELAY_SECONDS = 0.5
+# Waits between attempts at saving a batch before it's dropped
+WRITE_RETRY_DELAYS_SECONDS = (1, 5, 15)
+
+chat_write_queue_depth = Gauge('chat_write_queue_depth', 'Chat messages sent but not yet saved to the db')
+
+
+@dataclass
+class PendingMessage:
+    chat_message: ChatMessage  # unsaved
+    sender: User
+
+
+def write_messages(pending):
+    """Saves a batch of sent messages, moves each sender's last read time up
+    to their newest message and counts the global ones towards quests, in one
+    transaction so a failed batch can be written again."""
+    with transaction.atomic():
+        messages = ChatMessage.objects.bulk_create([p.chat_message for p in pending])
+
+        # bulk_create fills in time_send, latest wins
+        last_read_times = {(m.chat_id, m.sender_id): m.time_send for m in messages}
+        existing = ChatLastReadMessage.objects.select_for_update().filter(
+            chat_id__in={chat_id for chat_id, _ in last_read_times},
+            user_id__in={user_id for _, user_id in last_read_times})
+
+        updated = []
+        for last_read in existing:
+            time_send = last_read_times.pop((last_read.chat_id, last_read.user_id), None)
+            if time_send is not None:
+                last_read.time_send = time_send
+                updated.append(last_read)
+        ChatLastReadMessage.objects.bulk_update(updated, ['time_send'])
+        ChatLastReadMessage.objects.bulk_create([ChatLastReadMessage(chat_id=chat_id, user_id=user_id, time_send=time_send)
+                                                 for (chat_id, user_id), time_send in last_read_times.items()])
+        push_chat_history(messages)
+
+        senders = {p.sender.id: p.sender for p in pending}
+        global_counts = Counter(p.sender.id for p in pending if p.chat_message.chat_id == GLOBAL_CHAT_ID)
+        for user_id, count in global_counts.items():
+            QuestUpdater.add_progress_by_type(senders[user_id], constants.SEND_CHAT_MSG_GLOBAL, count)
+
+
+class ChatWriter:
+    """Write-behind persistence for AsyncChatConsumer.
+
+    Messages are queued in memory and saved in batches by a task on the
+    consumer's event loop, so a burst in global chat costs a handful of
+    inserts instead of a transaction per message. A batch that fails to save
+    is retried a few times before it's dropped. Anything still queued when
+    the process exits is lost, the messages were already delivered.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.task = None
+
+    def put(self, pending: PendingMessage):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+        self.queue.put_nowait(pending)
+        chat_write_queue_depth.set(self.queue.qsize())
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(FLUSH_DELAY_SECONDS)
+            while len(batch) < MAX_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            chat_write_queue_depth.set(self.queue.qsize())
+
+            await self.write(batch)
+
+    async def write(self, batch):
+        for delay in WRITE_RETRY_DELAYS_SECONDS + (None,):
+            try:
+                await database_sync_to_async(write_messages)(batch)
+                return
+            except Exception as e:
+                if delay is None:
+                    capture_exception(e)
+                    return
+                await asyncio.sleep(delay)
+
+
+chat_writer = ChatWriter()
@@ -0,0 +1,51 @@
+from django.contrib.auth.models import User
+
+from mainsocket import notifications
+from playerdata import constants, event_times, questupdater, regal_rewards
+
+# The badges sent on connect, in order
+BADGE_COUNTERS = {
+    constants.NotificationType.DAILY_QUEST.value: questupdater.DailyBadgeNotifCount(),
+    constants.NotificationType.WEEKLY_QUEST.value: questupdater.WeeklyBadgeNotifCount(),
+    constants.NotificationType.CUMULATIVE_QUEST.value: questupdater.CumulativeBadgeNotifCount(),
+    constants.NotificationType.GRASS_EVENT.value: event_times.GrassEventBadgeNotifCount(),
+    constants.NotificationType.REGAL_REWARDS.value: regal_rewards.RegalRewardsBadgeNotifCount(),
+}
+
+
+def count_badge_notifs(user, notif_types):
+    return [BADGE_COUNTERS[notif_type].get_badge_notif(user) for notif_type in notif_types]
+
+
+def get_badge_notifs(user):
+    """The current badge counts for `user`, read from redis with anything
+    missing recounted from the db and stored for next time."""
+    version, counts = notifications.get_badge_counts(user.id)
+
+    missing = [notif_type for notif_type in BADGE_COUNTERS if notif_type not in counts]
+    if missing:
+        recounted = count_badge_notifs(user, missing)
+        notifications.fill_badge_counts(user.id, version, recounted)
+        counts.update({badge_notif.notif_type: badge_notif.amount for badge_notif in recounted})
+
+    return [notifications.BadgeNotif(notif_type, counts[notif_type]) for notif_type in BADGE_COUNTERS]
+
+
+def reconcile_badge_counts(user_ids):
+    """Recounts every badge for users with stored counts, correcting drift
+    from writes that skipped the invalidation or raced a recount. Returns the
+    number of users whose stored counts were wrong."""
+    users = User.objects.select_related('regalrewards').filter(id__in=user_ids)
+
+    drifted = 0
+    for user in users:
+        version, counts = notifications.get_badge_counts(user.id)
+        if not counts:
+            continue
+
+        recounted = count_badge_notifs(user, BADGE_COUNTERS)
+        if any(counts.get(badge_notif.notif_type) != badge_notif.amount for badge_notif in recounted):
+            drifted += 1
+            notifications.fill_badge_counts(user.id, version, recounted)
+    return drifted
+
@@ -3,16 +3,21 @@ import json
 
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer
-from mainsocket import notifications
-from playerdata import questupdater, event_times, world_pack, constants, regal_rewards
+from django.contrib.auth.models import User
+
+from mainsocket import badges, notifications
+from playerdata import world_pack, constants
 
 
 # Channel group is the user_id
 # Only 1 channel per group, but this is still the convention since group names
 # are user defined, channel id's are auto generated and un-gettable
 class MainSocketConsumer(WebsocketConsumer):
+    # everything connect reads off the user, loaded in one query
+    preload_related = ('worldpack', 'wishlist', 'levelbooster', 'storymode', 'dungeonprogress', 'regalrewards')
+
     def connect(self):
-        self.user = self.scope["user"]
+        self.user = User.objects.select_related(*self.preload_related).get(id=self.scope["user"].id)
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = notifications.notif_channel_group_name(self.room_name)
 
@@ -25,13 +30,7 @@ class MainSocketConsumer(WebsocketConsumer):
         self.accept()
 
         # Send current notification badge counts
-        notifications.send_badge_notifs_replace(self.user.id,
-                                                questupdater.DailyBadgeNotifCount().get_badge_notif(self.user),
-                                                questupdater.WeeklyBadgeNotifCount().get_badge_notif(self.user),
-                                                questupdater.CumulativeBadgeNotifCount().get_badge_notif(self.user),
-                                                event_times.GrassEventBadgeNotifCount().get_badge_notif(self.user),
-                                                regal_rewards.RegalRewardsBadgeNotifCount().get_badge_notif(self.user),
-                                                )
+        notifications.send_badge_notifs_replace(self.user.id, *badges.get_badge_notifs(self.user))
 
         if world_pack.show_world_pack_popup(self.user):
             self.poll_server('show_worldpack', {})
@@ -69,6 +68,13 @@ class MainSocketConsumer(WebsocketConsumer):
             'data': event['data']
         }))
 
+    # a queued purchase was verified, the data is its PendingPurchaseSchema
+    def purchase_complete(self, event):
+        self.send(text_data=json.dumps({
+            'message_type': 'purchase_complete',
+            'data': event['data']
+        }))
+
     # Sends a message to client to perform/check something
     def poll_server(self, poll_type, data):
         self.send(text_data=json.dumps({
@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.db import transaction
+from django_redis import get_redis_connection
 from rest_marshmallow import Schema, fields
 
 
@@ -28,6 +31,91 @@ def notif_channel_group_name(user_id):
     return 'notif_%s' % user_id
 
 
+# Badge counts are kept in a redis hash per user, notif_type -> amount, so a
+# reconnecting client doesn't recount them. Types missing from the hash are
+# recounted on connect, see `mainsocket.badges`. Every change bumps `version`,
+# and a recount is only stored if nothing changed while it was running.
+BADGE_COUNTS_VERSION_FIELD = 'version'
+
+# Only moves counts that are already stored, a missing type is recounted in full
+INCR_BADGE_COUNTS_LUA = """
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+for i = 2, #ARGV, 2 do
+    if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+        redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+"""
+
+INVALIDATE_BADGE_COUNTS_LUA = """
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HDEL', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+"""
+
+FILL_BADGE_COUNTS_LUA = """
+if (redis.call('HGET', KEYS[1], 'version') or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIREAT', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def badge_counts_key(user_id):
+    return 'badge_counts_%s' % user_id
+
+
+# Quests, regal rewards and event tokens are all reset by the crons at 0 UTC
+def badge_counts_expire_at():
+    tomorrow = datetime.now(timezone.utc).date() + timedelta(days=1)
+    return int(datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=timezone.utc).timestamp())
+
+
+# Returns (version, {notif_type: amount}) for the stored counts
+def get_badge_counts(user_id):
+    stored = get_redis_connection("default").hgetall(badge_counts_key(user_id))
+    version = stored.pop(BADGE_COUNTS_VERSION_FIELD.encode(), b'')
+    return version, {int(notif_type): int(amount) for notif_type, amount in stored.items()}
+
+
+# Stores recounted badge notifs, unless the counts changed since `version` was read
+def fill_badge_counts(user_id, version, badge_notifs):
+    if len(badge_notifs) == 0:
+        return False
+
+    r = get_redis_connection("default")
+    fill_script = r.register_script(FILL_BADGE_COUNTS_LUA)
+    args = [version, badge_counts_expire_at()]
+    for badge_notif in badge_notifs:
+        args += [badge_notif.notif_type, badge_notif.amount]
+    return fill_script(keys=[badge_counts_key(user_id)], args=args) == 1
+
+
+def incr_badge_counts(user_id, badge_notifs):
+    r = get_redis_connection("default")
+    incr_script = r.register_script(INCR_BADGE_COUNTS_LUA)
+    args = [badge_counts_expire_at()]
+    for badge_notif in badge_notifs:
+        args += [badge_notif.notif_type, badge_notif.amount]
+    incr_script(keys=[badge_counts_key(user_id)], args=args)
+
+
+# Drops stored counts that changed without a `send_badge_notifs_increment`,
+# like claims, so they're recounted on the next connect
+def invalidate_badge_counts(user_id, *notif_types):
+    def invalidate():
+        r = get_redis_connection("default")
+        invalidate_script = r.register_script(INVALIDATE_BADGE_COUNTS_LUA)
+        invalidate_script(keys=[badge_counts_key(user_id)], args=[badge_counts_expire_at()] + list(notif_types))
+
+    # again on commit, in case a connect recounted before the change landed
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
 # Sends a list of badge notifs to the websocket
 # Replaces the badge count
 def send_badge_notifs_replace(user_id, *badge_notifs):
@@ -51,6 +139,8 @@ def send_badge_notifs_increment(user_id, *badge_notifs):
     if len(badge_notifs) == 0:
         return
 
+    incr_badge_counts(user_id, badge_notifs)
+
     room_group_name = notif_channel_group_name(user_id)
     channel_layer = get_channel_layer()
 
@@ -62,3 +152,17 @@ def send_badge_notifs_increment(user_id, *badge_notifs):
             'data': BadgeNotifSchema(badge_notifs, many=True).data
         }
     )
+
+
+# Tells the client a queued receipt was verified, see playerdata/purchase_queue.py
+def send_purchase_complete(user_id, pending_purchase):
+    room_group_name = notif_channel_group_name(user_id)
+    channel_layer = get_channel_layer()
+
+    async_to_sync(channel_layer.group_send)(
+        room_group_name,
+        {
+            'type': 'purchase_complete',
+            'data': pending_purchase
+        }
+    )
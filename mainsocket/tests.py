@@ -1,3 +1,59 @@
 from django.test import TestCase
+from django_redis import get_redis_connection
 
-# Create your tests here.
+from mainsocket import badges, notifications
+from playerdata import constants
+from playerdata.models import PlayerQuestDaily, User
+
+DAILY_QUEST = constants.NotificationType.DAILY_QUEST.value
+
+
+class BadgeCountsTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.select_related('regalrewards').get(username='battlegame')
+        self.r = get_redis_connection("default")
+        self.r.delete(notifications.badge_counts_key(self.u.id))
+
+    def tearDown(self):
+        self.r.delete(notifications.badge_counts_key(self.u.id))
+
+    def daily_count(self):
+        return next(b.amount for b in badges.get_badge_notifs(self.u) if b.notif_type == DAILY_QUEST)
+
+    def test_counts_stored(self):
+        first = badges.get_badge_notifs(self.u)
+        self.assertEqual([b.notif_type for b in first], list(badges.BADGE_COUNTERS))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(badges.get_badge_notifs(self.u), first)
+
+    def test_increment(self):
+        count = self.daily_count()
+        notifications.incr_badge_counts(self.u.id, [notifications.BadgeNotif(DAILY_QUEST, 2)])
+        self.assertEqual(self.daily_count(), count + 2)
+
+    def test_claim_invalidates(self):
+        quest = PlayerQuestDaily.objects.filter(user=self.u).first()
+        quest.completed = True
+        quest.claimed = False
+        quest.save()
+        count = self.daily_count()
+
+        quest.claimed = True
+        quest.save()
+        self.assertEqual(self.daily_count(), count - 1)
+
+    def test_stale_fill_rejected(self):
+        version, _ = notifications.get_badge_counts(self.u.id)
+        notifications.incr_badge_counts(self.u.id, [notifications.BadgeNotif(DAILY_QUEST, 1)])
+
+        self.assertFalse(notifications.fill_badge_counts(self.u.id, version, [notifications.BadgeNotif(DAILY_QUEST, 5)]))
+
+    def test_reconcile(self):
+        count = self.daily_count()
+        notifications.incr_badge_counts(self.u.id, [notifications.BadgeNotif(DAILY_QUEST, 3)])
+
+        self.assertEqual(badges.reconcile_badge_counts([self.u.id]), 1)
+        self.assertEqual(self.daily_count(), count)
@@ -374,6 +374,13 @@ class PurchasedTrackerAdmin(admin.ModelAdmin):
     search_fields = ('=user__id',)
 
 
+class PendingPurchaseAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'store', 'transaction_id', 'state', 'attempts', 'creation_time')
+    list_filter = ('state', 'store')
+    search_fields = ('=user__id', 'transaction_id')
+    raw_id_fields = ('user',)
+
+
 class CreatorCodeAdmin(admin.ModelAdmin):
     search_fields = ('=user__id',)
     raw_id_fields = ('user',)
@@ -460,6 +467,11 @@ class MailAdmin(admin.ModelAdmin):
     raw_id_fields = ('receiver', 'sender')
 
 
+class BroadcastMailAdmin(admin.ModelAdmin):
+    list_display = ('title', 'message', 'time_send')
+    raw_id_fields = ('sender',)
+
+
 class RegalRewardsAdmin(admin.ModelAdmin):
     raw_id_fields = ('user',)
 
@@ -506,19 +518,14 @@ class BaseCharacterAbility2Admin(admin.ModelAdmin):
         v = queryset[0].version
         changed = BaseCharacterAbility2.objects.filter(version=v)
 
-        previous = {}
-        for a in BaseCharacterAbility2.objects.all():
-            if version.parse(a.version) >= version.parse(v):
-                continue
-            if a.char_type not in previous or version.parse(a.version) > version.parse(previous[a.char_type].version):
-                previous[a.char_type] = a
+        previous = {p.char_type_id: p for p in base_character_ability_index.active_under_version(v, inclusive=False)}
 
         resp = []
         for a in changed:
-            if a.char_type not in previous:
+            if a.char_type_id not in previous:
                 resp.append('NEW CHARACTER: %s' % a.char_type.name)
             else:
-                p = previous[a.char_type]
+                p = previous[a.char_type_id]
                 char_diff = ['CHANGED CHARACTER: %s\n\n' % a.char_type.name]
                 
                 for ability_type, ability_name, specs, prev_specs in zip(
@@ -611,19 +618,14 @@ class BaseCharacterStatsAdmin(admin.ModelAdmin):
         v = queryset[0].version
         changed = BaseCharacterStats.objects.filter(version=v)
 
-        previous = {}
-        for a in BaseCharacterStats.objects.all():
-            if version.parse(a.version) >= version.parse(v):
-                continue
-            if a.char_type not in previous or version.parse(a.version) > version.parse(previous[a.char_type].version):
-                previous[a.char_type] = a
+        previous = {p.char_type_id: p for p in base_character_stats_index.active_under_version(v, inclusive=False)}
 
         resp = []
         for a in changed:
-            if a.char_type not in previous:
+            if a.char_type_id not in previous:
                 resp.append('NEW CHARACTER: %s' % a.char_type.name)
             else:
-                p = previous[a.char_type]
+                p = previous[a.char_type_id]
                 char_diff = ['CHANGED CHARACTER: %s\n\n' % a.char_type.name]
 
                 # Get ready for the if-statements baby.
@@ -887,6 +889,7 @@ admin.site.register(PlayerQuestWeekly)
 admin.site.register(ActiveCumulativeQuest, ActiveCumulativeQuestAdmin)
 admin.site.register(ActiveDailyQuest, ActiveDailyQuestAdmin)
 admin.site.register(ActiveWeeklyQuest, ActiveWeeklyQuestAdmin)
+admin.site.register(QuestRotation)
 
 admin.site.register(BaseCode, BaseCodeAdmin)
 admin.site.register(ClaimedCode)
@@ -908,6 +911,7 @@ admin.site.register(InvalidReceipt)
 admin.site.register(BaseDeal, BaseDealAdmin)
 admin.site.register(ActiveDeal, ActiveDealAdmin)
 admin.site.register(PurchasedTracker, PurchasedTrackerAdmin)
+admin.site.register(PendingPurchase, PendingPurchaseAdmin)
 admin.site.register(ServerStatus)
 admin.site.register(LogEntry, LogEntryAdmin)
 admin.site.register(IPTracker, IPTrackerAdmin)
@@ -934,6 +938,7 @@ admin.site.register(StoryMode, StoryModeAdmin)
 admin.site.register(StoryQuest, StoryQuestAdmin)
 admin.site.register(ExpeditionMap, ExpeditionMapAdmin)
 admin.site.register(Mail, MailAdmin)
+admin.site.register(BroadcastMail, BroadcastMailAdmin)
 
 admin.site.register(RegalRewards, RegalRewardsAdmin)
 admin.site.register(ActivityPoints, ActivityPointsAdmin)
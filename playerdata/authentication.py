@@ -0,0 +1,60 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from django_redis import get_redis_connection
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+# Kept short, a token that's rotated while a lookup is in flight can be
+# cached again right after it's deleted
+AUTH_TOKEN_CACHE_SECONDS = 300
+
+
+def auth_token_key(token_key):
+    return "auth_token_%s" % token_key
+
+
+def get_user_id_for_token(token_key):
+    r = get_redis_connection("default")
+    user_id = r.get(auth_token_key(token_key))
+    if user_id is not None:
+        return int(user_id)
+
+    user_id = Token.objects.filter(key=token_key).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        r.set(auth_token_key(token_key), user_id, ex=AUTH_TOKEN_CACHE_SECONDS)
+    return user_id
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that looks the token up in redis instead of joining
+    Token and User on every request.
+
+    Only the user is loaded. Views that update its one-to-one rows read them
+    after taking their locks, a copy loaded here would be written back stale.
+    """
+
+    def authenticate_credentials(self, key):
+        user_id = get_user_id_for_token(key)
+        if user_id is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        user = User.objects.filter(id=user_id).first()
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return user, Token(key=key, user=user)
+
+
+# ObtainAuthToken rotates tokens by deleting the old one
+@receiver(post_delete, sender=Token)
+def invalidate_auth_token(sender, instance, **kwargs):
+    def invalidate():
+        get_redis_connection("default").delete(auth_token_key(instance.key))
+
+    # again on commit, in case a request cached it before the delete landed
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -1,6 +1,14 @@
-from typing import List
+import hashlib
+import json
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
 
 from django.db.models import QuerySet
+from packaging import version as packaging_version
+from django_redis import get_redis_connection
+from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -13,7 +21,10 @@ from playerdata.models import BaseCharacterAbility2
 from playerdata.models import BaseCharacterStats
 from playerdata.models import BaseItem
 from playerdata.models import BasePrestige
-from playerdata.models import Flag, UserFlag
+from playerdata import config_cache
+from playerdata.models import Flag, UserFlag, FLAGS_CACHE
+from playerdata.models import BASE_INFO_CACHE, BASE_INFO_GENERATION_KEY
+from playerdata.models import base_character_ability_index, base_character_stats_index
 from playerdata.models import User
 
 
@@ -108,55 +119,152 @@ def get_char_rarity(char_type: int):
     return BaseCharacter.objects.get(char_type=char_type).rarity
 
 
+@dataclass(frozen=True)
+class FlagSnapshot:
+    values: Dict[str, bool]
+    user_overrides: Dict[int, Dict[str, bool]]
+
+
+def _load_flags():
+    values = {flag.name: flag.value for flag in Flag.objects.order_by('name')}
+    user_overrides = defaultdict(dict)
+    for user_id, flag_name, value in UserFlag.objects.values_list('user_id', 'flag_id', 'value'):
+        user_overrides[user_id][flag_name] = value
+    return FlagSnapshot(values, dict(user_overrides))
+
+
+flags_cache = config_cache.ConfigCache(FLAGS_CACHE, _load_flags)
+
+
+# Global flags with the user's overrides applied, {flag name: value}
+def flags_for(user) -> Dict[str, bool]:
+    snapshot = flags_cache.get()
+    return {**snapshot.values, **snapshot.user_overrides.get(user.id, {})}
+
+
 # returns false if flag doesn't exist or is false value
 def is_flag_active(flag_name: FlagName):
-    flag = Flag.objects.filter(name=flag_name.value).first()
-    return flag and flag.value
+    return flags_cache.get().values.get(flag_name.value, False)
 
 
-class BaseInfoView(APIView):
-    permission_classes = (IsAuthenticated,)
+BASE_INFO_BUNDLE_EXPIRY_SECONDS = 86400
+
+
+@dataclass(frozen=True)
+class BaseInfoBundle:
+    data: dict
+    digest: str
+
+
+def _serialize_base_characters(version):
+    if version is not None:
+        stats = BaseCharacterStats.get_active_under_version(version)
+    else:
+        stats = BaseCharacterStats.get_active()
+    stats_by_char_type = {s.char_type_id: s for s in stats}
+
+    for bc in BaseCharacter.objects.all():
+        # Characters without stats yet for this version can't be sent
+        if bc.char_type not in stats_by_char_type:
+            continue
+
+        serialized = BaseCharacterSchema(bc).data
+        serialized.update(BaseCharacterStatsSchema(stats_by_char_type[bc.char_type]).data)
+        yield serialized
+
 
-    def serialize_base_characters(version):
-        if version is not None:
-            stats = BaseCharacterStats.get_active_under_version(version)
-        else:
-            stats = BaseCharacterStats.get_active()
+def _build_base_info(version):
+    # For specs, check if the client specified a spec version - if not,
+    # just return the latest.
+    if version is not None:
+        specs = BaseCharacterAbility2.get_active_under_version(version)
+    else:
+        specs = BaseCharacterAbility2.get_active()
 
-        for bc in BaseCharacter.objects.all():
-            serialized = BaseCharacterSchema(bc).data
+    return {
+        'characters': list(_serialize_base_characters(version)),
+        'items': BaseItemSchema(BaseItem.objects.all(), many=True).data,
+        'specs': BaseCharacterAbilitySchema(specs, many=True).data,
+        'prestige': BasePrestigeSchema(BasePrestige.objects.all(), many=True).data,
+    }
 
-            char_stats = next(s for s in stats if s.char_type.char_type == bc.char_type)
-            serialized_stats = BaseCharacterStatsSchema(char_stats).data
-            serialized.update(serialized_stats)
-            yield serialized
+
+def _load_base_info_bundle(version):
+    r = get_redis_connection("default")
+    generation = int(r.get(BASE_INFO_GENERATION_KEY) or 0)
+    key = "base_info_bundle_%d_%s" % (generation, version or 'latest')
+
+    compressed = r.get(key)
+    if compressed is None:
+        compressed = zlib.compress(json.dumps(_build_base_info(version)).encode())
+        r.set(key, compressed, ex=BASE_INFO_BUNDLE_EXPIRY_SECONDS)
+
+    return BaseInfoBundle(json.loads(zlib.decompress(compressed)), hashlib.sha1(compressed).hexdigest())
+
+
+# {version: BaseInfoBundle}, emptied whenever base data or server versions change
+base_info_cache = config_cache.ConfigCache(BASE_INFO_CACHE, dict, ttl=3600)
+
+
+def resolve_base_info_version(version):
+    """Maps a client version to the newest stats or specs version at or below
+    it, so every client between two releases shares one bundle. None means
+    the latest data. Raises ValueError if `version` isn't a version number.
+    """
+    if version is None:
+        return None
+
+    parsed = packaging_version.parse(version)
+    if not isinstance(parsed, packaging_version.Version):
+        raise ValueError("invalid version %s" % version)
+
+    indexes = (base_character_stats_index, base_character_ability_index)
+    newest = [v for v in (index.newest_version() for index in indexes) if v is not None]
+    if not newest or parsed >= max(newest):
+        return None
+
+    at_or_below = [v for v in (index.version_at_or_below(parsed) for index in indexes) if v is not None]
+    if not at_or_below:
+        # older than every row, nothing is active
+        return '0.0.0'
+    return str(max(at_or_below))
+
+
+def get_base_info_bundle(version=None) -> BaseInfoBundle:
+    """Static game data for the given client version, built once per change to
+    the base tables and shared between workers through redis."""
+    version = resolve_base_info_version(version)
+    bundles = base_info_cache.get()
+    if version not in bundles:
+        bundles[version] = _load_base_info_bundle(version)
+    return bundles[version]
+
+
+class BaseInfoView(APIView):
+    permission_classes = (IsAuthenticated,)
 
     def flags(user):
         """Return global flags with user overrides for the given user."""
-        flags = {f.name: {'name': f.name, 'value': f.value} for f in Flag.objects.all()}
-        for uf in UserFlag.objects.select_related('flag').filter(user=user):
-            flags[uf.flag.name]['value'] = uf.value
-        return list(flags.values())
+        return [{'name': name, 'value': value} for name, value in flags_for(user).items()]
 
     def get(self, request, version=None):
-        itemSerializer = BaseItemSchema(BaseItem.objects.all(), many=True)
-        prestigeSerializer = BasePrestigeSchema(BasePrestige.objects.all(), many=True)
-
-        # For specs, check if the client specified a spec version - if not,
-        # just return the latest.
-        if version is not None:
-            specSerializer = BaseCharacterAbilitySchema(BaseCharacterAbility2.get_active_under_version(version), many=True)
-        else:
-            specSerializer = BaseCharacterAbilitySchema(BaseCharacterAbility2.get_active(), many=True)
+        try:
+            bundle = get_base_info_bundle(version)
+        except ValueError:
+            return Response({'status': False, 'reason': 'invalid version'}, status=status.HTTP_404_NOT_FOUND)
+        flags = BaseInfoView.flags(request.user)
+
+        # the same flags hash the same whichever order a worker loaded them in
+        flags_digest = json.dumps(sorted(flags, key=lambda flag: flag['name']), sort_keys=True)
+        etag = '"%s"' % hashlib.sha1((bundle.digest + flags_digest).encode()).hexdigest()
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
         return Response({
             'status': True,
-            'characters': list(BaseInfoView.serialize_base_characters(version)),
-            'items': itemSerializer.data,
-            'specs': specSerializer.data,
-            'prestige': prestigeSerializer.data,
-            'flags': BaseInfoView.flags(request.user),
-        })
+            **bundle.data,
+            'flags': flags,
+        }, headers={'ETag': etag})
 
 
 # Will lock the entire Users specified until the end of the transaction it is in
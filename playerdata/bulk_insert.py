@@ -0,0 +1,60 @@
+import io
+from itertools import islice
+from time import perf_counter
+
+from django.db import connection, models, transaction
+
+COPY_BATCH_SIZE = 10000
+
+
+# Postgres COPY text format, only scalar columns are supported
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _batches(iterable, batch_size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+
+def copy_bulk_create(model, objs, batch_size=COPY_BATCH_SIZE, report=None):
+    """Inserts unsaved model instances with Postgres COPY, batch_size at a time.
+
+    `objs` is consumed lazily, so passing a generator keeps memory at one
+    batch no matter how many rows there are. Each batch commits on its own,
+    a failure leaves the earlier batches in place. Like bulk_create, save()
+    and signals are skipped and the instances don't get their pks.
+
+    report(rows_written, elapsed_seconds) is called after every batch.
+    Returns the number of rows written.
+    """
+    fields = [field for field in model._meta.concrete_fields if not isinstance(field, models.AutoField)]
+    quote_name = connection.ops.quote_name
+    sql = "COPY %s (%s) FROM STDIN" % (quote_name(model._meta.db_table),
+                                       ", ".join(quote_name(field.column) for field in fields))
+
+    written = 0
+    start_time = perf_counter()
+    for batch in _batches(objs, batch_size):
+        buffer = io.StringIO()
+        for obj in batch:
+            values = [field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields]
+            buffer.write("\t".join(_copy_value(value) for value in values))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.copy_expert(sql, buffer)
+
+        written += len(batch)
+        if report is not None:
+            report(written, perf_counter() - start_time)
+    return written
+
@@ -0,0 +1,128 @@
+import logging
+import os
+import threading
+import time
+
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis import RedisError
+
+INVALIDATION_CHANNEL = "config_cache_invalidate"
+RESUBSCRIBE_BACKOFF_SECONDS = 10
+
+
+class ConfigCache:
+    """Process-local cache for config that rarely changes, e.g. server status.
+
+    The value is reloaded with `loader` every `ttl` seconds, or as soon as any
+    process calls `publish_invalidation(name)`. Invalidations arrive over redis
+    pub/sub and are read without blocking, so a cache hit costs no queries
+    and no redis round trips.
+
+    A thread that invalidated the cache in its open transaction sees its own
+    change from a separate copy until the transaction commits, the shared
+    value only ever holds committed data.
+    """
+    caches = {}
+
+    def __init__(self, name, loader, ttl=60):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.value = None
+        self.expires_at = 0
+        self.uncommitted = threading.local()
+        ConfigCache.caches[name] = self
+
+    def get(self):
+        _drain_invalidations()
+        pending = _uncommitted_invalidation(self.name)
+        if pending is not None:
+            if getattr(self.uncommitted, 'invalidation', None) is not pending:
+                self.uncommitted.value = self.loader()
+                self.uncommitted.invalidation = pending
+            return self.uncommitted.value
+
+        if time.monotonic() >= self.expires_at:
+            self.value = self.loader()
+            self.expires_at = time.monotonic() + self.ttl
+        return self.value
+
+    def invalidate(self):
+        self.expires_at = 0
+        self.uncommitted.invalidation = None
+
+    @classmethod
+    def invalidate_all(cls):
+        for cache in cls.caches.values():
+            cache.invalidate()
+
+
+_lock = threading.Lock()
+_pubsub = None
+_pubsub_pid = None
+_resubscribe_at = 0
+
+
+def _subscribe():
+    global _pubsub, _pubsub_pid
+
+    _pubsub = get_redis_connection("default").pubsub(ignore_subscribe_messages=True)
+    _pubsub.subscribe(INVALIDATION_CHANNEL)
+    _pubsub_pid = os.getpid()
+
+    # Anything published before we (re)subscribed was missed
+    ConfigCache.invalidate_all()
+
+
+def _drain_invalidations():
+    global _pubsub, _resubscribe_at
+
+    with _lock:
+        try:
+            # connections can't be shared with forked workers
+            if _pubsub is None or _pubsub_pid != os.getpid():
+                if time.monotonic() < _resubscribe_at:
+                    return
+                _subscribe()
+
+            message = _pubsub.get_message()
+            while message is not None:
+                cache = ConfigCache.caches.get(message['data'].decode())
+                if cache is not None:
+                    cache.invalidate()
+                message = _pubsub.get_message()
+        except RedisError as e:
+            # Fall back to the ttl until redis is back
+            logging.error("config cache pubsub error: %s" % e)
+            _pubsub = None
+            _resubscribe_at = time.monotonic() + RESUBSCRIBE_BACKOFF_SECONDS
+
+
+# The newest pending publish_invalidation(name) in this thread's open transaction
+def _uncommitted_invalidation(name):
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+
+    pending = None
+    for _, func in connection.run_on_commit:
+        if getattr(func, 'config_cache_name', None) == name:
+            pending = func
+    return pending
+
+
+# Invalidates the named cache in every process once the current transaction
+# commits, nothing is invalidated if it rolls back
+def publish_invalidation(name):
+    def publish():
+        cache = ConfigCache.caches.get(name)
+        if cache is not None:
+            cache.invalidate()
+        try:
+            get_redis_connection("default").publish(INVALIDATION_CHANNEL, name)
+        except RedisError as e:
+            logging.error("config cache publish error: %s" % e)
+
+    publish.config_cache_name = name
+    transaction.on_commit(publish)
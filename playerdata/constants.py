@@ -264,6 +264,13 @@ class DealType(Enum):
     GEMS_COST = 3
 
 
+# Queued receipt validation, see playerdata/purchase_queue.py
+class PendingPurchaseState(Enum):
+    PENDING = 0
+    DONE = 1
+    FAILED = 2
+
+
 class ChapterRewardPackType(Enum):
     CHAPTER19 = 0
     CHAPTER25 = 1
@@ -8,9 +8,9 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_marshmallow import Schema, fields
 
-from playerdata import shards, dungeon
+from playerdata import shards, dungeon, config_cache
 from . import rolls, constants, chests, dungeon_gen
-from .models import DailyDungeonStatus, DailyDungeonStage
+from .models import DailyDungeonStatus, DailyDungeonStage, DUNGEON_STAGES_CACHE
 from .questupdater import QuestUpdater
 from .serializers import DailyDungeonStartSerializer, CharStateResultSerializer
 
@@ -73,6 +73,8 @@ def daily_dungeon_team_gen_cron():
     # refresh the stages on db
     DailyDungeonStage.objects.all().delete()
     DailyDungeonStage.objects.bulk_create(teams_list)
+    # bulk_create doesn't send post_save
+    config_cache.publish_invalidation(DUNGEON_STAGES_CACHE)
 
 
 # Pulls the corresponding boss stage and generates either a filler or boss level
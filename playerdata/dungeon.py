@@ -17,7 +17,7 @@ from . import constants, formulas, dungeon_gen, wishlist, chapter_rewards_pack,
     level_booster, story_mode
 from .constants import DungeonType
 from .matcher import PlacementSchema
-from .questupdater import QuestUpdater
+from .questupdater import QuestUpdater, batch_quest_progress
 from .referral import award_referral
 from .serializers import ValueSerializer, SetDungeonProgressSerializer
 
@@ -80,15 +80,16 @@ def track_dungeon_stats(dungeon_type, is_win, stage):
     if not DungeonStats.objects.filter(dungeon_type=dungeon_type, stage=stage).exists():
         DungeonStats.objects.create(dungeon_type=dungeon_type, stage=stage)
     key = get_redis_dungeon_winrate_key(dungeon_type, stage)
-    r.incr(f'{key}_games')
+    r.hincrby(key, 'games')
     if is_win:
-        r.incr(f'{key}_wins')
+        r.hincrby(key, 'wins')
 
 
 class DungeonSetProgressCommitView(APIView):
     permission_classes = (IsAuthenticated,)
 
     @transaction.atomic
+    @batch_quest_progress
     def post(self, request):
         # Increment Dungeon progress
         serializer = SetDungeonProgressSerializer(data=request.data)
@@ -1,11 +1,12 @@
 import json
 import math
 import random
+from dataclasses import dataclass
 from datetime import date
 
-from playerdata import constants, base, server
+from playerdata import constants, base, server, config_cache
 from playerdata.matcher import PlacementSchema
-from playerdata.models import Placement, Character, DungeonBoss, DailyDungeonStage, Item
+from playerdata.models import Placement, Character, DungeonBoss, DailyDungeonStage, Item, DUNGEON_STAGES_CACHE
 
 
 # Adjust the prestige based on prestige rarity cap
@@ -30,6 +31,8 @@ We expect team_comp to be in format of
 # into a fully functional Placement
 def convert_teamp_comp_to_stage(team_comp, stage_num, levels, prestiges, seed_int):
     rng = random.Random(seed_int)
+    # team_comp can be a cached boss row shared by every request, positions go on a copy
+    team_comp = [dict(char) for char in team_comp]
 
     placement = Placement()
     available_pos_frontline = [*constants.FRONTLINE_POS]
@@ -248,21 +251,49 @@ def early_campaign_teams(stage_num):
     return team_comp
 
 
+@dataclass
+class DungeonStages:
+    bosses: dict  # (dungeon_type, stage) -> DungeonBoss
+    tunnels_team_comps: dict  # stage -> team_comp
+    mobs: dict  # stage_cache_key -> serialized placement
+
+
+def _load_dungeon_stages():
+    bosses = {(boss.dungeon_type, boss.stage): boss for boss in DungeonBoss.objects.all()}
+    tunnels_team_comps = dict(DailyDungeonStage.objects.values_list('stage', 'team_comp'))
+    return DungeonStages(bosses, tunnels_team_comps, {})
+
+
+# Generated mobs are a pure function of the stage, the boss rows and (for
+# tunnels) the day, so each one is generated once per worker until a
+# DungeonBoss or DailyDungeonStage changes
+dungeon_stages_cache = config_cache.ConfigCache(DUNGEON_STAGES_CACHE, _load_dungeon_stages, ttl=3600)
+
+
+def get_dungeon_boss(stages, stage, dungeon_type):
+    boss = stages.bosses.get((dungeon_type, stage))
+    if boss is None:
+        raise DungeonBoss.DoesNotExist("No DungeonBoss for stage %d, dungeon type %d" % (stage, dungeon_type))
+    return boss
+
+
 # Although there's some duplicate code
 # keeping it separate to accommodate easier future changes
-def stage_generator(stage_num, dungeon_type):
+def generate_stage(stages, stage_num, dungeon_type):
     if dungeon_type == constants.DungeonType.CAMPAIGN.value:
         boss_stage = math.ceil(stage_num / constants.NUM_DUNGEON_SUBSTAGES[dungeon_type]) * constants.NUM_DUNGEON_SUBSTAGES[dungeon_type]
 
-        dungeon_boss = DungeonBoss.objects.get(stage=boss_stage, dungeon_type=dungeon_type)
+        # the boss row is shared by every request, don't modify it
+        dungeon_boss = get_dungeon_boss(stages, boss_stage, dungeon_type)
+        team_comp = dungeon_boss.team_comp
         if stage_num <= 20:
-            dungeon_boss.team_comp = early_campaign_teams(stage_num)
+            team_comp = early_campaign_teams(stage_num)
 
         seed_int = stage_num
         levels = get_campaign_levels_for_stage(10, stage_num, boss_stage)
         prestiges = get_campaign_prestige(boss_stage)
 
-        placement = convert_teamp_comp_to_stage(dungeon_boss.team_comp, stage_num, levels, prestiges, seed_int)
+        placement = convert_teamp_comp_to_stage(team_comp, stage_num, levels, prestiges, seed_int)
         placement = swap_in_peasants(stage_num, placement, prestiges, seed_int)
 
         # hardcode dragon boss
@@ -277,7 +308,7 @@ def stage_generator(stage_num, dungeon_type):
 
     elif dungeon_type == constants.DungeonType.TOWER.value:
         boss_stage = math.ceil(stage_num / constants.NUM_DUNGEON_SUBSTAGES[dungeon_type]) * constants.NUM_DUNGEON_SUBSTAGES[dungeon_type]
-        team_comp = DungeonBoss.objects.get(stage=boss_stage, dungeon_type=dungeon_type).team_comp
+        team_comp = get_dungeon_boss(stages, boss_stage, dungeon_type).team_comp
         seed_int = stage_num
         levels = get_tower_levels_for_stage(5, stage_num, boss_stage)
         prestiges = [10] * 5  #TODO: can increase this up to 15 as you progress
@@ -286,7 +317,9 @@ def stage_generator(stage_num, dungeon_type):
 
     elif dungeon_type == constants.DungeonType.TUNNELS.value:
         boss_stage = math.ceil(stage_num / 4)
-        team_comp = DailyDungeonStage.objects.get(stage=boss_stage).team_comp
+        if boss_stage not in stages.tunnels_team_comps:
+            raise DailyDungeonStage.DoesNotExist("No DailyDungeonStage for stage %d" % boss_stage)
+        team_comp = stages.tunnels_team_comps[boss_stage]
         levels = get_tunnels_levels_for_stage(10, stage_num)
         seed_int = date.today().month + date.today().day + stage_num
         # TODO: perfect place to add in some more prestige as you go deeper
@@ -300,6 +333,24 @@ def stage_generator(stage_num, dungeon_type):
     return PlacementSchema(placement).data
 
 
+def stage_cache_key(stage_num, dungeon_type):
+    if dungeon_type == constants.DungeonType.TUNNELS.value:
+        # tunnels are reseeded every day
+        return dungeon_type, stage_num, date.today()
+    if dungeon_type == constants.DungeonType.CAMPAIGN.value:
+        return dungeon_type, stage_num, server.is_server_version_higher('1.0.8')
+    return dungeon_type, stage_num
+
+
+# The returned mob is shared between requests, treat it as read only
+def stage_generator(stage_num, dungeon_type):
+    stages = dungeon_stages_cache.get()
+    key = stage_cache_key(stage_num, dungeon_type)
+    if key not in stages.mobs:
+        stages.mobs[key] = generate_stage(stages, stage_num, dungeon_type)
+    return stages.mobs[key]
+
+
 # To print out all the dungeon levels:
 # python manage.py shell_plus
 # from playerdata import dungeon_gen
@@ -1,11 +1,16 @@
+import heapq
+from itertools import islice
+
 from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils.dateparse import parse_datetime
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_marshmallow import Schema, fields
 
 from playerdata import redemptioncodes
-from playerdata.models import Character, Mail, ClaimedCode
+from playerdata.models import BroadcastMail, BroadcastMailStatus, Character, Mail, ClaimedCode
 from playerdata.serializers import IntSerializer, CharStateResultSerializer, SendMailSerializer
 
 
@@ -22,12 +27,107 @@ class MailSchema(Schema):
     time_send = fields.DateTime()
 
 
+# Broadcast mail is listed with negative ids, so they never collide with Mail ids
+class BroadcastMailSchema(MailSchema):
+    id = fields.Method('get_id')
+    is_read = fields.Method('get_is_read')
+    has_unclaimed_reward = fields.Method('get_has_unclaimed_reward')
+
+    def get_id(self, broadcast):
+        return -broadcast.id
+
+    def get_is_read(self, broadcast):
+        return broadcast.status.is_read
+
+    def get_has_unclaimed_reward(self, broadcast):
+        return broadcast.code_id is not None and not broadcast.status.is_claimed
+
+
+INBOX_PAGE_SIZE = 100
+
+
+def visible_broadcasts(user):
+    deleted = BroadcastMailStatus.objects.filter(broadcast=OuterRef('pk'), user=user, is_deleted=True)
+    return BroadcastMail.objects.filter(time_send__gte=user.date_joined).filter(~Exists(deleted))
+
+
+# The user's status for a broadcast, made the first time they see it
+def get_broadcast_status(user, broadcast_id):
+    broadcast = visible_broadcasts(user).filter(id=broadcast_id).select_related('code').first()
+    if broadcast is None:
+        return None
+    status, _ = BroadcastMailStatus.objects.get_or_create(broadcast=broadcast, user=user)
+    return status
+
+
+# Newest first, mail sent at the same time by its listed id
+def inbox_order(entry):
+    mail, schema = entry
+    return mail.time_send, -mail.id if schema is BroadcastMailSchema else mail.id
+
+
+def get_inbox_page(user, before=None, before_id=None):
+    """Up to INBOX_PAGE_SIZE of the user's mail and broadcasts, newest first,
+    as (object, schema) pairs. The page starts after the mail listed as
+    (`before`, `before_id`), or at anything sent before `before` when there's
+    no `before_id`."""
+    mails = Mail.objects.filter(receiver=user).select_related('sender__userinfo').order_by('-time_send', '-id')
+    broadcasts = visible_broadcasts(user).select_related('sender__userinfo').order_by('-time_send', 'id')
+    if before is not None:
+        mails_before = Q(time_send__lt=before)
+        broadcasts_before = Q(time_send__lt=before)
+        if before_id is not None:
+            # broadcasts are listed as -id
+            mails_before |= Q(time_send=before, id__lt=before_id)
+            broadcasts_before |= Q(time_send=before, id__gt=-before_id)
+        mails = mails.filter(mails_before)
+        broadcasts = broadcasts.filter(broadcasts_before)
+
+    broadcasts = list(broadcasts.prefetch_related(Prefetch('statuses', queryset=BroadcastMailStatus.objects.filter(user=user),
+                                                           to_attr='user_statuses'))[:INBOX_PAGE_SIZE])
+    new_statuses = []
+    for broadcast in broadcasts:
+        if broadcast.user_statuses:
+            broadcast.status = broadcast.user_statuses[0]
+        else:
+            broadcast.status = BroadcastMailStatus(broadcast=broadcast, user=user)
+            new_statuses.append(broadcast.status)
+    BroadcastMailStatus.objects.bulk_create(new_statuses, ignore_conflicts=True)
+
+    merged = heapq.merge(((mail, MailSchema) for mail in mails[:INBOX_PAGE_SIZE]),
+                         ((broadcast, BroadcastMailSchema) for broadcast in broadcasts),
+                         key=inbox_order, reverse=True)
+    return list(islice(merged, INBOX_PAGE_SIZE))
+
+
 class GetInboxView(APIView):
     permission_classes = (IsAuthenticated,)
 
+    # A full page means there may be more, ?before=<time_send>&before_id=<id> of the last mail for the next one
     def get(self, request):
-        all_mail = Mail.objects.filter(receiver=request.user).select_related('sender__userinfo').order_by('-time_send')
-        return Response({'status': True, 'mail': MailSchema(all_mail, many=True).data})
+        before = request.query_params.get('before')
+        before_id = request.query_params.get('before_id')
+
+        if before:
+            try:
+                before = parse_datetime(before)
+            except ValueError:
+                before = None
+            if before is None:
+                return Response({'status': False, 'reason': 'invalid before'})
+        else:
+            before = None
+
+        if before_id:
+            try:
+                before_id = int(before_id)
+            except ValueError:
+                return Response({'status': False, 'reason': 'invalid before_id'})
+        else:
+            before_id = None
+
+        page = get_inbox_page(request.user, before, before_id)
+        return Response({'status': True, 'mail': [schema(mail).data for mail, schema in page]})
 
 
 class ReadInboxView(APIView):
@@ -39,7 +139,10 @@ class ReadInboxView(APIView):
         serializer.is_valid(raise_exception=True)
         mail_id = serializer.validated_data['value']
 
-        mail = Mail.objects.filter(id=mail_id, receiver=request.user).first()
+        if mail_id < 0:
+            mail = get_broadcast_status(request.user, -mail_id)
+        else:
+            mail = Mail.objects.filter(id=mail_id, receiver=request.user).first()
         if mail is None:
             return Response({'status': False, 'reason': 'invalid mail id: ' + str(mail_id)})
 
@@ -75,7 +178,11 @@ class ClaimMailView(APIView):
         serializer.is_valid(raise_exception=True)
         mail_id = serializer.validated_data['value']
 
-        mail = Mail.objects.filter(id=mail_id, receiver=request.user).first()
+        if mail_id < 0:
+            status = get_broadcast_status(request.user, -mail_id)
+            mail = status.broadcast if status is not None else None
+        else:
+            mail = Mail.objects.filter(id=mail_id, receiver=request.user).first()
         if mail is None:
             return Response({'status': False, 'reason': 'invalid mail id: ' + str(mail_id)})
 
@@ -88,8 +195,12 @@ class ClaimMailView(APIView):
         redemptioncodes.award_code(request.user, mail.code)
         ClaimedCode.objects.create(user=request.user, code=mail.code)
 
-        mail.has_unclaimed_reward = False
-        mail.save()
+        if mail_id < 0:
+            status.is_claimed = True
+            status.save()
+        else:
+            mail.has_unclaimed_reward = False
+            mail.save()
 
         redeem_code_schema = redemptioncodes.RedeemCodeSchema(mail.code)
         return Response({'status': True, 'redeem_code': redeem_code_schema.data})
@@ -104,6 +215,15 @@ class DeleteMailView(APIView):
         serializer.is_valid(raise_exception=True)
         mail_id = serializer.validated_data['value']
 
+        if mail_id < 0:
+            status = get_broadcast_status(request.user, -mail_id)
+            if status is None:
+                return Response({'status': False, 'reason': 'invalid mail id: ' + str(mail_id)})
+
+            status.is_deleted = True
+            status.save()
+            return Response({'status': True})
+
         mail = Mail.objects.filter(id=mail_id, receiver=request.user).first()
         if mail is None:
             return Response({'status': False, 'reason': 'invalid mail id: ' + str(mail_id)})
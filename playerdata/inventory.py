@@ -10,7 +10,7 @@ from playerdata import constants, server, base, level_booster
 from playerdata.models import Character, UserInfo, ServerStatus
 from playerdata.models import Item
 from . import formulas
-from .questupdater import QuestUpdater
+from .questupdater import QuestUpdater, batch_quest_progress
 from .serializers import EquipItemSerializer, UnequipItemSerializer, ValueSerializer, ScrapItemSerializer
 from .serializers import TargetCharSerializer
 
@@ -50,7 +50,12 @@ class CharacterSchema(Schema):
     trinket_2 = fields.Nested(ItemSchema)
 
     def get_char_level(self, char):
-        if base.is_flag_active(base.FlagName.LEVEL_MATCH):
+        # Resolved once per request by get_serializable_characters
+        level_match = getattr(char, 'level_match', None)
+        if level_match is None:
+            level_match = base.is_flag_active(base.FlagName.LEVEL_MATCH)
+
+        if level_match:
             if char.is_boosted:
                 if char.char_id in char.user.levelbooster.top_five and not char.user.levelbooster.is_enhanced:
                     return char.level
@@ -116,14 +121,29 @@ class InventorySchema(Schema):
         return userinfo.player_exp
 
 
+EQUIPMENT_SLOTS = ['hat', 'armor', 'weapon', 'boots', 'trinket_1', 'trinket_2']
+
+
+# Loads a user's characters along with everything CharacterSchema reads, so
+# serializing them takes the same number of queries for 1 or 200 characters
+def get_serializable_characters(user):
+    level_match = bool(base.is_flag_active(base.FlagName.LEVEL_MATCH))
+    chars = list(Character.objects.filter(user=user).select_related(*['%s__item_type' % slot for slot in EQUIPMENT_SLOTS]))
+    for char in chars:
+        # shares one cached levelbooster across every character
+        char.user = user
+        char.level_match = level_match
+    return chars
+
+
 class InventoryView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
         level_booster.try_eval_save_top_five(request.user)  # evaling here guarantees correctness and is lazier than evaling at each levelup/refunds
 
-        char_serializer = CharacterSchema(Character.objects.filter(user=request.user), many=True)
-        item_serializer = ItemSchema(Item.objects.filter(user=request.user), many=True)
+        char_serializer = CharacterSchema(get_serializable_characters(request.user), many=True)
+        item_serializer = ItemSchema(Item.objects.filter(user=request.user).select_related('item_type'), many=True)
         inventory_serializer = InventorySchema(request.user.inventory)
         return Response(
                 {'status': True, 'characters': char_serializer.data, 'items': item_serializer.data, 'details': inventory_serializer.data})
@@ -534,6 +554,7 @@ class ScrapItemsView(APIView):
     permission_classes = (IsAuthenticated,)
 
     @transaction.atomic
+    @batch_quest_progress
     def post(self, request):
         serializer = ScrapItemSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
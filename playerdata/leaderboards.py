@@ -17,6 +17,12 @@ def pvp_ranking_key():
     return "pvp_ranking"
 
 
+# Bots are also kept in their own sorted set so the pvp queue can match low
+# elo players against bots only, see `pvp_queue.get_opponents_from_index`
+def pvp_bot_ranking_key():
+    return "pvp_bot_ranking"
+
+
 def clan_ranking_key():
     return "clan_ranking"
 
@@ -16,13 +16,13 @@ from rest_framework.status import (
 from rest_framework.views import APIView
 
 from playerdata import server
+from playerdata.profanity_filter import profanity
 from playerdata.social import isTextSanitized
 from .models import UserInfo, IPTracker
 from .serializers import AuthTokenSerializer
 from .serializers import ChangeNameSerializer
 from .serializers import CreateNewUserSerializer
 from .serializers import RecoverAccountSerializer
-from better_profanity import profanity
 
 
 class HelloView(APIView):
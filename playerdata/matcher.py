@@ -1,9 +1,11 @@
+import json
 import random
 import secrets
 from collections import defaultdict
 
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django_redis import get_redis_connection
 from random_username.generate import generate_username
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
@@ -13,9 +15,10 @@ from rest_marshmallow import Schema, fields
 from playerdata import constants, formulas, server
 from playerdata.models import BaseCharacter
 from playerdata.models import Character
-from playerdata.models import Match, MatchReplay, ServerStatus
+from playerdata.models import Match, MatchReplay
 from playerdata.models import Placement
 from playerdata.models import UserInfo
+from playerdata.models import userinfo_snapshot_key, USERINFO_SNAPSHOT_EXPIRY_SECONDS
 from .inventory import CharacterSchema
 from .serializers import GetMatchHistorySerializer
 from .serializers import GetOpponentsSerializer
@@ -155,6 +158,40 @@ def userinfo_preloaded():
         .select_related('user__dungeonprogress')
 
 
+# Only writes the snapshot if nothing invalidated it since we read the version
+SET_USERINFO_SNAPSHOT_LUA = """
+local version = redis.call('HGET', KEYS[1], 'version') or '0'
+if version ~= ARGV[1] then
+    return 0
+end
+
+redis.call('HMSET', KEYS[1], 'version', version, 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+# Returns the serialized UserInfoSchema for user_id, skipping the
+# userinfo_preloaded join when the cached snapshot is still current
+def get_userinfo_snapshot(user_id):
+    r = get_redis_connection("default")
+    key = userinfo_snapshot_key(user_id)
+
+    version, data = r.hmget(key, 'version', 'data')
+    if data is not None:
+        return json.loads(data)
+
+    query = userinfo_preloaded().filter(user_id=user_id).first()
+    serialized = UserInfoSchema(query).data
+    if query is None:
+        return serialized
+
+    script = r.register_script(SET_USERINFO_SNAPSHOT_LUA)
+    script(keys=[key], args=[version.decode() if version else '0', json.dumps(serialized),
+                             USERINFO_SNAPSHOT_EXPIRY_SECONDS])
+    return serialized
+
+
 class GetUserView(APIView):
     permission_classes = (IsAuthenticated,)
 
@@ -307,7 +344,7 @@ class GetReplayView(APIView):
             return Response({'status': False, 'reason': 'match expired or does not exist'})
 
         match = match_q[0]
-        if ServerStatus.latest_version() != match.version:
+        if server.latest_version() != match.version:
             return Response({'status': False, 'reason': 'replay version out of date'})
 
         replay_q = MatchReplay.objects.filter(match=match)
@@ -328,7 +365,7 @@ class GetReplayMatchView(APIView):
         match = Match.objects.filter(id=serializer.validated_data['value']).first()
         if match is None:
             return Response({'status': False, 'reason': 'match expired or does not exist'})
-        if ServerStatus.latest_version() != match.version:
+        if server.latest_version() != match.version:
             return Response({'status': False, 'reason': 'replay version out of date'})
 
         match_export = MatchHistorySchema(match)
@@ -0,0 +1,33 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django_better_admin_arrayfield.models.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playerdata', '0248_clanseasonreward'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestRotation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_interval', models.IntegerField()),
+                ('base_quests', django_better_admin_arrayfield.models.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('expiration_date', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='playerquestcumulative2',
+            name='daily_expiration_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='playerquestcumulative2',
+            name='weekly_expiration_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
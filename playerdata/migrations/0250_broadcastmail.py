@@ -0,0 +1,46 @@
+# Generated by Django 3.0.4 on 2026-10-18 12:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('playerdata', '0249_questrotation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('sender_profile_picture_id', models.IntegerField(default=0)),
+                ('time_send', models.DateTimeField(auto_now_add=True)),
+                ('title', models.TextField(default='')),
+                ('code', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='playerdata.BaseCode')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcastmailsender', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BroadcastMailStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_read', models.BooleanField(default=False)),
+                ('is_claimed', models.BooleanField(default=False)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statuses', to='playerdata.BroadcastMail')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('broadcast', 'user')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='broadcastmail',
+            index=models.Index(fields=['time_send'], name='playerdata__time_se_0a6a5a_idx'),
+        ),
+    ]
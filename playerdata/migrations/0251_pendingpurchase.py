@@ -0,0 +1,41 @@
+# Generated by Django 3.0.4 on 2026-10-18 15:10
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('playerdata', '0250_broadcastmail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingPurchase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('store', models.IntegerField()),
+                ('receipt', models.TextField()),
+                ('transaction_id', models.TextField()),
+                ('new_purchase_token', models.TextField(blank=True, default='')),
+                ('state', models.IntegerField(choices=[(0, 'PENDING'), (1, 'DONE'), (2, 'FAILED')], default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'transaction_id')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='pendingpurchase',
+            index=models.Index(fields=['state', 'next_attempt_time'], name='playerdata__state_58761d_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.0.4 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playerdata', '0251_pendingpurchase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CronCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.TextField()),
+                ('day', models.DateField()),
+                ('next_pk', models.IntegerField()),
+            ],
+            options={
+                'unique_together': {('name', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+from django.db import migrations
+from django.db.models import Max
+
+from playerdata import constants
+
+
+# Same as models.get_expiration_date
+def next_expiration_date(days_interval):
+    if days_interval == 1:
+        delta = 1
+    else:
+        delta = (7 - datetime.today().weekday()) % 7
+        if delta == 0:
+            delta = 7
+
+    return datetime.combine(date.today(), time(tzinfo=timezone.utc)) + timedelta(days=delta)
+
+
+def seed_rotation(apps, days_interval, player_quest_model, active_quest_model, num_quests):
+    QuestRotation = apps.get_model('playerdata', 'QuestRotation')
+    PlayerQuestModel = apps.get_model('playerdata', player_quest_model)
+    ActiveQuestModel = apps.get_model('playerdata', active_quest_model)
+
+    if QuestRotation.objects.filter(days_interval=days_interval).exists():
+        return
+
+    # Players already hold the live quests the last cron gave out, keep them current. Without any,
+    # new accounts got the head of the queue.
+    expiration_date = PlayerQuestModel.objects.aggregate(Max('expiration_date'))['expiration_date__max']
+    if expiration_date is not None:
+        base_quests = sorted(PlayerQuestModel.objects.filter(expiration_date=expiration_date)
+                             .values_list('base_quest_id', flat=True).distinct())
+    else:
+        expiration_date = next_expiration_date(days_interval)
+        base_quests = list(ActiveQuestModel.objects.order_by('id').values_list('base_quest_id', flat=True)[:num_quests])
+
+    # nothing to hand out yet, e.g. a fresh database, the first cron makes the rotation
+    if not base_quests:
+        return
+
+    QuestRotation.objects.create(days_interval=days_interval, base_quests=base_quests, expiration_date=expiration_date)
+
+
+def seed_quest_rotations(apps, schema_editor):
+    seed_rotation(apps, 1, 'PlayerQuestDaily', 'ActiveDailyQuest', constants.NUM_DAILY_QUESTS)
+    seed_rotation(apps, 7, 'PlayerQuestWeekly', 'ActiveWeeklyQuest', constants.NUM_WEEKLY_QUESTS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('playerdata', '0252_croncheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_quest_rotations, migrations.RunPython.noop),
+    ]
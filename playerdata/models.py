@@ -1,11 +1,10 @@
 import json
 import random
 import string
+from bisect import bisect_left, bisect_right
 from collections import defaultdict
 from datetime import datetime, date, time, timedelta
 from packaging import version
-import time as ptime
-import functools
 
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
@@ -13,15 +12,18 @@ from django.contrib.auth.models import User
 from django.contrib.postgres.fields import JSONField
 from django.db import IntegrityError
 from django.db import models
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.deconstruct import deconstructible
 from django_better_admin_arrayfield.models.fields import ArrayField
+from django_redis import get_redis_connection
 from decouple import config
 
 from bulk_update_or_create import BulkUpdateOrCreateQuerySet
-from playerdata import constants
+from mainsocket import notifications
+from playerdata import config_cache, constants
 
 # Developer account IDs for in-game accounts
 from playerdata.constants import DealType, DungeonType, RewardType
@@ -50,12 +52,6 @@ class ServerStatus(models.Model):
             models.Index(fields=['creation_time', 'event_type']),
         ]
 
-    @functools.lru_cache(maxsize=1)
-    def latest_version(ttl=int(ptime.time()//60)):
-        """Return the latest server version, cached with TTL of 60 seconds."""
-        status = ServerStatus.objects.filter(event_type='V').latest('creation_time')
-        return status.version_number
-
     def clean(self):
         if self.event_type == 'V':
             if not self.version_number:
@@ -75,6 +71,16 @@ class ServerStatus(models.Model):
             return "Upcoming maintenance: %s" % (self.maintenance_start)
 
 
+# Name of the `config_cache.ConfigCache` for server versions, see `server.py`
+SERVER_STATUS_CACHE = 'server_status'
+
+
+@receiver(post_save, sender=ServerStatus)
+@receiver(post_delete, sender=ServerStatus)
+def invalidate_server_status_cache(sender, instance, **kwargs):
+    config_cache.publish_invalidation(SERVER_STATUS_CACHE)
+
+
 class Flag(models.Model):
     name = models.CharField(max_length=30, primary_key=True)
     value = models.BooleanField(default=False)
@@ -93,7 +99,18 @@ class UserFlag(models.Model):
 
     def __str__(self):
         return '%s (%s): %s' % (str(self.flag), str(self.user), str(self.value))
-        
+
+
+FLAGS_CACHE = 'flags'
+
+
+@receiver(post_save, sender=Flag)
+@receiver(post_delete, sender=Flag)
+@receiver(post_save, sender=UserFlag)
+@receiver(post_delete, sender=UserFlag)
+def invalidate_flags_cache(sender, instance, **kwargs):
+    config_cache.publish_invalidation(FLAGS_CACHE)
+
 
 class BaseCharacter(models.Model):
     char_type = models.AutoField(primary_key=True)
@@ -121,6 +138,63 @@ class BaseCharacter(models.Model):
         return str(self.char_type) + ': ' + self.name
 
 
+class VersionIndex:
+    """Rows of a model versioned per character, as char_type -> rows sorted by
+    parsed version. Finding the rows active as of a version is then a bisect
+    per character instead of a table scan. Rebuilt whenever a row is saved.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = config_cache.ConfigCache(version_index_cache_name(model), self.load, ttl=600)
+
+    def load(self):
+        rows_by_char_type = defaultdict(list)
+        for row in self.model.objects.select_related('char_type'):
+            # We expect server versions to be triplets.
+            rows_by_char_type[row.char_type_id].append((version.parse(row.version), row))
+
+        index = {}
+        for char_type in sorted(rows_by_char_type):
+            rows = sorted(rows_by_char_type[char_type], key=lambda r: r[0])
+            index[char_type] = ([v for v, _ in rows], [row for _, row in rows])
+        return index
+
+    def active_under_version(self, v=None, inclusive=True):
+        """Newest row per character with a version at or below `v`, or strictly
+        below it if not inclusive. Returns the newest rows if `v` is None."""
+        parsed = version.parse(v) if v is not None else None
+
+        active = []
+        for versions, rows in self.cache.get().values():
+            if parsed is None:
+                i = len(rows)
+            elif inclusive:
+                i = bisect_right(versions, parsed)
+            else:
+                i = bisect_left(versions, parsed)
+
+            if i > 0:
+                active.append(rows[i - 1])
+        return active
+
+    def version_at_or_below(self, parsed):
+        """Newest parsed row version at or below `parsed`, None if there's none."""
+        newest = None
+        for versions, _ in self.cache.get().values():
+            i = bisect_right(versions, parsed)
+            if i > 0 and (newest is None or versions[i - 1] > newest):
+                newest = versions[i - 1]
+        return newest
+
+    def newest_version(self):
+        return max((versions[-1] for versions, _ in self.cache.get().values()), default=None)
+
+
+def version_index_cache_name(model):
+    return 'version_index_%s' % model._meta.model_name
+
+
 class BaseCharacterStats(models.Model):
     char_type = models.ForeignKey(BaseCharacter, on_delete=models.CASCADE)
     version = models.CharField(max_length=30, default='0.0.0')
@@ -151,23 +225,13 @@ class BaseCharacterStats(models.Model):
         return self.char_type.name + ': ' + self.version
 
     def get_active():
-        stats = {}
-        for s in BaseCharacterStats.objects.all():
-            # We expect server versions to be triplets.
-            if s.char_type not in stats or version.parse(s.version) > version.parse(stats[s.char_type].version):
-                stats[s.char_type] = s
-        return stats.values()
+        return base_character_stats_index.active_under_version()
 
     def get_active_under_version(v):
-        stats = {}
-        for s in BaseCharacterStats.objects.all():
-            if version.parse(s.version) > version.parse(v):
-                continue
-            
-            # We expect server versions to be triplets.
-            if s.char_type not in stats or version.parse(s.version) > version.parse(stats[s.char_type].version):
-                stats[s.char_type] = s
-        return stats.values()
+        return base_character_stats_index.active_under_version(v)
+
+
+base_character_stats_index = VersionIndex(BaseCharacterStats)
 
 
 class BaseCharacterAbility2(models.Model):
@@ -305,23 +369,10 @@ class BaseCharacterAbility2(models.Model):
                                       % expected_level)
 
     def get_active():
-        specs = {}
-        for a in BaseCharacterAbility2.objects.all():
-            # We expect server versions to be triplets.
-            if a.char_type not in specs or version.parse(a.version) > version.parse(specs[a.char_type].version):
-                specs[a.char_type] = a
-        return specs.values() 
+        return base_character_ability_index.active_under_version()
 
     def get_active_under_version(v):
-        specs = {}
-        for a in BaseCharacterAbility2.objects.all():
-            if version.parse(a.version) > version.parse(v):
-                continue
-            
-            # We expect server versions to be triplets.
-            if a.char_type not in specs or version.parse(a.version) > version.parse(specs[a.char_type].version):
-                specs[a.char_type] = a
-        return specs.values() 
+        return base_character_ability_index.active_under_version(v)
  
     class Meta:
         unique_together = ('char_type', 'version')
@@ -330,6 +381,20 @@ class BaseCharacterAbility2(models.Model):
         return self.char_type.name + ': ' + self.version
 
 
+base_character_ability_index = VersionIndex(BaseCharacterAbility2)
+
+
+@receiver(post_save, sender=BaseCharacterStats)
+@receiver(post_delete, sender=BaseCharacterStats)
+@receiver(post_save, sender=BaseCharacterAbility2)
+@receiver(post_delete, sender=BaseCharacterAbility2)
+@receiver(post_save, sender=BaseCharacter)
+def invalidate_version_indexes(sender, instance, **kwargs):
+    # BaseCharacter too, since indexed rows hold on to their char_type
+    for model in (BaseCharacterStats, BaseCharacterAbility2):
+        config_cache.publish_invalidation(version_index_cache_name(model))
+
+
 class BaseCharacterAbility:
     def validate_ability_specs():
         # NOTE: we should not put validators inside of model classes, because
@@ -436,6 +501,34 @@ class BasePrestige(StatModifiers):
         return self.char_type.name + ": " + str(self.level)
 
 
+BASE_INFO_CACHE = 'base_info'
+BASE_INFO_GENERATION_KEY = 'base_info_generation'
+
+
+def bump_base_info_generation():
+    get_redis_connection("default").incr(BASE_INFO_GENERATION_KEY)
+
+
+@receiver(post_save, sender=ServerStatus)
+@receiver(post_delete, sender=ServerStatus)
+@receiver(post_save, sender=BaseCharacter)
+@receiver(post_delete, sender=BaseCharacter)
+@receiver(post_save, sender=BaseCharacterStats)
+@receiver(post_delete, sender=BaseCharacterStats)
+@receiver(post_save, sender=BaseCharacterAbility2)
+@receiver(post_delete, sender=BaseCharacterAbility2)
+@receiver(post_save, sender=BaseItem)
+@receiver(post_delete, sender=BaseItem)
+@receiver(post_save, sender=BasePrestige)
+@receiver(post_delete, sender=BasePrestige)
+def invalidate_base_info_cache(sender, instance, **kwargs):
+    # Bump again on commit, in case another worker rebuilt the bundle from the
+    # old rows before this transaction landed
+    bump_base_info_generation()
+    transaction.on_commit(bump_base_info_generation)
+    config_cache.publish_invalidation(BASE_INFO_CACHE)
+
+
 class Item(models.Model):
     item_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -1116,6 +1209,17 @@ class DungeonBoss(models.Model):
         return "Stage: " + str(self.stage)
 
 
+DUNGEON_STAGES_CACHE = 'dungeon_stages'
+
+
+@receiver(post_save, sender=DungeonBoss)
+@receiver(post_delete, sender=DungeonBoss)
+@receiver(post_save, sender=DailyDungeonStage)
+@receiver(post_delete, sender=DailyDungeonStage)
+def invalidate_dungeon_stages_cache(sender, instance, **kwargs):
+    config_cache.publish_invalidation(DUNGEON_STAGES_CACHE)
+
+
 class BaseQuest(models.Model):
     title = models.TextField()
     type = models.IntegerField()
@@ -1138,6 +1242,10 @@ class PlayerQuestCumulative2(models.Model):
     completed_quests = ArrayField(models.IntegerField(), blank=True, null=True, default=list)
     claimed_quests = ArrayField(models.IntegerField(), blank=True, null=True, default=list)
 
+    # The QuestRotation expiration dates this user's daily / weekly rows were made for
+    daily_expiration_date = models.DateTimeField(blank=True, null=True)
+    weekly_expiration_date = models.DateTimeField(blank=True, null=True)
+
 
 class PlayerQuestDaily(models.Model):
     base_quest = models.ForeignKey(BaseQuest, on_delete=models.CASCADE)
@@ -1180,6 +1288,17 @@ class ActiveCumulativeQuest(models.Model):
         return "(" + str(self.id) + ") " + self.base_quest.title
 
 
+# Name of the `config_cache.ConfigCache` for active quests, see `questupdater.py`
+ACTIVE_QUESTS_CACHE = 'active_quests'
+
+
+@receiver(post_save, sender=BaseQuest)
+@receiver(post_save, sender=ActiveCumulativeQuest)
+@receiver(post_delete, sender=ActiveCumulativeQuest)
+def invalidate_active_quests_cache(sender, instance, **kwargs):
+    config_cache.publish_invalidation(ACTIVE_QUESTS_CACHE)
+
+
 class ActiveWeeklyQuest(models.Model):
     base_quest = models.ForeignKey(BaseQuest, on_delete=models.CASCADE)
 
@@ -1194,6 +1313,29 @@ class ActiveDailyQuest(models.Model):
         return "(" + str(self.id) + ") " + self.base_quest.title
 
 
+# The daily (days_interval 1) or weekly (7) quests everyone has until
+# expiration_date. A user's PlayerQuestDaily / PlayerQuestWeekly rows are only
+# made the first time they look at or progress quests in the rotation, see
+# `questupdater.materialize_player_quests`.
+class QuestRotation(models.Model):
+    days_interval = models.IntegerField()
+    base_quests = ArrayField(models.IntegerField(), default=list)
+    expiration_date = models.DateTimeField()
+
+    def __str__(self):
+        return "(" + str(self.days_interval) + " days) expires " + str(self.expiration_date)
+
+
+# Name of the `config_cache.ConfigCache` for quest rotations, see `questupdater.py`
+QUEST_ROTATIONS_CACHE = 'quest_rotations'
+
+
+@receiver(post_save, sender=QuestRotation)
+@receiver(post_delete, sender=QuestRotation)
+def invalidate_quest_rotations_cache(sender, instance, **kwargs):
+    config_cache.publish_invalidation(QUEST_ROTATIONS_CACHE)
+
+
 class BaseCode(models.Model):
     code = models.TextField()
     gems = models.IntegerField(default=0)
@@ -1234,6 +1376,33 @@ class Mail(models.Model):
         ]
 
 
+# Mail for everyone who had an account when it was sent, see `inbox.py`.
+# A player only gets a BroadcastMailStatus once they open their inbox.
+class BroadcastMail(models.Model):
+    message = models.TextField()
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='broadcastmailsender')
+    sender_profile_picture_id = models.IntegerField(default=0)
+    time_send = models.DateTimeField(auto_now_add=True)
+    code = models.ForeignKey(BaseCode, on_delete=models.CASCADE, null=True, blank=True)
+    title = models.TextField(default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['time_send']),
+        ]
+
+
+class BroadcastMailStatus(models.Model):
+    broadcast = models.ForeignKey(BroadcastMail, on_delete=models.CASCADE, related_name='statuses')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    is_read = models.BooleanField(default=False)
+    is_claimed = models.BooleanField(default=False)
+    is_deleted = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('broadcast', 'user')
+
+
 class UserReferral(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     referral_code = models.TextField(unique=True)
@@ -1285,6 +1454,17 @@ class IPTracker(models.Model):
         return str(self.ip)
 
 
+# How far a chunked cron got today, written in the same transaction as the
+# chunk so a rerun never redoes a committed one, see battlegame/cron.py
+class CronCheckpoint(models.Model):
+    name = models.TextField()
+    day = models.DateField()
+    next_pk = models.IntegerField()
+
+    class Meta:
+        unique_together = ('name', 'day')
+
+
 class HackerAlert(models.Model):
     """An alert indicating a potential hacking incident by user."""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -1418,6 +1598,28 @@ class PurchasedTracker(models.Model):
         ]
 
 
+# A receipt waiting on the store, see playerdata/purchase_queue.py
+class PendingPurchase(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    store = models.IntegerField()  # 0 Apple, 1 Google
+    receipt = models.TextField()
+    transaction_id = models.TextField()
+    new_purchase_token = models.TextField(default='', blank=True)
+    state = models.IntegerField(choices=[(state.value, state.name) for state in constants.PendingPurchaseState],
+                                default=constants.PendingPurchaseState.PENDING.value)
+    attempts = models.IntegerField(default=0)
+    next_attempt_time = models.DateTimeField(default=timezone.now)
+    creation_time = models.DateTimeField(default=timezone.now)
+    # what /validate/ would have returned, set once the state isn't PENDING
+    result = JSONField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('user', 'transaction_id')
+        indexes = [
+            models.Index(fields=['state', 'next_attempt_time']),
+        ]
+
+
 def default_slot_list():
     return []
 
@@ -1600,6 +1802,31 @@ class GrassEvent(models.Model):
     rewards_left = ArrayField(models.IntegerField(), default=default_grass_rewards_left, blank=True, null=True)
 
 
+# Claims save these rows directly and the client lowers its own badge, so drop
+# the stored count and let the next connect recount it
+BADGE_NOTIF_TYPES = {
+    PlayerQuestDaily: constants.NotificationType.DAILY_QUEST.value,
+    PlayerQuestWeekly: constants.NotificationType.WEEKLY_QUEST.value,
+    PlayerQuestCumulative2: constants.NotificationType.CUMULATIVE_QUEST.value,
+    GrassEvent: constants.NotificationType.GRASS_EVENT.value,
+    RegalRewards: constants.NotificationType.REGAL_REWARDS.value,
+}
+
+
+@receiver(post_save, sender=PlayerQuestDaily)
+@receiver(post_save, sender=PlayerQuestWeekly)
+@receiver(post_save, sender=PlayerQuestCumulative2)
+@receiver(post_save, sender=GrassEvent)
+@receiver(post_save, sender=RegalRewards)
+def invalidate_badge_counts(sender, instance, update_fields=None, **kwargs):
+    # QuestProgressBatch saves completions this way and sends the increment itself,
+    # materializing quests invalidates the daily / weekly counts itself
+    if sender is PlayerQuestCumulative2 and update_fields is not None and \
+            set(update_fields) <= {'completed_quests', 'daily_expiration_date', 'weekly_expiration_date'}:
+        return
+    notifications.invalidate_badge_counts(instance.user_id, BADGE_NOTIF_TYPES[sender])
+
+
 # TODO: Combine with relic shop for keeping track of various purchased shop things
 class ResourceShop(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
@@ -1668,12 +1895,8 @@ def create_user_info(sender, instance, created, **kwargs):
         create_user_referral(instance)
         CreatorCodeTracker.objects.create(user=instance)
 
-        # Add quests
-        expiry_date_weekly = get_expiration_date(7)
-        expiry_date_daily = get_expiration_date(1)
+        # Daily and weekly quests are made on first use, see `questupdater.materialize_player_quests`
         PlayerQuestCumulative2.objects.create(user=instance)
-        create_quests_by_class(instance, ActiveWeeklyQuest.objects.all()[:constants.NUM_WEEKLY_QUESTS], PlayerQuestWeekly, expiry_date_weekly)
-        create_quests_by_class(instance, ActiveDailyQuest.objects.all()[:constants.NUM_DAILY_QUESTS], PlayerQuestDaily, expiry_date_daily)
 
         # Add welcome messages, if developer account IDs are defined in env
         if DEV_ACCOUNT_IDS:
@@ -1699,14 +1922,6 @@ def create_user_info(sender, instance, created, **kwargs):
             ChatMessage.objects.create(chat=chat, message=welcomeMessage4, sender=devUser)
 
 
-def create_quests_by_class(user, active_quests, quest_class, expiry_date):
-    bulk_quests = []
-    for quest in active_quests:
-        player_quest = quest_class(base_quest=quest.base_quest, user=user, expiration_date=expiry_date)
-        bulk_quests.append(player_quest)
-    quest_class.objects.bulk_create(bulk_quests)
-
-
 # Gets the next expiration date which is just midnight no time zone
 def get_expiration_date(interval):
     if interval == 1:
@@ -1731,3 +1946,83 @@ def save_user_info(sender, instance, **kwargs):
     instance.userstats.save()
     instance.inventory.save()
     instance.userinfo.clanmember.save()
+
+
+# Serialized opponent profiles are cached in a redis hash of {version, data},
+# see `matcher.get_userinfo_snapshot`. Any save to the models making up the
+# profile bumps the version and drops the data once the transaction commits,
+# so in-flight readers can't write back a stale snapshot.
+# Bump USERINFO_SNAPSHOT_SCHEMA when UserInfoSchema changes.
+USERINFO_SNAPSHOT_SCHEMA = 1
+USERINFO_SNAPSHOT_EXPIRY_SECONDS = 3600
+
+
+def userinfo_snapshot_key(user_id):
+    return "userinfo_snapshot_%d_%d" % (USERINFO_SNAPSHOT_SCHEMA, user_id)
+
+
+def invalidate_userinfo_snapshot(user_id):
+    if user_id is None:
+        return
+    invalidate_userinfo_snapshots([user_id])
+
+
+# For updates that skip post_save, like the cron resets
+def invalidate_userinfo_snapshots(user_ids):
+    user_ids = list(user_ids)
+
+    def invalidate():
+        pipe = get_redis_connection("default").pipeline()
+        for user_id in user_ids:
+            key = userinfo_snapshot_key(user_id)
+            pipe.hincrby(key, 'version', 1)
+            pipe.hdel(key, 'data')
+            pipe.expire(key, USERINFO_SNAPSHOT_EXPIRY_SECONDS)
+        pipe.execute()
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Placement)
+@receiver(post_delete, sender=Placement)
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Character)
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=UserInfo)
+@receiver(post_save, sender=UserStats)
+@receiver(post_save, sender=DungeonProgress)
+def invalidate_userinfo_snapshot_by_user(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_userinfo_snapshot(instance.user_id)
+
+
+@receiver(post_save, sender=ClanMember)
+@receiver(post_delete, sender=ClanMember)
+def invalidate_userinfo_snapshot_by_clanmember(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_userinfo_snapshot(instance.userinfo_id)
+
+
+# Snapshots hold the clan's name, remembered here to tell when it's renamed.
+# Read from __dict__ so a deferred name isn't loaded.
+@receiver(post_init, sender=Clan2)
+def remember_clan_name(sender, instance, **kwargs):
+    instance.loaded_name = instance.__dict__.get('name')
+
+
+def invalidate_userinfo_snapshots_by_clan(clan):
+    invalidate_userinfo_snapshots(ClanMember.objects.filter(clan2=clan).values_list('userinfo_id', flat=True))
+
+
+@receiver(post_save, sender=Clan2)
+def invalidate_userinfo_snapshots_by_clan_rename(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created and instance.name != instance.loaded_name:
+        invalidate_userinfo_snapshots_by_clan(instance)
+    instance.loaded_name = instance.name
+
+
+# Members are moved out of a deleted clan with an update, which skips post_save
+@receiver(pre_delete, sender=Clan2)
+def invalidate_userinfo_snapshots_by_clan_delete(sender, instance, **kwargs):
+    invalidate_userinfo_snapshots_by_clan(instance)
@@ -0,0 +1,85 @@
+from better_profanity import Profanity
+
+WHITELIST_WORDS = ['omg', 'omfg', 'lmao', 'lmfao', 'god', 'goddamn', 'goddammit', 'goddamned',
+                   'pee', 'poop', 'suck', 'sucked', 'crap', 'turd', 'piss', 'ugly', 'vulgar',
+                   'womb', 'virgin', 'retard', 'moron', 'doofus', 'dummy', 'douche',
+                   'douchebag', 'gay', 'lesbian', 'damn', 'fart', 'fat', 'hell', 'quicky',
+                   'sexual', 'wtf', 'kill', 'jerk', 'vomit', 'vulgar', 'vodka', 'wang',
+                   'weirdo', 'xx', 'xxx', 'urinal', 'urine', 'unwed', 'thug', 'stupid',
+                   'strip', 'steamy', 'sissy', 'seduce', 'pot']
+
+_END = ''
+
+
+class CompiledWordSet:
+    """The censor words in a trie, with the character substitutions folded in.
+
+    Stands in for better_profanity's list of VaryingStrings, where checking a
+    word compares it against every entry in turn. Here it walks the trie once,
+    following every letter an input character could be standing in for, so
+    `'sh1t' in words` costs the length of the word instead of the whole list.
+    """
+
+    def __init__(self, words, char_map):
+        # input char -> the word list chars it matches, e.g. '*' -> a, i, o, u, v, e
+        self.substitutes = {}
+        for char, variants in char_map.items():
+            for variant in variants:
+                if len(variant) != 1:
+                    raise ValueError("only single character substitutions can be compiled, got %r" % variant)
+                self.substitutes.setdefault(variant, set()).add(char)
+        # chars without a mapping only match themselves
+        for variant, chars in self.substitutes.items():
+            if variant not in char_map:
+                chars.add(variant)
+        self.char_map = char_map
+
+        self.root = {}
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        if _END not in node:
+            node[_END] = True
+            self.size += 1
+
+    def __contains__(self, text):
+        if not isinstance(text, str) or not text:
+            return False
+
+        nodes = [self.root]
+        for char in text:
+            chars = self.substitutes.get(char, (char,))
+            nodes = [node[c] for node in nodes for c in chars if c in node]
+            if not nodes:
+                return False
+        return any(_END in node for node in nodes)
+
+    def __len__(self):
+        return self.size
+
+
+class CompiledProfanity(Profanity):
+    """better_profanity with its word list compiled into a CompiledWordSet.
+
+    Tokenizing and censoring are left to the library, so results match it
+    exactly, only the word lookups are swapped out.
+    """
+
+    def _populate_words_to_wordset(self, words, *, whitelist_words=None):
+        super()._populate_words_to_wordset(words, whitelist_words=whitelist_words)
+        self.CENSOR_WORDSET = CompiledWordSet((str(word) for word in self.CENSOR_WORDSET), self.CHARS_MAPPING)
+
+    def add_censor_words(self, custom_words):
+        if not isinstance(custom_words, (list, tuple, set)):
+            raise TypeError("Function 'add_censor_words' only accepts list, tuple or set.")
+        for word in custom_words:
+            self.CENSOR_WORDSET.add(word)
+
+
+profanity = CompiledProfanity()
+profanity.load_censor_words(whitelist_words=list(WHITELIST_WORDS))
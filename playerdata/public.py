@@ -8,7 +8,7 @@ from django.http import HttpResponse
 from rest_framework.views import APIView
 
 from playerdata.models import BaseCharacterStats
-from playerdata.models import ServerStatus
+from playerdata import server
 
 
 # These two functions are translated from BaseInfo.cs#L420.
@@ -28,7 +28,7 @@ class PublicStatsView(APIView):
         if version is None:
             # We do this differently from base, to ensure that we don't expose
             # stats that have not yet been released yet.
-            version = ServerStatus.latest_version()
+            version = server.latest_version()
 
         response = HttpResponse(
             # Opt to display it instead of downloading it for now.
@@ -0,0 +1,211 @@
+"""Receipts verified off the request path.
+
+QueueValidateView stores the receipt as a PendingPurchase and returns right
+away. A pool of worker threads asks the store and fulfils it, then the client
+is told over the main socket, or finds out by polling PendingPurchaseView.
+Receipts the store couldn't answer for are retried with backoff by
+`retry_pending_purchases`, which the cron also uses to pick up anything a
+worker dropped.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from django.db import connections, transaction
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_marshmallow import Schema, fields
+
+from mainsocket import notifications
+from playerdata import constants, purchases, store_validators
+from playerdata.models import PendingPurchase
+from playerdata.serializers import ValidateReceiptSerializer
+
+PENDING = constants.PendingPurchaseState.PENDING.value
+DONE = constants.PendingPurchaseState.DONE.value
+FAILED = constants.PendingPurchaseState.FAILED.value
+
+# Receipts verified at once per process, one per pooled store client
+VERIFY_WORKERS = store_validators.VALIDATOR_POOL_SIZE
+
+MAX_VERIFY_ATTEMPTS = 6
+RETRY_BACKOFF_SECONDS = 30  # doubled after every attempt
+
+# A claimed receipt isn't picked up by another worker for this long, after
+# that it's assumed the worker died with it
+VERIFY_LEASE_SECONDS = 4 * store_validators.STORE_HTTP_TIMEOUT
+
+STORE_UNAVAILABLE_RESULT = {'status': False, 'reason': 'store unavailable, try again later'}
+
+
+class PendingPurchaseSchema(Schema):
+    id = fields.Int()
+    transaction_id = fields.Str()
+    state = fields.Int()
+    result = fields.Raw()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+# Made per process, a forked worker doesn't inherit the parent's threads
+def _get_executor():
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='purchase-verify')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _run_in_worker(pending_id):
+    try:
+        process_pending_purchase(pending_id)
+    except Exception:
+        logging.exception("pending purchase %d: verification failed" % pending_id)
+    finally:
+        connections.close_all()
+
+
+def schedule_pending_purchase(pending_id):
+    # after commit, or the worker might not see the row yet
+    transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, pending_id))
+
+
+def submit_receipt(user, store, receipt, transaction_id, new_purchase_token):
+    """Stores the receipt and queues it for verification. Resubmitting a
+    transaction returns the purchase already queued for it, one that failed
+    because the store was unavailable is queued again."""
+    with transaction.atomic():
+        pending, created = PendingPurchase.objects.get_or_create(
+            user=user, transaction_id=transaction_id,
+            defaults={'store': store, 'receipt': receipt, 'new_purchase_token': new_purchase_token})
+        if created:
+            schedule_pending_purchase(pending.id)
+            return pending
+
+        pending = PendingPurchase.objects.select_for_update().get(id=pending.id)
+        if pending.state == FAILED:
+            pending.state = PENDING
+            pending.attempts = 0
+            pending.next_attempt_time = datetime.now(timezone.utc)
+            pending.result = None
+            pending.save(update_fields=['state', 'attempts', 'next_attempt_time', 'result'])
+            schedule_pending_purchase(pending.id)
+    return pending
+
+
+def claim_pending_purchase(pending_id):
+    """Takes a receipt that's due for verification, leasing it so no other
+    worker verifies it at the same time. None if it isn't due."""
+    now = datetime.now(timezone.utc)
+
+    with transaction.atomic():
+        pending = PendingPurchase.objects.select_for_update(skip_locked=True, of=('self',)).select_related('user') \
+            .filter(id=pending_id, state=PENDING, next_attempt_time__lte=now).first()
+        if pending is None:
+            return None
+
+        pending.attempts += 1
+        pending.next_attempt_time = now + timedelta(seconds=VERIFY_LEASE_SECONDS)
+        pending.save(update_fields=['attempts', 'next_attempt_time'])
+    return pending
+
+
+def complete_pending_purchase(pending_id, state, get_result):
+    """Sets the final state and result, get_result(pending) runs in the same
+    transaction so a purchase is fulfilled at most once. The client is told
+    once it commits. Returns False if it was already completed."""
+    with transaction.atomic():
+        pending = PendingPurchase.objects.select_for_update(of=('self',)).select_related('user') \
+            .filter(id=pending_id, state=PENDING).first()
+        if pending is None:
+            return False
+
+        pending.state = state
+        pending.result = get_result(pending)
+        pending.save(update_fields=['state', 'result'])
+
+        data = PendingPurchaseSchema(pending).data
+        transaction.on_commit(lambda: notifications.send_purchase_complete(pending.user_id, data))
+    return True
+
+
+def retry_later(pending):
+    if pending.attempts >= MAX_VERIFY_ATTEMPTS:
+        complete_pending_purchase(pending.id, FAILED, lambda p: STORE_UNAVAILABLE_RESULT)
+        return
+
+    backoff = RETRY_BACKOFF_SECONDS * 2 ** (pending.attempts - 1)
+    PendingPurchase.objects.filter(id=pending.id, state=PENDING) \
+        .update(next_attempt_time=datetime.now(timezone.utc) + timedelta(seconds=backoff))
+
+
+def process_pending_purchase(pending_id):
+    pending = claim_pending_purchase(pending_id)
+    if pending is None:
+        return
+
+    try:
+        transaction_id, purchase_id = purchases.verify_receipt(pending.user, pending.store, pending.receipt,
+                                                               pending.transaction_id, pending.new_purchase_token)
+    except store_validators.StoreUnavailable:
+        retry_later(pending)
+        return
+    except store_validators.InvalidPurchase as e:
+        complete_pending_purchase(pending.id, DONE, lambda p: {'status': False, 'reason': str(e)})
+        return
+    except (ValueError, KeyError):
+        complete_pending_purchase(pending.id, DONE, lambda p: {'status': False, 'reason': 'invalid receipt'})
+        return
+
+    try:
+        # reward_purchase also skips transactions that were already fulfilled
+        complete_pending_purchase(pending.id, DONE,
+                                  lambda p: purchases.fulfil_purchase(p.user, transaction_id, purchase_id).data)
+    except Exception:
+        retry_later(pending)
+        raise
+
+
+def retry_pending_purchases(limit=1000):
+    """Verifies up to `limit` due receipts with the worker pool's concurrency,
+    returns how many were due."""
+    due = list(PendingPurchase.objects.filter(state=PENDING, next_attempt_time__lte=datetime.now(timezone.utc))
+               .order_by('next_attempt_time').values_list('id', flat=True)[:limit])
+
+    with ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix='purchase-verify') as executor:
+        list(executor.map(_run_in_worker, due))
+    return len(due)
+
+
+class QueueValidateView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        serializer = ValidateReceiptSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        store = serializer.validated_data['store']
+        receipt = serializer.validated_data['receipt']
+        transaction_id = serializer.validated_data['transaction_id']
+        new_purchase_token = serializer.validated_data['new_purchase_token'] if 'new_purchase_token' in serializer.validated_data else ''
+
+        pending = submit_receipt(request.user, store, receipt, transaction_id, new_purchase_token)
+        return Response({'status': True, 'pending_purchase': PendingPurchaseSchema(pending).data})
+
+
+class PendingPurchaseView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, pending_id):
+        pending = PendingPurchase.objects.filter(user=request.user, id=pending_id).first()
+        if pending is None:
+            return Response({'status': False, 'reason': 'purchase not found'})
+
+        return Response({'status': True, 'pending_purchase': PendingPurchaseSchema(pending).data})
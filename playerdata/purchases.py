@@ -6,22 +6,18 @@ from datetime import datetime, timezone, timedelta
 
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import IntegrityError, transaction
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from inapppy import AppStoreValidator, InAppPyValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_marshmallow import Schema, fields
 
-from battlegame.settings import SERVICE_ACCOUNT_FILE
 from playerdata.creatorcode import award_supported_creator
 from playerdata.models import Character
 from playerdata.models import InvalidReceipt
 from playerdata.models import Inventory
 from playerdata.models import PurchasedTracker, Item, ActiveDeal, BaseDeal, get_expiration_date
 from .tier_system import get_season_expiration_date
-from . import constants, chests, rolls, chapter_rewards_pack, world_pack, server, formulas
+from . import constants, chests, rolls, chapter_rewards_pack, world_pack, server, formulas, store_validators
 from .base import BaseItemSchema, BaseCharacterSchema
 from .constants import DealType
 from .questupdater import QuestUpdater
@@ -52,75 +48,86 @@ class PurchaseView(APIView):
 class ValidateView(APIView):
     permission_classes = (IsAuthenticated,)
 
-    @transaction.atomic()
+    # Not atomic, the store is asked before any transaction is opened and
+    # only the fulfilment holds one
     def post(self, request):
         serializer = ValidateReceiptSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         store = serializer.validated_data['store']
         receipt = serializer.validated_data['receipt']
         transaction_id = serializer.validated_data['transaction_id']
+        new_purchase_token = serializer.validated_data['new_purchase_token'] if 'new_purchase_token' in serializer.validated_data else ''
+
+        try:
+            transaction_id, purchase_id = verify_receipt(request.user, store, receipt, transaction_id, new_purchase_token)
+        except store_validators.StoreUnavailable:
+            return Response({'status': False, 'reason': 'store unavailable, try again later'})
+        except store_validators.InvalidPurchase as e:
+            return Response({'status': False, 'reason': str(e)})
+
+        with transaction.atomic():
+            return fulfil_purchase(request.user, transaction_id, purchase_id)
+
+
+def verify_receipt(user, store, receipt_raw, transaction_id, new_purchase_token):
+    """Asks the store about a receipt, outside of any transaction.
 
-        if store == 0:  # Apple
-            new_purchase_token = serializer.validated_data['new_purchase_token'] if 'new_purchase_token' in serializer.validated_data else ''
-            return validate_apple(request, receipt, transaction_id, new_purchase_token)
-        elif store == 1:
-            return validate_google(request, receipt)
+    Returns the (transaction_id, purchase_id) to fulfil, purchase_id is None
+    when the receipt is good but there's nothing to fulfil. Raises
+    InvalidPurchase with the reason for the client, or StoreUnavailable.
+    """
+    if store == 0:  # Apple
+        return verify_apple(receipt_raw, transaction_id, new_purchase_token)
+    elif store == 1:
+        return verify_google(user, receipt_raw)
+    raise store_validators.InvalidPurchase('invalid store ' + str(store))
 
 
-def validate_google(request, receipt_raw):
-    SCOPES = ['https://www.googleapis.com/auth/androidpublisher']
+def fulfil_purchase(user, transaction_id, purchase_id):
+    if purchase_id is None:
+        return Response({'status': True})
+    return reward_purchase(user, transaction_id, purchase_id)
 
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
 
+def verify_google(user, receipt_raw):
     payload = json.loads(receipt_raw)['Payload']
     json_payload = json.loads(payload)['json']
     receipt = json.loads(json_payload)
 
-    service = build('androidpublisher', 'v3', credentials=credentials)
-
     try:
         purchase_id = receipt['productId']
         transaction_id = receipt['orderId']
         is_subscription = purchase_id.startswith('com.salutationstudio.tinytitans.monthlypass')
 
-        if is_subscription:
-            response = service.purchases().subscriptions().get(packageName=receipt['packageName'],
-                                                               subscriptionId=purchase_id,
-                                                               token=receipt['purchaseToken']).execute()
-        else:
-            response = service.purchases().products().get(packageName=receipt['packageName'],
-                                                          productId=purchase_id,
-                                                          token=receipt['purchaseToken']).execute()
+        store_validators.verify_google_purchase(receipt['packageName'], purchase_id, receipt['purchaseToken'], is_subscription)
 
-        return reward_purchase(request.user, transaction_id, purchase_id)
+    except store_validators.StoreUnavailable:
+        raise
 
     except Exception:
-        InvalidReceipt.objects.create(user=request.user, order_number=str(receipt['orderId']),
+        InvalidReceipt.objects.create(user=user, order_number=str(receipt['orderId']),
                                       date=receipt['purchaseTime'], product_id=receipt['productId'], receipt=receipt_raw)
-        return Response({'status': False, 'reason': 'receipt validation failed'})
+        raise store_validators.InvalidPurchase('receipt validation failed')
 
+    return transaction_id, purchase_id
 
-def validate_apple(request, receipt_raw, transaction_id, new_purchase_token):
-    payload = json.loads(receipt_raw)['Payload']
 
-    bundle_id = 'com.salutationstudio.tinytitans'
-    validator = AppStoreValidator(bundle_id, auto_retry_wrong_env_request=True)
+def verify_apple(receipt_raw, transaction_id, new_purchase_token):
+    payload = json.loads(receipt_raw)['Payload']
 
     try:
-        validation_result = validator.validate(payload, None, exclude_old_transactions=False)
-        purchase_id = parse_apple_purchase_id(validation_result, transaction_id)
-        if purchase_id == '':
-            return Response({'status': False, 'reason': 'transaction_id not found'})
+        validation_result = store_validators.verify_apple_receipt(payload)
+    except store_validators.InvalidPurchase:
+        raise store_validators.InvalidPurchase('receipt validation failed')
 
-        if new_purchase_token != "UD5QKLWvv7fVbnfkCZ2dsUq4wZ":
-            return Response({'status': True})
+    purchase_id = parse_apple_purchase_id(validation_result, transaction_id)
+    if purchase_id == '':
+        raise store_validators.InvalidPurchase('transaction_id not found')
 
-        return reward_purchase(request.user, transaction_id, purchase_id)
+    if new_purchase_token != "UD5QKLWvv7fVbnfkCZ2dsUq4wZ":
+        return transaction_id, None
 
-    except InAppPyValidationError as ex:
-        response_from_apple = ex.raw_response  # contains actual response from AppStore service.
-        return Response({'status': False, 'reason': 'receipt validation failed'})
+    return transaction_id, purchase_id
 
 
 # https://developer.apple.com/documentation/appstorereceipts/responsebody/receipt/in_app
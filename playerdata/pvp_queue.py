@@ -6,7 +6,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from playerdata import constants, matcher, server
+from playerdata import constants, leaderboards, matcher, server
 from playerdata.models import UserInfo
 
 
@@ -19,22 +19,29 @@ def pop_pvp_queue(user):
     opponent_queue_key = build_opponent_queue_key(user.id)
     recently_seen_key = build_recently_seen_key(user.id)
 
-    # push more opponents into the queue if last one
-    if r.llen(opponent_queue_key) <= 1:
-        add_opponents_to_queue(r, user, opponent_queue_key, recently_seen_key)
+    script = r.register_script(POP_PVP_QUEUE_LUA)
+    opponent_id = script(keys=[opponent_queue_key, recently_seen_key],
+                         args=[RECENTLY_SEEN_QUEUE_LIMIT, QUEUE_EXPIRY_SECONDS])
 
-    # pop the current opponent off the queue and push it into recently seen
-    opponent_id = r.lpop(opponent_queue_key)
-    r.rpush(recently_seen_key, opponent_id)
+    # push more opponents into the queue if that was the last one
+    if opponent_id is None:
+        opponent_id = add_opponents_to_queue(r, user, opponent_queue_key, recently_seen_key)
 
-    if is_over_queue_limit(r, recently_seen_key, RECENTLY_SEEN_QUEUE_LIMIT):
-        r.lpop(recently_seen_key)
+    return int(opponent_id)
 
-    # expire the keys after 6 hours
-    r.expire(opponent_queue_key, 21600)
-    r.expire(recently_seen_key, 21600)
 
-    return get_current_opponent_id(r, opponent_queue_key)
+# Returns the current opponent without popping it
+# replenishes the queue if it's empty
+def peek_pvp_queue(user):
+    r = get_redis_connection("default")
+
+    opponent_queue_key = build_opponent_queue_key(user.id)
+    opponent_id = r.lindex(opponent_queue_key, 0)
+
+    if opponent_id is None:
+        opponent_id = add_opponents_to_queue(r, user, opponent_queue_key, build_recently_seen_key(user.id))
+
+    return int(opponent_id)
 
 
 ######################
@@ -42,6 +49,26 @@ def pop_pvp_queue(user):
 # With these queues we've chosen to do right pushes and left pops
 
 RECENTLY_SEEN_QUEUE_LIMIT = 10
+QUEUE_EXPIRY_SECONDS = 21600  # 6 hours
+
+# Pops the current opponent into recently seen, trims recently seen down to
+# its limit and refreshes both expiries, all in one atomic round trip.
+#
+# KEYS: [opponent queue, recently seen]
+# ARGV: [recently seen limit, expiry seconds]
+#
+# Returns the next opponent id, or nil if the queue needs to be replenished.
+POP_PVP_QUEUE_LUA = """
+local opponent_id = redis.call('LPOP', KEYS[1])
+if opponent_id then
+    redis.call('RPUSH', KEYS[2], opponent_id)
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[1]), -1)
+end
+
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('LINDEX', KEYS[1], 0)
+"""
 
 
 def build_opponent_queue_key(user_id):
@@ -52,27 +79,103 @@ def build_recently_seen_key(user_id):
     return "seen_" + str(user_id)
 
 
-def is_over_queue_limit(r, key, limit):
-    return r.llen(key) > limit
-
-
-def get_current_opponent_id(r, key):
-    return int(r.lindex(key, 0))
-
-
 def get_redis_list(r, key, MAX_SIZE):
     return r.lrange(key, 0, MAX_SIZE)
 
 
+# Returns the id at the front of the queue after replenishing
 def add_opponents_to_queue(r, user, opponent_queue_key, recently_seen_key):
     # hardcode queue the first 5 opponents
     if user.userstats.num_games == 0:
-        r.rpush(opponent_queue_key, 86, 87, 88, 100, 101)
-        return
-
-    exclude_list = get_redis_list(r, recently_seen_key, RECENTLY_SEEN_QUEUE_LIMIT)
-    user_ids = get_opponents_list(user, exclude_list)
-    r.rpush(opponent_queue_key, *user_ids)
+        user_ids = [86, 87, 88, 100, 101]
+    else:
+        user_ids = get_opponents_from_index(r, user, recently_seen_key)
+
+        # the elo index is rebuilt by the nightly cron, only hit the db if it's empty
+        if len(user_ids) == 0:
+            exclude_list = get_redis_list(r, recently_seen_key, RECENTLY_SEEN_QUEUE_LIMIT)
+            user_ids = get_opponents_list(user, exclude_list)
+
+    pipe = r.pipeline()
+    pipe.rpush(opponent_queue_key, *user_ids)
+    pipe.expire(opponent_queue_key, QUEUE_EXPIRY_SECONDS)
+    pipe.lindex(opponent_queue_key, 0)
+    return pipe.execute()[-1]
+
+
+NUM_QUEUE_OPPONENTS = 7
+OPPONENT_SAMPLE_LIMIT = 1000
+BOT_ONLY_MAX_ELO = 150
+
+# Same widening search as `get_opponents_list`, but done server side on the
+# `pvp_ranking` sorted sets so a refill is a single round trip.
+#
+# KEYS: [ranking zset, bot ranking zset, recently seen list]
+# ARGV: [cur_elo, start_range, increase_range, bot_only_max_elo,
+#        num_opponents, sample_limit, seen_limit, self_id]
+#
+# Returns the candidate ids of the first window with at least num_opponents
+# unseen users, or of the widest window that covers the whole index.
+OPPONENTS_WITHIN_ELO_LUA = """
+local cur_elo = tonumber(ARGV[1])
+local start_range = tonumber(ARGV[2])
+local increase_range = tonumber(ARGV[3])
+local bot_only_max_elo = tonumber(ARGV[4])
+local num_opponents = tonumber(ARGV[5])
+local sample_limit = tonumber(ARGV[6])
+
+local excluded = {[ARGV[8]] = true}
+local num_excluded = 1
+for _, id in ipairs(redis.call('LRANGE', KEYS[3], 0, tonumber(ARGV[7]))) do
+    excluded[id] = true
+    num_excluded = num_excluded + 1
+end
+
+-- furthest distance from cur_elo to any score in the index
+local reach = 0
+for _, key in ipairs({KEYS[1], KEYS[2]}) do
+    local lowest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local highest = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')
+    if #lowest > 0 then
+        reach = math.max(reach, cur_elo - tonumber(lowest[2]), tonumber(highest[2]) - cur_elo)
+    end
+end
+
+local search_count = 1
+while true do
+    local bound = search_count * increase_range + start_range
+    local key = KEYS[1]
+    if cur_elo + bound <= bot_only_max_elo then
+        key = KEYS[2]
+    end
+
+    local candidates = {}
+    local ids = redis.call('ZRANGEBYSCORE', key, cur_elo - bound, cur_elo + bound,
+                           'LIMIT', 0, sample_limit + num_excluded)
+    for _, id in ipairs(ids) do
+        if not excluded[id] and #candidates < sample_limit then
+            table.insert(candidates, id)
+        end
+    end
+
+    if #candidates >= num_opponents or bound >= reach then
+        return candidates
+    end
+    search_count = search_count + 1
+end
+"""
+
+
+# Samples opponents from the redis elo index, no db queries
+def get_opponents_from_index(r, user, recently_seen_key):
+    script = r.register_script(OPPONENTS_WITHIN_ELO_LUA)
+    candidates = script(keys=[leaderboards.pvp_ranking_key(), leaderboards.pvp_bot_ranking_key(), recently_seen_key],
+                        args=[user.userinfo.elo, constants.MATCHER_START_RANGE, constants.MATCHER_INCREASE_RANGE,
+                              BOT_ONLY_MAX_ELO, NUM_QUEUE_OPPONENTS, OPPONENT_SAMPLE_LIMIT,
+                              RECENTLY_SEEN_QUEUE_LIMIT, user.id])
+
+    user_ids = [int(user_id) for user_id in candidates]
+    return random.sample(user_ids, min(len(user_ids), NUM_QUEUE_OPPONENTS))
 
 
 def _get_opponents_within_elo(cur_elo, search_count, exclude_list):
@@ -80,7 +183,7 @@ def _get_opponents_within_elo(cur_elo, search_count, exclude_list):
     min_elo = cur_elo - bound
     max_elo = cur_elo + bound
 
-    if max_elo <= 150:
+    if max_elo <= BOT_ONLY_MAX_ELO:
         return UserInfo.objects.filter(elo__gte=min_elo, elo__lte=max_elo, is_bot=True) \
             .exclude(user_id__in=exclude_list) \
             .values_list('user_id', flat=True)[:1000]
@@ -93,7 +196,7 @@ def _get_opponents_within_elo(cur_elo, search_count, exclude_list):
 def get_opponents_list(user, exclude_list):
     cur_elo = user.userinfo.elo
     search_count = 1
-    num_opponents = 7
+    num_opponents = NUM_QUEUE_OPPONENTS
     exclude_list.append(user.id)
 
     # loop until we have at least NUM_OPPONENTS users in the queue
@@ -111,17 +214,8 @@ class GetOpponentView(APIView):
 
     @transaction.atomic
     def post(self, request):
-        r = get_redis_connection("default")
-        opponent_queue_key = build_opponent_queue_key(request.user.id)
-        recently_seen_key = build_recently_seen_key(request.user.id)
-
-        # push more opponents into the queue
-        if r.llen(opponent_queue_key) == 0:
-            add_opponents_to_queue(r, request.user, opponent_queue_key, recently_seen_key)
-
-        opponent_id = get_current_opponent_id(r, opponent_queue_key)
-        query = matcher.userinfo_preloaded().filter(user_id=opponent_id).first()
-        enemies = matcher.UserInfoSchema(query)
+        opponent_id = peek_pvp_queue(request.user)
+        enemies = matcher.get_userinfo_snapshot(opponent_id)
         if server.is_server_version_higher('0.5.0'):
-            return Response({'status': True, 'user_info': enemies.data})
-        return Response(enemies.data)
+            return Response({'status': True, 'user_info': enemies})
+        return Response(enemies)
@@ -8,14 +8,16 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_marshmallow import Schema, fields
 
+from playerdata import config_cache
 from playerdata.models import ActiveDailyQuest, get_expiration_date, ActiveWeeklyQuest, \
-    BaseQuest, PlayerQuestCumulative2, ActiveCumulativeQuest, ActivityPoints
+    BaseQuest, PlayerQuestCumulative2, ActivityPoints, ACTIVE_QUESTS_CACHE
 from playerdata.models import PlayerQuestDaily
 from playerdata.models import PlayerQuestWeekly
-from playerdata.models import User
+from playerdata.models import QuestRotation
 from . import constants
 from .activity_points import ActivityPointsUpdater, ActivityPointsSchema
-from .questupdater import QuestUpdater
+from .questupdater import QuestUpdater, get_all_active_cumulative_quests, current_player_quests, \
+    materialize_player_quests
 from .serializers import ClaimQuestSerializer, IntSerializer
 
 
@@ -81,8 +83,9 @@ class QuestView(APIView):
 
     def get(self, request):
         player_cumulative = PlayerQuestCumulative2.objects.filter(user=request.user).first()
-        active_quests = ActiveCumulativeQuest.objects.select_related("base_quest").exclude(base_quest_id__in=player_cumulative.claimed_quests)
-        cumulative_basequests = [quest.base_quest for quest in active_quests]
+        materialize_player_quests(request.user, player_cumulative)
+        cumulative_basequests = [quest for quest in get_all_active_cumulative_quests()
+                                 if quest.id not in player_cumulative.claimed_quests]
         request.user.userstats.cumulative_stats = defaultdict(int, request.user.userstats.cumulative_stats)
 
         cumulative_quests = []
@@ -95,11 +98,11 @@ class QuestView(APIView):
             }
             cumulative_quests.append(quest)
 
-        weekly_quests = PlayerQuestWeekly.objects.filter(user=request.user)\
+        weekly_quests = current_player_quests(PlayerQuestWeekly, request.user)\
             .select_related('base_quest__item_type').select_related('base_quest__char_type')\
             .order_by('claimed', '-completed')
 
-        daily_quests = PlayerQuestDaily.objects.filter(user=request.user)\
+        daily_quests = current_player_quests(PlayerQuestDaily, request.user)\
             .select_related('base_quest__item_type').select_related('base_quest__char_type')\
             .order_by('claimed', '-completed')
 
@@ -128,7 +131,7 @@ def handle_claim_quest(request, quest_class):
     user = request.user
 
     try:
-        quest = quest_class.objects.get(user=request.user, id=quest_id)
+        quest = current_player_quests(quest_class, user).get(id=quest_id)
     except ObjectDoesNotExist:
         return Response({'status': False, 'reason': 'invalid quest_id: %d' % quest_id})
 
@@ -165,7 +168,7 @@ class ClaimQuestCumulativeView(APIView):
         if (base_quest.id in player_quest.completed_quests) and not (base_quest.id in player_quest.claimed_quests):
             award_quest(request.user.inventory, base_quest)
             player_quest.claimed_quests.append(quest_id)
-            player_quest.save()
+            player_quest.save(update_fields=['claimed_quests'])
             return Response({'status': True})
 
         return Response({'status': False, 'reason': 'quest is still in progress'})
@@ -221,10 +224,8 @@ def _delete_first_n_rows(quest_class, n):
         id__in=list(quest_class.objects.values_list('pk', flat=True)[:n])).delete()
 
 
-def refresh_quests(PlayerQuestModel, ActiveQuestModel, num_quests, days_interval):
-    PlayerQuestModel.objects.all().delete()
-
-    # pull new ones and make them for every user
+def refresh_quests(ActiveQuestModel, num_quests, days_interval):
+    # pull new ones and make them the rotation for every user
     all_queued_quests = ActiveQuestModel.objects.all()
     if all_queued_quests.count() < num_quests:
         if ActiveQuestModel is ActiveDailyQuest:
@@ -234,27 +235,27 @@ def refresh_quests(PlayerQuestModel, ActiveQuestModel, num_quests, days_interval
         all_queued_quests = ActiveQuestModel.objects.all()
 
     active_quests = all_queued_quests[:num_quests]
-    expiry_date = get_expiration_date(days_interval)
-    users = User.objects.all()
-    bulk_quests = []
-    for quest in active_quests:
-        for user in users:
-            player_quest = PlayerQuestModel(base_quest=quest.base_quest, user=user, expiration_date=expiry_date)
-            bulk_quests.append(player_quest)
 
-    PlayerQuestModel.objects.bulk_create(bulk_quests)
+    # Player rows are made per user on first use, see `materialize_player_quests`
+    with transaction.atomic():
+        QuestRotation.objects.filter(days_interval=days_interval).delete()
+        QuestRotation.objects.create(days_interval=days_interval,
+                                     base_quests=[quest.base_quest_id for quest in active_quests],
+                                     expiration_date=get_expiration_date(days_interval))
     _delete_first_n_rows(ActiveQuestModel, num_quests)
 
 
-# refresh quests: deletes the previous ActiveQuests and uses new ones to propagate to users
+# refresh quests: deletes the previous ActiveQuests and uses new ones as the next rotation
 def refresh_daily_quests():
-    refresh_quests(PlayerQuestDaily, ActiveDailyQuest, constants.NUM_DAILY_QUESTS, 1)
+    refresh_quests(ActiveDailyQuest, constants.NUM_DAILY_QUESTS, 1)
     queue_active_daily_quests()
+    config_cache.publish_invalidation(ACTIVE_QUESTS_CACHE)
 
 
 def refresh_weekly_quests():
-    refresh_quests(PlayerQuestWeekly, ActiveWeeklyQuest, constants.NUM_WEEKLY_QUESTS, 7)
+    refresh_quests(ActiveWeeklyQuest, constants.NUM_WEEKLY_QUESTS, 7)
     queue_active_weekly_quests()
+    config_cache.publish_invalidation(ACTIVE_QUESTS_CACHE)
 
 
 # randomly sample from pool of quest ids to populate ActiveQuest
@@ -1,15 +1,23 @@
+import functools
 import logging
+import threading
 from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
 
+from django.db import transaction
 from django.db.transaction import atomic
 
 from mainsocket import notifications
-from playerdata import constants
-from playerdata.models import PlayerQuestCumulative2, BaseQuest, ActiveCumulativeQuest
+from playerdata import config_cache, constants
+from playerdata.models import PlayerQuestCumulative2, BaseQuest, ActiveCumulativeQuest, ACTIVE_QUESTS_CACHE
 from playerdata.models import PlayerQuestDaily
 from playerdata.models import PlayerQuestWeekly
+from playerdata.models import QuestRotation, QUEST_ROTATIONS_CACHE
 
 
+# Quest list helpers only update the quests in memory, callers are expected to
+# bulk_update them afterwards
 def add_progress_to_quest_list(progress, quests):
     completed_count = 0
     try:
@@ -20,7 +28,6 @@ def add_progress_to_quest_list(progress, quests):
                 completed_count += 1
             else:
                 quest.progress += progress
-            quest.save()
     except OverflowError:
         logging.error("stats overflow error")
     return completed_count
@@ -35,7 +42,6 @@ def set_progress_to_quest_list(progress, quests):
                 completed_count += 1
 
             quest.progress = progress
-            quest.save()
     except OverflowError:
         logging.error("stats overflow error")
     return completed_count
@@ -49,15 +55,98 @@ def update_cumulative_progress2(quests, progress, player_cumulative):
             player_cumulative.completed_quests.append(quest.id)
             completed_count += 1
 
-    player_cumulative.save()
     return completed_count
 
 
+# The active cumulative BaseQuests, in order and by quest type
+@dataclass(frozen=True)
+class ActiveCumulativeQuests:
+    quests: List[BaseQuest]  # in ActiveCumulativeQuest order, as QuestView lists them
+    by_type: Dict[int, List[BaseQuest]]
+
+
+def _load_active_cumulative_quests():
+    quests = [active_cumulative.base_quest for active_cumulative in
+              ActiveCumulativeQuest.objects.select_related('base_quest__item_type', 'base_quest__char_type').order_by('id')]
+    quests_by_type = defaultdict(list)
+    for quest in quests:
+        quests_by_type[quest.type].append(quest)
+    return ActiveCumulativeQuests(quests, dict(quests_by_type))
+
+
+# Only changes through the admin and the quest crons, see `quest.refresh_quests`
+active_cumulative_quests_cache = config_cache.ConfigCache(ACTIVE_QUESTS_CACHE, _load_active_cumulative_quests, ttl=600)
+
+
+def get_all_active_cumulative_quests():
+    return active_cumulative_quests_cache.get().quests
+
+
 # Returns the base_quests for the set of ActiveCumulativeQuests
 def get_active_cumulative_quests(UPDATE_TYPE, player_cumulative):
-    active_cumulative_quests = ActiveCumulativeQuest.objects.filter(base_quest__type=UPDATE_TYPE) \
-        .exclude(base_quest_id__in=(player_cumulative.completed_quests + player_cumulative.claimed_quests)).select_related('base_quest')
-    return [active_cumulative.base_quest for active_cumulative in active_cumulative_quests]
+    return get_active_cumulative_quests_by_types([UPDATE_TYPE], player_cumulative)
+
+
+def get_active_cumulative_quests_by_types(update_types, player_cumulative):
+    quests_by_type = active_cumulative_quests_cache.get().by_type
+    excluded = set(player_cumulative.completed_quests).union(player_cumulative.claimed_quests)
+    return [quest for update_type in update_types for quest in quests_by_type.get(update_type, [])
+            if quest.id not in excluded]
+
+
+# Maps days_interval to the current QuestRotation, only changes with the quest crons
+def _load_quest_rotations():
+    return {rotation.days_interval: rotation for rotation in QuestRotation.objects.order_by('expiration_date')}
+
+
+quest_rotations_cache = config_cache.ConfigCache(QUEST_ROTATIONS_CACHE, _load_quest_rotations, ttl=600)
+
+# PlayerQuest model -> (days_interval, PlayerQuestCumulative2 field marking its rotation, badge type)
+PLAYER_QUEST_ROTATIONS = {
+    PlayerQuestDaily: (1, 'daily_expiration_date', constants.NotificationType.DAILY_QUEST.value),
+    PlayerQuestWeekly: (7, 'weekly_expiration_date', constants.NotificationType.WEEKLY_QUEST.value),
+}
+
+
+# The user's rows for the current rotation. Before the first QuestRotation
+# there's nothing to filter on, and every row is current.
+def current_player_quests(PlayerQuestModel, user):
+    days_interval, _, _ = PLAYER_QUEST_ROTATIONS[PlayerQuestModel]
+    quests = PlayerQuestModel.objects.filter(user=user)
+    rotation = quest_rotations_cache.get().get(days_interval)
+    if rotation is not None:
+        quests = quests.filter(expiration_date=rotation.expiration_date)
+    return quests
+
+
+def materialize_player_quests(user, player_cumulative):
+    """Makes the user's daily and weekly quest rows for the current rotations,
+    if they don't have them yet, and drops their rows from older ones.
+
+    player_cumulative remembers which rotations were made, so this costs no
+    queries after the first call in a rotation.
+    """
+    rotations = quest_rotations_cache.get()
+    for PlayerQuestModel, (days_interval, expiration_field, notif_type) in PLAYER_QUEST_ROTATIONS.items():
+        rotation = rotations.get(days_interval)
+        if rotation is None or getattr(player_cumulative, expiration_field) == rotation.expiration_date:
+            continue
+
+        with transaction.atomic():
+            locked = PlayerQuestCumulative2.objects.select_for_update().get(user=user)
+            if getattr(locked, expiration_field) != rotation.expiration_date:
+                PlayerQuestModel.objects.filter(user=user).exclude(expiration_date=rotation.expiration_date).delete()
+                existing = set(PlayerQuestModel.objects.filter(user=user).values_list('base_quest_id', flat=True))
+                PlayerQuestModel.objects.bulk_create([PlayerQuestModel(user=user, base_quest_id=base_quest_id,
+                                                                       expiration_date=rotation.expiration_date)
+                                                      for base_quest_id in rotation.base_quests
+                                                      if base_quest_id not in existing])
+
+                setattr(locked, expiration_field, rotation.expiration_date)
+                locked.save(update_fields=[expiration_field])
+                notifications.invalidate_badge_counts(user.id, notif_type)
+
+        setattr(player_cumulative, expiration_field, rotation.expiration_date)
 
 
 class CumulativeBadgeNotifCount(notifications.BadgeNotifCount):
@@ -70,90 +159,159 @@ class CumulativeBadgeNotifCount(notifications.BadgeNotifCount):
 
 class DailyBadgeNotifCount(notifications.BadgeNotifCount):
     def get_badge_notif(self, user):
-        count = PlayerQuestDaily.objects.filter(user=user, completed=True, claimed=False).count()
+        count = current_player_quests(PlayerQuestDaily, user).filter(completed=True, claimed=False).count()
         return notifications.BadgeNotif(constants.NotificationType.DAILY_QUEST.value, count)
 
 
 class WeeklyBadgeNotifCount(notifications.BadgeNotifCount):
     def get_badge_notif(self, user):
-        count = PlayerQuestWeekly.objects.filter(user=user, completed=True, claimed=False).count()
+        count = current_player_quests(PlayerQuestWeekly, user).filter(completed=True, claimed=False).count()
         return notifications.BadgeNotif(constants.NotificationType.WEEKLY_QUEST.value, count)
 
 
-class QuestUpdater:
+class QuestProgressBatch:
+    """Collects quest progress for a user and writes it all at once.
+
+    While a batch is open, `QuestUpdater` calls for its user are only recorded.
+    `flush` then loads the affected quests once, applies the updates in order,
+    and writes them with one bulk_update per quest table. It sends a single
+    badge notification after the transaction commits.
+
+    Open one per request with `with QuestProgressBatch(request.user):` inside
+    the view's transaction, or with the `batch_quest_progress` decorator.
+    """
+    _local = threading.local()
+
+    def __init__(self, user):
+        self.user = user
+        self.updates = []  # (quest type, amount, is_set)
+        self.outer = None
 
     @staticmethod
+    def current(user):
+        batch = getattr(QuestProgressBatch._local, 'batch', None)
+        if batch is not None and batch.user.id == user.id:
+            return batch
+        return None
+
+    def __enter__(self):
+        self.outer = getattr(QuestProgressBatch._local, 'batch', None)
+        QuestProgressBatch._local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        QuestProgressBatch._local.batch = self.outer
+        if exc_type is None:
+            self.flush()
+
+    def add(self, UPDATE_TYPE, amount):
+        self.updates.append((UPDATE_TYPE, amount, False))
+
+    def set(self, UPDATE_TYPE, amount):
+        self.updates.append((UPDATE_TYPE, amount, True))
+
     @atomic
-    def add_progress_by_type(user, UPDATE_TYPE, amount):
-        if amount < 0:
-            logging.error("negative progress on quest type: " + UPDATE_TYPE)
+    def flush(self):
+        if len(self.updates) == 0:
             return
 
+        user = self.user
+        update_types = {update_type for update_type, _, _ in self.updates}
+
         player_cumulative = PlayerQuestCumulative2.objects.filter(user=user).first()
-        cumulative_basequests = get_active_cumulative_quests(UPDATE_TYPE, player_cumulative)
-
-        weekly_quests = PlayerQuestWeekly.objects.select_related('base_quest').filter(user=user,
-                                                                                      base_quest__type=UPDATE_TYPE,
-                                                                                      completed=False, claimed=False)
-        daily_quests = PlayerQuestDaily.objects.select_related('base_quest').filter(user=user,
-                                                                                    base_quest__type=UPDATE_TYPE,
-                                                                                    completed=False, claimed=False)
+        materialize_player_quests(user, player_cumulative)
+        cumulative_basequests = get_active_cumulative_quests_by_types(update_types, player_cumulative)
+        daily_quests = list(current_player_quests(PlayerQuestDaily, user).select_related('base_quest')
+                            .filter(base_quest__type__in=update_types, completed=False, claimed=False))
+        weekly_quests = list(current_player_quests(PlayerQuestWeekly, user).select_related('base_quest')
+                             .filter(base_quest__type__in=update_types, completed=False, claimed=False))
+
+        daily_count = 0
+        weekly_count = 0
         cumulative_count = 0
-        try:
-            user.userstats.cumulative_stats = defaultdict(int, user.userstats.cumulative_stats)
-            user.userstats.cumulative_stats[str(UPDATE_TYPE)] += amount
-            user.userstats.save()
+        user.userstats.cumulative_stats = defaultdict(int, user.userstats.cumulative_stats)
+
+        for update_type, amount, is_set in self.updates:
+            def pending(quests):
+                return [quest for quest in quests if quest.base_quest.type == update_type and not quest.completed]
+
+            update_list = set_progress_to_quest_list if is_set else add_progress_to_quest_list
+            daily_count += update_list(amount, pending(daily_quests))
+            weekly_count += update_list(amount, pending(weekly_quests))
+
+            try:
+                if is_set:
+                    user.userstats.cumulative_stats[str(update_type)] = amount
+                else:
+                    user.userstats.cumulative_stats[str(update_type)] += amount
+
+                pending_cumulative = [quest for quest in cumulative_basequests
+                                      if quest.type == update_type and quest.id not in player_cumulative.completed_quests]
+                cumulative_count += update_cumulative_progress2(pending_cumulative, user.userstats.cumulative_stats[str(update_type)], player_cumulative)
+            except OverflowError:
+                logging.error("stats overflow error")
+
+        self.updates = []
+
+        user.userstats.save(update_fields=['cumulative_stats'])
+        if cumulative_count > 0:
+            player_cumulative.save(update_fields=['completed_quests'])
+        PlayerQuestDaily.objects.bulk_update(daily_quests, ['progress', 'completed'])
+        PlayerQuestWeekly.objects.bulk_update(weekly_quests, ['progress', 'completed'])
+
+        def notify():
+            try:
+                notifications.send_badge_notifs_increment(user.id,
+                                                          notifications.BadgeNotif(constants.NotificationType.DAILY_QUEST.value, daily_count),
+                                                          notifications.BadgeNotif(constants.NotificationType.WEEKLY_QUEST.value, weekly_count),
+                                                          notifications.BadgeNotif(constants.NotificationType.CUMULATIVE_QUEST.value, cumulative_count)
+                                                          )
+            except:
+                logging.error("notification redis error")
+
+        transaction.on_commit(notify)
+
+
+# Opens a QuestProgressBatch for request.user around an APIView method
+def batch_quest_progress(func):
+    @functools.wraps(func)
+    def wrapper(view, request, *args, **kwargs):
+        with QuestProgressBatch(request.user):
+            return func(view, request, *args, **kwargs)
+    return wrapper
 
-            cumulative_count = update_cumulative_progress2(cumulative_basequests, user.userstats.cumulative_stats[str(UPDATE_TYPE)], player_cumulative)
-        except OverflowError:
-            logging.error("stats overflow error")
 
-        daily_count = add_progress_to_quest_list(amount, daily_quests)
-        weekly_count = add_progress_to_quest_list(amount, weekly_quests)
+class QuestUpdater:
+
+    @staticmethod
+    def add_progress_by_type(user, UPDATE_TYPE, amount):
+        if amount < 0:
+            logging.error("negative progress on quest type: " + UPDATE_TYPE)
+            return
 
-        try:
-            notifications.send_badge_notifs_increment(user.id,
-                                                      notifications.BadgeNotif(constants.NotificationType.DAILY_QUEST.value, daily_count),
-                                                      notifications.BadgeNotif(constants.NotificationType.WEEKLY_QUEST.value, weekly_count),
-                                                      notifications.BadgeNotif(constants.NotificationType.CUMULATIVE_QUEST.value, cumulative_count)
-                                                      )
-        except:
-            logging.error("notification redis error")
+        batch = QuestProgressBatch.current(user)
+        if batch is not None:
+            batch.add(UPDATE_TYPE, amount)
+            return
 
+        batch = QuestProgressBatch(user)
+        batch.add(UPDATE_TYPE, amount)
+        batch.flush()
 
     @staticmethod
-    @atomic
     def set_progress_by_type(user, UPDATE_TYPE, amount):
         if amount < 0:
             logging.error("negative progress on quest type: " + UPDATE_TYPE)
             return
 
-        player_cumulative = PlayerQuestCumulative2.objects.filter(user=user).first()
-        cumulative_basequests = get_active_cumulative_quests(UPDATE_TYPE, player_cumulative)
-
-        weekly_quests = PlayerQuestWeekly.objects.select_related('base_quest').filter(user=user,
-                                                                                      base_quest__type=UPDATE_TYPE,
-                                                                                      completed=False, claimed=False)
-        daily_quests = PlayerQuestDaily.objects.select_related('base_quest').filter(user=user,
-                                                                                    base_quest__type=UPDATE_TYPE,
-                                                                                    completed=False, claimed=False)
-
-        user.userstats.cumulative_stats[str(UPDATE_TYPE)] = amount
-        user.userstats.save()
-
-        cumulative_count = update_cumulative_progress2(cumulative_basequests, user.userstats.cumulative_stats[str(UPDATE_TYPE)], player_cumulative)
-
-        daily_count = set_progress_to_quest_list(amount, daily_quests)
-        weekly_count = set_progress_to_quest_list(amount, weekly_quests)
-
-        try:
-            notifications.send_badge_notifs_increment(user.id,
-                                                      notifications.BadgeNotif(constants.NotificationType.DAILY_QUEST.value, daily_count),
-                                                      notifications.BadgeNotif(constants.NotificationType.WEEKLY_QUEST.value, weekly_count),
-                                                      notifications.BadgeNotif(constants.NotificationType.CUMULATIVE_QUEST.value, cumulative_count)
-                                                      )
-        except:
-            logging.error("notification redis error")
+        batch = QuestProgressBatch.current(user)
+        if batch is not None:
+            batch.set(UPDATE_TYPE, amount)
+            return
+
+        batch = QuestProgressBatch(user)
+        batch.set(UPDATE_TYPE, amount)
+        batch.flush()
 
     @staticmethod
     def game_won_by_char_id(user, char_id):
@@ -1,10 +1,7 @@
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.transaction import atomic
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 
-from battlegame.settings import SERVICE_ACCOUNT_FILE
-from playerdata import constants, chapter_rewards_pack
+from playerdata import constants, chapter_rewards_pack, store_validators
 from playerdata.models import PurchasedTracker
 from playerdata.purchases import get_deal_from_purchase_id
 
@@ -40,15 +37,8 @@ def refund_purchase(purchase: PurchasedTracker):
 # Runs daily and checks for refunded purchases in the past 30 days (Google's max range)
 @atomic
 def google_refund_cron():
-    SCOPES = ['https://www.googleapis.com/auth/androidpublisher']
-
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    service = build('androidpublisher', 'v3', credentials=credentials)
-    bundle_id = 'com.salutationstudio.tinytitans'
-
-    response = service.purchases().voidedpurchases().list(packageName=bundle_id).execute()
+    with store_validators.google_validators.client() as google:
+        response = google.service.purchases().voidedpurchases().list(packageName=store_validators.BUNDLE_ID).execute()
 
     refund_ids = []
     # Exit early if no refunds exist
@@ -1,10 +1,15 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
 from django.utils import timezone
 from packaging import version
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_marshmallow import Schema, fields
 
-from playerdata.models import ServerStatus
+from playerdata import config_cache
+from playerdata.models import ServerStatus, SERVER_STATUS_CACHE
 
 
 class MaintenanceSchema(Schema):
@@ -12,27 +17,52 @@ class MaintenanceSchema(Schema):
     expected_end = fields.DateTime()
 
 
+@dataclass(frozen=True)
+class ServerVersions:
+    latest: ServerStatus
+    latest_required: Optional[ServerStatus]
+    parsed_latest: version.Version
+
+
+def _load_server_versions():
+    versions = ServerStatus.objects.filter(event_type='V')
+    latest = versions.latest('creation_time')
+    latest_required = versions.filter(require_update=True).order_by('-creation_time').first()
+    return ServerVersions(latest, latest_required, version.parse(latest.version_number))
+
+
+server_versions_cache = config_cache.ConfigCache(SERVER_STATUS_CACHE, _load_server_versions)
+
+
+# Version strings we compare against are literals, so only parse them once
+@lru_cache(maxsize=None)
+def _parse_version(version_num):
+    return version.parse(version_num)
+
+
+def latest_version():
+    return server_versions_cache.get().latest.version_number
+
+
 def is_server_version_higher(version_num):
-    latest_version = ServerStatus.objects.filter(event_type='V').latest('creation_time')
-    return version.parse(latest_version.version_number) > version.parse(version_num)
+    return server_versions_cache.get().parsed_latest > _parse_version(version_num)
 
 
 def get_next_patch():
-    next_patch = ServerStatus.latest_version().split('.')
+    next_patch = latest_version().split('.')
     next_patch[-1] = str(int(next_patch[-1]) + 1)
     return '.'.join(next_patch)
 
 
 class ServerStatusView(APIView):
     def get(self, request):
-        latest_version = ServerStatus.objects.filter(event_type='V').latest('creation_time')
-        latest_required = ServerStatus.objects.filter(event_type='V', require_update=True).latest('creation_time')
+        versions = server_versions_cache.get()
         upcoming_maintenances = ServerStatus.objects.filter(event_type='M').filter(maintenance_start__gte=timezone.now())
 
         return Response({
             'status': True,
-            'version': latest_version.version_number,
-            'patch_notes': latest_version.patch_notes,
-            'last_required_update_version': latest_required.version_number,
+            'version': versions.latest.version_number,
+            'patch_notes': versions.latest.patch_notes,
+            'last_required_update_version': versions.latest_required.version_number if versions.latest_required else None,
             'upcoming_maintenances': [MaintenanceSchema(m).data for m in upcoming_maintenances],
         })
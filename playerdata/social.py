@@ -1,7 +1,6 @@
 import random
 import re
 
-from better_profanity import profanity
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.db.models import Prefetch
@@ -22,6 +21,7 @@ from playerdata.models import Friend
 from playerdata.models import FriendRequest
 from . import constants, clan_pve
 from .matcher import UserInfoSchema, LightUserInfoSchema
+from .profanity_filter import profanity
 from .questupdater import QuestUpdater
 from .serializers import AcceptFriendRequestSerializer
 from .serializers import GetUserSerializer
@@ -10,13 +10,12 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from playerdata.models import DungeonProgress, Chest, Match, MatchReplay
-from playerdata.models import ServerStatus
 from playerdata.models import TournamentMatch
 from playerdata.models import TournamentMember
 from playerdata.models import UserStats
 from . import constants, formulas, rolls, tier_system, server, pvp_queue, matcher, afk_rewards, leaderboards, base
 from .formulas import vip_exp_to_level
-from .questupdater import QuestUpdater
+from .questupdater import QuestUpdater, batch_quest_progress
 from .serializers import UploadResultSerializer, BotResultsSerializer
 
 
@@ -91,6 +90,7 @@ class UploadQuickplayResultView(APIView):
     permission_classes = (IsAuthenticated,)
 
     @atomic
+    @batch_quest_progress
     def post(self, request):
         serializer = UploadResultSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -190,7 +190,7 @@ def update_match_history(attacker, defender_id, win, elo_updates, seed, attackin
                                  defender_id=defender_id,
                                  is_win=win,
                                  match_type='Q',
-                                 version=ServerStatus.latest_version(),
+                                 version=server.latest_version(),
                                  original_attacker_elo=elo_updates.attacker_original,
                                  updated_attacker_elo=elo_updates.attacker_new,
                                  original_defender_elo=elo_updates.defender_original,
@@ -214,19 +214,32 @@ def get_quickplay_usage_bucket(elo):
     return str(int(elo / constants.USAGE_BUCKET_ELO_SIZE))
 
 
-def save_usage_into_redis(team, win, elo, key_append):
-    r = get_redis_connection("default")
+# Queues the usage increments for a team on a redis pipeline, so an upload
+# costs one round trip however many characters it tracks
+def save_usage_into_redis(pipe, team, win, elo, key_append):
     chars = ['char_1', 'char_2', 'char_3', 'char_4', 'char_5']
+    bucket_num = get_quickplay_usage_bucket(elo)
     for char_num in chars:
         if(team[char_num] is None or team[char_num]['char_type'] == 0):
             continue
         char_type = team[char_num]['char_type']
-        base_key = get_redis_quickplay_usage_key(char_type)
-        bucket_num = get_quickplay_usage_bucket(elo)
-        key = f"{base_key}_{bucket_num}{key_append}"
-        r.incr(f"{key}_games")
+        # One hash per character, with a "{bucket}_games" / "{bucket}_wins" field per elo bucket
+        key = get_redis_quickplay_usage_key(char_type)
+        field = f"{bucket_num}{key_append}"
+        pipe.hincrby(key, f"{field}_games")
         if win:
-            r.incr(f"{key}_wins")
+            pipe.hincrby(key, f"{field}_wins")
+
+
+# Usage counted since the last push_quickplay_usage_to_db, as
+# {char_type: {"{bucket}_{games|wins|defense_games|defense_wins}": count}}
+def get_pending_quickplay_usage(char_types):
+    pipe = get_redis_connection("default").pipeline(transaction=False)
+    for char_type in char_types:
+        pipe.hgetall(get_redis_quickplay_usage_key(char_type))
+
+    return {char_type: {field.decode(): int(count) for field, count in counters.items()}
+            for char_type, counters in zip(char_types, pipe.execute())}
 
 
 def handle_quickplay(request, win, opponent, stats, seed, attacking_team, defending_team):
@@ -237,8 +250,10 @@ def handle_quickplay(request, win, opponent, stats, seed, attacking_team, defend
         return Response({'status': False, 'reason': 'Max daily quickplay games exceeded'})
 
     update_stats(request.user, win, stats)
-    save_usage_into_redis(attacking_team, win, request.user.userinfo.elo, "")
-    save_usage_into_redis(defending_team, not win, request.user.userinfo.elo, "_defense")
+    pipe = get_redis_connection("default").pipeline(transaction=False)
+    save_usage_into_redis(pipe, attacking_team, win, request.user.userinfo.elo, "")
+    save_usage_into_redis(pipe, defending_team, not win, request.user.userinfo.elo, "_defense")
+    pipe.execute()
 
     chest_rarity = 0
     coins = 0
@@ -354,9 +369,8 @@ class SkipView(APIView):
         request.user.userstats.save()
 
         next_opponent_id = pvp_queue.pop_pvp_queue(request.user)
-        query = matcher.userinfo_preloaded().filter(user_id=next_opponent_id).first()
-        enemy = matcher.UserInfoSchema(query)
-        return Response({'status': True, 'next_enemy': enemy.data})
+        enemy = matcher.get_userinfo_snapshot(next_opponent_id)
+        return Response({'status': True, 'next_enemy': enemy})
 
 
 # TODO: add tests for this
@@ -385,4 +399,9 @@ class PostBotResultsView(APIView):
             user1.userinfo.save()
             user2.userinfo.save()
 
+            for userinfo in (user1.userinfo, user2.userinfo):
+                leaderboards.update_redis_ranking(userinfo.user_id, userinfo.elo, leaderboards.pvp_ranking_key())
+                if userinfo.is_bot:
+                    leaderboards.update_redis_ranking(userinfo.user_id, userinfo.elo, leaderboards.pvp_bot_ranking_key())
+
         return Response({'status': True})
@@ -0,0 +1,203 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import google.auth.exceptions
+import httplib2
+import requests
+from django.conf import settings
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from inapppy import AppStoreValidator, InAppPyValidationError
+
+BUNDLE_ID = 'com.salutationstudio.tinytitans'
+GOOGLE_SCOPES = ['https://www.googleapis.com/auth/androidpublisher']
+
+# Seconds to wait on a store before giving up on the request
+STORE_HTTP_TIMEOUT = 10
+
+# Clients kept per store, which is also the most validations a process runs against a store at once
+VALIDATOR_POOL_SIZE = 8
+
+# https://developer.apple.com/documentation/appstorereceipts/status
+APPLE_SERVER_UNAVAILABLE = 21005
+APPLE_INTERNAL_ERRORS = range(21100, 21200)
+
+
+class InvalidPurchase(Exception):
+    """The store looked at the receipt and rejected it."""
+
+
+class StoreUnavailable(Exception):
+    """The store couldn't be asked, the receipt may still be good."""
+
+
+class ClientPool:
+    """Long-lived store clients shared between threads.
+
+    A client holds its connection open and can't be used from two threads at
+    once, so a validation checks one out for as long as it runs. Clients are
+    made on first use, up to `size`, after which callers wait for a free one.
+    """
+
+    def __init__(self, factory, size=VALIDATOR_POOL_SIZE, timeout=STORE_HTTP_TIMEOUT):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        client = self._checkout()
+        try:
+            yield client
+        finally:
+            self.idle.put(client)
+
+    def _checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            can_create = self.created < self.size
+            if can_create:
+                self.created += 1
+
+        if not can_create:
+            try:
+                return self.idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise StoreUnavailable("all %d store clients are busy" % self.size)
+
+        try:
+            return self.factory()
+        except Exception:
+            with self.lock:
+                self.created -= 1
+            raise
+
+
+class GooglePlayValidator:
+    def __init__(self, discovery_doc, credentials):
+        http = httplib2.Http(timeout=STORE_HTTP_TIMEOUT)
+        if credentials is not None:
+            http = AuthorizedHttp(credentials, http=http)
+        self.service = build_from_document(discovery_doc, http=http)
+
+    def get_purchase(self, package_name, purchase_id, token, is_subscription):
+        purchases = self.service.purchases()
+        if is_subscription:
+            request = purchases.subscriptions().get(packageName=package_name, subscriptionId=purchase_id, token=token)
+        else:
+            request = purchases.products().get(packageName=package_name, productId=purchase_id, token=token)
+        return request.execute()
+
+
+class GooglePlayValidatorFactory:
+    """Makes GooglePlayValidators, fetching the discovery document and loading
+    the service account once for all of them instead of once per purchase."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.discovery_doc = None
+        self.credentials = None
+
+    def __call__(self):
+        with self.lock:
+            if self.discovery_doc is None:
+                try:
+                    response = requests.get(settings.GOOGLE_DISCOVERY_URL, timeout=STORE_HTTP_TIMEOUT)
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    raise StoreUnavailable("couldn't fetch the androidpublisher discovery document") from e
+
+                # no service account means an unauthenticated fake store in tests
+                if settings.SERVICE_ACCOUNT_FILE:
+                    self.credentials = service_account.Credentials.from_service_account_file(
+                        settings.SERVICE_ACCOUNT_FILE, scopes=GOOGLE_SCOPES)
+                self.discovery_doc = response.json()
+
+        return GooglePlayValidator(self.discovery_doc, self.credentials)
+
+
+class PooledAppStoreValidator(AppStoreValidator):
+    """AppStoreValidator over a kept-alive session, posting to the configured urls."""
+
+    def __init__(self, production_url, sandbox_url):
+        # set before super().__init__, which picks the url
+        self.production_url = production_url
+        self.sandbox_url = sandbox_url
+        self.session = requests.Session()
+        super().__init__(BUNDLE_ID, auto_retry_wrong_env_request=True, http_timeout=STORE_HTTP_TIMEOUT)
+
+    def _change_url_by_sandbox(self):
+        self.url = self.sandbox_url if self.sandbox else self.production_url
+
+    def validate(self, receipt, shared_secret=None, exclude_old_transactions=False):
+        # a sandbox receipt leaves validate() switched to the sandbox, start every receipt at production
+        self.sandbox = False
+        return super().validate(receipt, shared_secret, exclude_old_transactions)
+
+    def post_json(self, request_json):
+        self._change_url_by_sandbox()
+
+        try:
+            response = self.session.post(self.url, json=request_json, timeout=self.http_timeout)
+        except requests.RequestException as e:
+            raise StoreUnavailable("app store request failed") from e
+        if response.status_code >= 500:
+            raise StoreUnavailable("app store returned %d" % response.status_code)
+
+        try:
+            return response.json()
+        except ValueError:
+            raise InAppPyValidationError("HTTP error")
+
+
+def make_apple_validator():
+    return PooledAppStoreValidator(settings.APPLE_VERIFY_RECEIPT_URL, settings.APPLE_SANDBOX_VERIFY_RECEIPT_URL)
+
+
+google_validators = ClientPool(GooglePlayValidatorFactory())
+apple_validators = ClientPool(make_apple_validator)
+
+
+def reset_validators():
+    """Drops every pooled client, later validations make new ones from the current settings."""
+    global google_validators, apple_validators
+    google_validators = ClientPool(GooglePlayValidatorFactory())
+    apple_validators = ClientPool(make_apple_validator)
+
+
+def verify_google_purchase(package_name, purchase_id, token, is_subscription):
+    """Returns Google's record of the purchase. Raises InvalidPurchase when
+    Google doesn't know it, StoreUnavailable when Google couldn't be asked."""
+    with google_validators.client() as validator:
+        try:
+            return validator.get_purchase(package_name, purchase_id, token, is_subscription)
+        except HttpError as e:
+            if e.resp.status >= 500 or e.resp.status == 429:
+                raise StoreUnavailable("google play returned %d" % e.resp.status) from e
+            raise InvalidPurchase(str(e)) from e
+        except (httplib2.HttpLib2Error, OSError, google.auth.exceptions.TransportError) as e:
+            raise StoreUnavailable("google play request failed") from e
+
+
+def verify_apple_receipt(receipt):
+    """Returns the App Store's decoded receipt. Raises InvalidPurchase when
+    the receipt is rejected, StoreUnavailable when Apple couldn't be asked."""
+    with apple_validators.client() as validator:
+        try:
+            return validator.validate(receipt, None, exclude_old_transactions=False)
+        except InAppPyValidationError as e:
+            raw_response = getattr(e, 'raw_response', None) or {}
+            status = raw_response.get('status')
+            if status == APPLE_SERVER_UNAVAILABLE or status in APPLE_INTERNAL_ERRORS:
+                raise StoreUnavailable("app store returned status %s" % status) from e
+            raise InvalidPurchase(str(e)) from e
@@ -0,0 +1,177 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from django.test import override_settings
+
+from playerdata import store_validators
+
+SERVICE_PATH = 'androidpublisher/v3/applications/'
+
+
+def _get_method(method_id, path, id_param, response):
+    return {
+        'id': method_id,
+        'path': path,
+        'httpMethod': 'GET',
+        'response': {'$ref': response},
+        'parameters': {
+            name: {'type': 'string', 'required': True, 'location': 'path'}
+            for name in ('packageName', id_param, 'token')
+        },
+        'parameterOrder': ['packageName', id_param, 'token'],
+    }
+
+
+def discovery_document(root_url):
+    """The parts of androidpublisher v3 that receipt validation uses."""
+    return {
+        'kind': 'discovery#restDescription',
+        'name': 'androidpublisher',
+        'version': 'v3',
+        'rootUrl': root_url,
+        'servicePath': SERVICE_PATH,
+        'schemas': {
+            'ProductPurchase': {'id': 'ProductPurchase', 'type': 'object'},
+            'SubscriptionPurchase': {'id': 'SubscriptionPurchase', 'type': 'object'},
+        },
+        'resources': {'purchases': {'resources': {
+            'products': {'methods': {'get': _get_method(
+                'androidpublisher.purchases.products.get',
+                '{packageName}/purchases/products/{productId}/tokens/{token}', 'productId', 'ProductPurchase')}},
+            'subscriptions': {'methods': {'get': _get_method(
+                'androidpublisher.purchases.subscriptions.get',
+                '{packageName}/purchases/subscriptions/{subscriptionId}/tokens/{token}', 'subscriptionId', 'SubscriptionPurchase')}},
+        }}},
+    }
+
+
+class FakeStoreHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        store = self.server.store
+        if self.path == '/discovery':
+            return self.send_json(200, discovery_document(store.url + '/'))
+        if store.take_failure():
+            return self.send_json(503, {'error': {'code': 503, 'message': 'Backend Error'}})
+
+        # /androidpublisher/v3/applications/{packageName}/purchases/{kind}/{id}/tokens/{token}
+        path = urlsplit(self.path).path
+        parts = [unquote(part) for part in path[len('/' + SERVICE_PATH):].split('/')]
+        if len(parts) == 6 and parts[1] == 'purchases' and parts[4] == 'tokens':
+            purchase = store.google_purchases.get(parts[5])
+            if purchase is not None and purchase['productId'] == parts[3]:
+                return self.send_json(200, purchase)
+        return self.send_json(400, {'error': {'code': 400, 'message': 'The purchase token is no longer valid.'}})
+
+    def do_POST(self):
+        store = self.server.store
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        store.apple_requests.append(self.path)
+        if store.take_failure():
+            return self.send_json(503, {})
+
+        receipts = store.apple_sandbox_receipts if self.path == '/sandbox/verifyReceipt' else store.apple_receipts
+        other_receipts = store.apple_receipts if receipts is store.apple_sandbox_receipts else store.apple_sandbox_receipts
+        receipt = body['receipt-data']
+        if receipt in receipts:
+            return self.send_json(200, {'status': 0, 'receipt': {'bundle_id': 'com.salutationstudio.tinytitans',
+                                                                 'in_app': receipts[receipt]}})
+        if receipt in other_receipts:
+            return self.send_json(200, {'status': 21007 if receipts is store.apple_receipts else 21008})
+        return self.send_json(200, {'status': 21002})
+
+
+class FakeStore:
+    """Google Play and the App Store on a local port, for testing receipt
+    validation offline. Only purchases added up front validate, everything
+    else is rejected the way the real stores reject it.
+    """
+
+    def __init__(self):
+        self.google_purchases = {}  # purchase token -> Google's purchase record
+        self.apple_receipts = {}  # receipt data -> in_app list
+        self.apple_sandbox_receipts = {}
+        self.apple_requests = []  # verifyReceipt paths posted to, in order
+        self.failures = 0
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStoreHandler)
+        self.server.daemon_threads = True
+        self.server.store = self
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def settings(self):
+        """Settings pointing the store validators here."""
+        return {
+            'GOOGLE_DISCOVERY_URL': self.url + '/discovery',
+            'SERVICE_ACCOUNT_FILE': None,
+            'APPLE_VERIFY_RECEIPT_URL': self.url + '/verifyReceipt',
+            'APPLE_SANDBOX_VERIFY_RECEIPT_URL': self.url + '/sandbox/verifyReceipt',
+        }
+
+    def fail_next(self, count):
+        """Answers the next `count` validations with a 503."""
+        with self.lock:
+            self.failures = count
+
+    def take_failure(self):
+        with self.lock:
+            if self.failures <= 0:
+                return False
+            self.failures -= 1
+            return True
+
+    def add_google_purchase(self, product_id, order_id, token):
+        """Returns the receipt the client would send for the purchase."""
+        self.google_purchases[token] = {'kind': 'androidpublisher#productPurchase', 'productId': product_id,
+                                        'orderId': order_id, 'purchaseState': 0}
+        receipt = {'productId': product_id, 'orderId': order_id, 'packageName': 'com.salutationstudio.tinytitans',
+                   'purchaseToken': token, 'purchaseTime': 1600000000}
+        return json.dumps({'Payload': json.dumps({'json': json.dumps(receipt)})})
+
+    def add_apple_purchase(self, product_id, transaction_id, receipt_data, sandbox=False):
+        """Returns the receipt the client would send for the purchase."""
+        receipts = self.apple_sandbox_receipts if sandbox else self.apple_receipts
+        receipts.setdefault(receipt_data, []).append({'product_id': product_id, 'transaction_id': transaction_id})
+        return json.dumps({'Payload': receipt_data})
+
+
+class FakeStoreMixin:
+    """Points the store validators at a FakeStore, `self.store`, for the test case."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.store = FakeStore()
+        cls.store.start()
+        cls.store_settings = override_settings(**cls.store.settings())
+        cls.store_settings.enable()
+        store_validators.reset_validators()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store_settings.disable()
+        store_validators.reset_validators()
+        cls.store.stop()
+        super().tearDownClass()
@@ -1,7 +1,10 @@
 from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APITestCase
 
+from playerdata import base
 from playerdata.base import BaseInfoView
-from playerdata.models import User, Flag, UserFlag
+from playerdata.models import User, Flag, UserFlag, BaseItem
 
 
 class BaseFlagTestCase(TestCase):
@@ -21,3 +24,82 @@ class BaseFlagTestCase(TestCase):
                                                  value=True)
         flags = BaseInfoView.flags(self.u)
         self.assertTrue(any(f['name'] == 'dummy' and f['value'] for f in flags))
+
+
+class FlagSnapshotTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.other = User.objects.get(username='wilsoncwu')
+        self.level_match = Flag.objects.create(name=base.FlagName.LEVEL_MATCH.value, value=False)
+
+    def test_no_queries_when_cached(self):
+        base.is_flag_active(base.FlagName.LEVEL_MATCH)
+        with self.assertNumQueries(0):
+            self.assertFalse(base.is_flag_active(base.FlagName.LEVEL_MATCH))
+            self.assertFalse(base.is_flag_active(base.FlagName.STAR_TIERS))
+            base.flags_for(self.u)
+
+    def test_invalidated_on_save(self):
+        self.assertFalse(base.is_flag_active(base.FlagName.LEVEL_MATCH))
+        self.level_match.value = True
+        self.level_match.save()
+        self.assertTrue(base.is_flag_active(base.FlagName.LEVEL_MATCH))
+
+    def test_user_override(self):
+        UserFlag.objects.create(flag=self.level_match, user=self.u, value=True)
+        self.assertTrue(base.flags_for(self.u)[self.level_match.name])
+        self.assertFalse(base.flags_for(self.other)[self.level_match.name])
+        self.assertFalse(base.is_flag_active(base.FlagName.LEVEL_MATCH))
+
+
+class BaseInfoBundleTestCase(APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.client.force_authenticate(user=self.u)
+
+    def test_not_modified(self):
+        response = self.client.get('/baseinfo/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['status'])
+        self.assertTrue(response.data['items'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/baseinfo/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_rebuilt_on_base_data_change(self):
+        etag = self.client.get('/baseinfo/')['ETag']
+
+        item = BaseItem.objects.first()
+        item.name = 'Renamed'
+        item.save()
+
+        response = self.client.get('/baseinfo/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(any(i['name'] == 'Renamed' for i in response.data['items']))
+
+    def test_flags_change_etag(self):
+        etag = self.client.get('/baseinfo/')['ETag']
+        Flag.objects.create(name='dummy', value=True)
+
+        response = self.client.get('/baseinfo/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_versions_share_bundles(self):
+        base.base_info_cache.invalidate()
+        for version in ('100.0.0', '100.0.1', '200.5.3'):
+            response = self.client.get('/baseinfo/%s' % version)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # every version past the newest stats and specs gets the latest bundle
+        self.assertEqual(list(base.base_info_cache.get()), [None])
+
+    def test_invalid_version(self):
+        response = self.client.get('/baseinfo/not-a-version')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.data['status'])
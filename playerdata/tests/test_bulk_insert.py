@@ -0,0 +1,25 @@
+from django.test import TestCase
+
+from playerdata import bulk_insert
+from playerdata.models import Mail, User
+
+
+class CopyBulkCreateTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def test_copy_in_batches(self):
+        receiver_ids = list(User.objects.values_list('id', flat=True)[:5])
+        message = "line one\n\ttabbed \\ backslash"
+        progress = []
+
+        written = bulk_insert.copy_bulk_create(Mail,
+                                               (Mail(title='hi', message=message, sender_id=receiver_ids[0], receiver_id=user_id)
+                                                for user_id in receiver_ids),
+                                               batch_size=2, report=lambda rows, _: progress.append(rows))
+
+        self.assertEqual(written, 5)
+        self.assertEqual(progress, [2, 4, 5])
+        mails = Mail.objects.filter(title='hi', receiver_id__in=receiver_ids)
+        self.assertEqual(sorted(mail.receiver_id for mail in mails), sorted(receiver_ids))
+        self.assertTrue(all(mail.message == message and mail.code is None and not mail.is_read for mail in mails))
+        self.assertTrue(all(mail.time_send is not None for mail in mails))
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+from django.test import TestCase
+from django_redis import get_redis_connection
+
+from battlegame import cron
+from playerdata import statusupdate
+from playerdata.models import BaseCharacterUsage, CronCheckpoint, Inventory, User
+
+
+class RunInChunksTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def test_visits_every_row_once(self):
+        seen = []
+        cron.run_in_chunks("test_chunks", Inventory.objects.all(), lambda chunk: seen.extend(chunk.values_list('pk', flat=True)), chunk_size=2)
+
+        self.assertEqual(sorted(seen), sorted(Inventory.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_resumes_from_checkpoint(self):
+        pks = sorted(Inventory.objects.values_list('pk', flat=True))
+        CronCheckpoint.objects.create(name="test_chunks", day=datetime.utcnow().date(), next_pk=pks[1])
+
+        seen = []
+        cron.run_in_chunks("test_chunks", Inventory.objects.all(), lambda chunk: seen.extend(chunk.values_list('pk', flat=True)), chunk_size=2)
+
+        self.assertEqual(sorted(seen), pks[1:])
+
+    def test_ticket_drop(self):
+        inventory = Inventory.objects.filter(daily_dungeon_ticket__lt=cron.MAX_DAILY_DUNGEON_TICKET).first()
+        tickets = inventory.daily_dungeon_ticket
+        cron.clear_cron_checkpoint("daily_dungeon_ticket_drop")
+
+        cron.daily_dungeon_ticket_drop()
+
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.daily_dungeon_ticket, tickets + 1)
+        cron.clear_cron_checkpoint("daily_dungeon_ticket_drop")
+
+    def test_ticket_drop_capped(self):
+        Inventory.objects.all().update(daily_dungeon_ticket=cron.MAX_DAILY_DUNGEON_TICKET)
+        cron.clear_cron_checkpoint("daily_dungeon_ticket_drop")
+
+        cron.daily_dungeon_ticket_drop()
+
+        self.assertFalse(Inventory.objects.exclude(daily_dungeon_ticket=cron.MAX_DAILY_DUNGEON_TICKET).exists())
+        cron.clear_cron_checkpoint("daily_dungeon_ticket_drop")
+
+    def test_rerun_skips_committed_chunks(self):
+        inventory = Inventory.objects.filter(daily_dungeon_ticket__lt=cron.MAX_DAILY_DUNGEON_TICKET - 1).first()
+        tickets = inventory.daily_dungeon_ticket
+        cron.clear_cron_checkpoint("daily_dungeon_ticket_drop")
+
+        # a retry on the same day finds every chunk checkpointed
+        cron.daily_dungeon_ticket_drop()
+        cron.daily_dungeon_ticket_drop()
+
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.daily_dungeon_ticket, tickets + 1)
+
+    def test_checkpoint_rolled_back_with_chunk(self):
+        def fail(chunk):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            cron.run_in_chunks("test_chunks", Inventory.objects.all(), fail, chunk_size=2)
+        self.assertFalse(CronCheckpoint.objects.filter(name="test_chunks").exists())
+
+
+class PushQuickplayUsageTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.r = get_redis_connection("default")
+        self.key = statusupdate.get_redis_quickplay_usage_key(1)
+        self.r.delete(self.key)
+
+    def tearDown(self):
+        self.r.delete(self.key)
+
+    def test_push_usage(self):
+        team = {'char_1': {'char_type': 1}, 'char_2': None, 'char_3': None, 'char_4': None, 'char_5': None}
+        before = BaseCharacterUsage.objects.get(char_type_id=1)
+
+        pipe = self.r.pipeline()
+        statusupdate.save_usage_into_redis(pipe, team, True, 1200, "")
+        statusupdate.save_usage_into_redis(pipe, team, False, 1200, "")
+        statusupdate.save_usage_into_redis(pipe, team, False, 1200, "_defense")
+        pipe.execute()
+        cron.push_quickplay_usage_to_db()
+
+        after = BaseCharacterUsage.objects.get(char_type_id=1)
+        self.assertEqual(after.num_games_buckets[2], before.num_games_buckets[2] + 2)
+        self.assertEqual(after.num_wins_buckets[2], before.num_wins_buckets[2] + 1)
+        self.assertEqual(after.num_defense_games_buckets[2], before.num_defense_games_buckets[2] + 1)
+        self.assertEqual(after.num_defense_wins_buckets[2], before.num_defense_wins_buckets[2])
+        self.assertFalse(self.r.exists(self.key))
+
+    def test_pending_usage(self):
+        team = {'char_1': {'char_type': 1}, 'char_2': None, 'char_3': None, 'char_4': None, 'char_5': None}
+        pipe = self.r.pipeline()
+        statusupdate.save_usage_into_redis(pipe, team, True, 1200, "")
+        pipe.execute()
+
+        self.assertEqual(statusupdate.get_pending_quickplay_usage([1]), {1: {'2_games': 1, '2_wins': 1}})
+
+    def test_live_usage_view(self):
+        self.client.force_login(User.objects.get(username='battlegame'))
+        response = self.client.get('/stats/liveusage/', {'char_type': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1', response.json())
+
+        response = self.client.get('/stats/liveusage/', {'char_type': 'abc'})
+        self.assertEqual(response.status_code, 400)
@@ -3,7 +3,7 @@ import json
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
-from playerdata import constants
+from playerdata import constants, dungeon_gen
 
 from playerdata.models import User, ServerStatus, DungeonBoss, DungeonStage, DungeonProgress
 
@@ -78,3 +78,35 @@ class DungeonStageAPITestCase(APITestCase):
         # overlevel is by 10, stage 121 works well because all
         # chars have the same level pre-overlevelling, so comparing against any works
         self.assertTrue(char5_level - 10 == char4_level)
+
+
+class DungeonStageCacheTestCase(APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.boss = DungeonBoss.objects.create(stage=140, team_comp=json.loads(test_comp_str))
+
+    def test_cached(self):
+        mob = dungeon_gen.stage_generator(121, constants.DungeonType.CAMPAIGN.value)
+        with self.assertNumQueries(0):
+            self.assertEqual(dungeon_gen.stage_generator(121, constants.DungeonType.CAMPAIGN.value), mob)
+
+    def test_invalidated_on_boss_change(self):
+        dungeon_gen.stage_generator(121, constants.DungeonType.CAMPAIGN.value)
+
+        self.boss.team_comp = json.loads(test_with_items)
+        self.boss.save()
+
+        mob = dungeon_gen.stage_generator(121, constants.DungeonType.CAMPAIGN.value)
+        self.assertEqual(mob['char_1']['weapon']['item_type'], 32)
+
+    def test_boss_positions_unchanged(self):
+        dungeon_gen.dungeon_stages_cache.invalidate()
+        boss_mob = dungeon_gen.stage_generator(140, constants.DungeonType.CAMPAIGN.value)
+
+        # a normal stage shuffles positions, that mustn't leak into its boss stage
+        dungeon_gen.dungeon_stages_cache.invalidate()
+        dungeon_gen.stage_generator(121, constants.DungeonType.CAMPAIGN.value)
+        self.assertEqual(dungeon_gen.stage_generator(140, constants.DungeonType.CAMPAIGN.value), boss_mob)
+        cached_boss = dungeon_gen.dungeon_stages_cache.get().bosses[(constants.DungeonType.CAMPAIGN.value, 140)]
+        self.assertEqual(cached_boss.team_comp, json.loads(test_comp_str))
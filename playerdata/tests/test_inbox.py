@@ -1,7 +1,9 @@
+from unittest import mock
+
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from playerdata.models import User, Mail, BaseCode
+from playerdata.models import User, Mail, BaseCode, BroadcastMail, BroadcastMailStatus
 from datetime import datetime, timedelta, timezone
 
 
@@ -91,3 +93,76 @@ class InboxAPITestCase(APITestCase):
 
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(len(resp.data['mail']), 1)
+
+
+class BroadcastMailAPITestCase(APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.sender = User.objects.get(username='battlegame')
+        self.receiver = User.objects.get(id=21)
+        self.client.force_authenticate(user=self.receiver)
+
+        curr_time = datetime.now(timezone.utc)
+        self.basecode = BaseCode.objects.create(gems=100, code='broadcastgems', num_left=-1, start_time=curr_time, end_time=curr_time + timedelta(days=2))
+
+    def test_merged_inbox(self):
+        Mail.objects.create(sender=self.sender, receiver=self.receiver, message='direct')
+        broadcast = BroadcastMail.objects.create(sender=self.sender, message='everyone', code=self.basecode)
+        self.assertFalse(BroadcastMailStatus.objects.filter(user=self.receiver).exists())
+
+        resp = self.client.get('/inbox/get/')
+
+        self.assertEqual([mail['message'] for mail in resp.data['mail']][:2], ['everyone', 'direct'])
+        self.assertEqual(resp.data['mail'][0]['id'], -broadcast.id)
+        self.assertTrue(resp.data['mail'][0]['has_unclaimed_reward'])
+        self.assertTrue(BroadcastMailStatus.objects.filter(user=self.receiver, broadcast=broadcast).exists())
+
+    def test_claim_and_delete(self):
+        broadcast = BroadcastMail.objects.create(sender=self.sender, message='everyone', code=self.basecode)
+        receiver_gems = self.receiver.inventory.gems
+
+        resp = self.client.post('/inbox/claim/', {'value': -broadcast.id})
+        self.assertTrue(resp.data['status'])
+        self.receiver.inventory.refresh_from_db()
+        self.assertEqual(self.receiver.inventory.gems, receiver_gems + 100)
+
+        resp = self.client.post('/inbox/claim/', {'value': -broadcast.id})
+        self.assertFalse(resp.data['status'])
+
+        resp = self.client.post('/inbox/delete/', {'value': -broadcast.id})
+        self.assertTrue(resp.data['status'])
+        resp = self.client.get('/inbox/get/')
+        self.assertFalse(any(mail['id'] == -broadcast.id for mail in resp.data['mail']))
+
+    def test_not_sent_to_newer_accounts(self):
+        broadcast = BroadcastMail.objects.create(sender=self.sender, message='everyone')
+        self.receiver.date_joined = datetime.now(timezone.utc) + timedelta(minutes=1)
+        self.receiver.save()
+
+        resp = self.client.get('/inbox/get/')
+        self.assertFalse(any(mail['id'] == -broadcast.id for mail in resp.data['mail']))
+
+    def test_pages_split_at_same_time(self):
+        mails = [Mail.objects.create(sender=self.sender, receiver=self.receiver, message='mail %d' % i) for i in range(3)]
+        broadcast = BroadcastMail.objects.create(sender=self.sender, message='everyone')
+        same_time = datetime.now(timezone.utc)
+        Mail.objects.filter(receiver=self.receiver).update(time_send=same_time - timedelta(minutes=1))
+        Mail.objects.filter(id__in=[mail.id for mail in mails]).update(time_send=same_time)
+        BroadcastMail.objects.filter(id=broadcast.id).update(time_send=same_time)
+
+        seen = []
+        params = {}
+        with mock.patch('playerdata.inbox.INBOX_PAGE_SIZE', 2):
+            for _ in range(2):
+                resp = self.client.get('/inbox/get/', params)
+                self.assertTrue(resp.data['status'])
+                seen += [mail['id'] for mail in resp.data['mail']]
+                params = {'before': resp.data['mail'][-1]['time_send'], 'before_id': resp.data['mail'][-1]['id']}
+
+        self.assertEqual(seen, [mails[2].id, mails[1].id, mails[0].id, -broadcast.id])
+
+    def test_invalid_before(self):
+        # '+' decoded as a space
+        resp = self.client.get('/inbox/get/', {'before': '2020-01-01T00:00:00 00:00'})
+        self.assertFalse(resp.data['status'])
@@ -1,9 +1,11 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 import playerdata.constants
-from playerdata import formulas, constants, inventory
+from playerdata import base, formulas, constants, inventory
 
-from playerdata.models import User, BaseCharacter, Character, BaseItem, Item
+from playerdata.models import User, BaseCharacter, Character, BaseItem, Item, Flag
 
 
 class EquipItemAPITestCase(APITestCase):
@@ -340,3 +342,30 @@ class ScrapItemTestCase(APITestCase):
 
         self.owned_bow3.refresh_from_db()
         self.assertEqual(self.owned_bow3.exp, expected_exp)
+
+
+class InventoryQueryCountTestCase(APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.client.force_authenticate(user=self.u)
+        Flag.objects.create(name=base.FlagName.LEVEL_MATCH.value, value=True)
+
+    def add_equipped_characters(self, count):
+        base_archer = BaseCharacter.objects.get(name="Archer")
+        base_bow = BaseItem.objects.get(name="Bow")
+        for _ in range(count):
+            bow = Item.objects.create(user=self.u, item_type=base_bow, exp=0)
+            Character.objects.create(user=self.u, char_type=base_archer, weapon=bow, is_boosted=True)
+
+    def test_constant_queries(self):
+        self.add_equipped_characters(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/inventoryinfo/')
+        self.assertTrue(response.data['status'])
+
+        self.add_equipped_characters(20)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get('/inventoryinfo/')
+        self.assertTrue(response.data['status'])
@@ -1,3 +1,5 @@
+from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 from playerdata.models import User
 
@@ -30,4 +32,29 @@ class ChangeNameTestCase(APITestCase):
         response = self.client.post('/changename/',{
             'name' : 'okName'
         })
-        self.assertTrue(response.data['status'])
\ No newline at end of file
+        self.assertTrue(response.data['status'])
+
+class CachedTokenAuthenticationTestCase(APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='testWilson')
+        Token.objects.filter(user=self.u).delete()
+        self.token = Token.objects.create(user=self.u)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_cached_token(self):
+        self.assertEqual(self.client.get('/test/').status_code, status.HTTP_200_OK)
+
+        # just the user
+        with self.assertNumQueries(1):
+            response = self.client.get('/test/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_rotated_token(self):
+        self.assertEqual(self.client.get('/test/').status_code, status.HTTP_200_OK)
+
+        Token.objects.filter(user=self.u).delete()
+        Token.objects.create(user=self.u)
+
+        self.assertEqual(self.client.get('/test/').status_code, status.HTTP_401_UNAUTHORIZED)
@@ -1,7 +1,12 @@
+from django.test import TransactionTestCase
+from django_redis import get_redis_connection
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from playerdata.models import User, Placement, BaseCharacter, Character
+from battlegame import cron
+from playerdata import constants, matcher, tier_system
+from playerdata.models import User, UserInfo, UserStats, Placement, BaseCharacter, Character, Clan2, ClanMember, \
+    userinfo_snapshot_key
 
 
 class MatcherAPITestCase(APITestCase):
@@ -115,3 +120,74 @@ class PlacementsAPITestCase(APITestCase):
 
         placement.refresh_from_db()
         self.assertEqual(placement.pos_1, 2)
+
+
+class UserInfoSnapshotTestCase(TransactionTestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='testWilson')
+        self.r = get_redis_connection("default")
+        self.r.delete(userinfo_snapshot_key(self.u.id))
+
+    def tearDown(self):
+        self.r.delete(userinfo_snapshot_key(self.u.id))
+
+    def test_snapshot_cached(self):
+        snapshot = matcher.get_userinfo_snapshot(self.u.id)
+        self.assertEqual(snapshot['name'], 'testWilson')
+        self.assertIsNotNone(self.r.hget(userinfo_snapshot_key(self.u.id), 'data'))
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id), snapshot)
+
+    def test_snapshot_invalidated(self):
+        matcher.get_userinfo_snapshot(self.u.id)
+
+        self.u.userinfo.name = 'renamed'
+        self.u.userinfo.save()
+        self.assertIsNone(self.r.hget(userinfo_snapshot_key(self.u.id), 'data'))
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['name'], 'renamed')
+
+        char = self.u.userinfo.default_placement.char_1
+        char.level += 1
+        char.save()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['default_placement']['char_1']['level'], char.level)
+
+    def test_snapshot_invalidated_by_stats(self):
+        matcher.get_userinfo_snapshot(self.u.id)
+
+        self.u.userstats.num_wins += 1
+        self.u.userstats.save()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['num_wins'], self.u.userstats.num_wins)
+
+        self.u.dungeonprogress.campaign_stage += 1
+        self.u.dungeonprogress.save()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['campaign_stage'], self.u.dungeonprogress.campaign_stage)
+
+    def test_snapshot_invalidated_by_daily_reset(self):
+        UserStats.objects.filter(user=self.u).update(daily_wins=3, daily_games=4)
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['daily_wins'], 3)
+
+        cron.clear_cron_checkpoint("reset_daily_wins")
+        cron.run_in_chunks("reset_daily_wins", UserStats.objects.filter(daily_wins__gt=0, daily_games__gt=0),
+                           cron._reset_daily_wins_chunk)
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['daily_wins'], 0)
+
+    def test_snapshot_invalidated_by_season_reset(self):
+        grandmaster_elo = constants.TIER_ELO_INCREMENT * (constants.Tiers.GRANDMASTER.value - 1)
+        UserInfo.objects.filter(user=self.u).update(elo=grandmaster_elo + 500, highest_season_elo=grandmaster_elo + 500)
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['elo'], grandmaster_elo + 500)
+
+        tier_system.restart_season()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['elo'], grandmaster_elo)
+
+    def test_snapshot_invalidated_by_clan(self):
+        clan = Clan2.objects.create(name='snapshotclan')
+        ClanMember.objects.filter(userinfo_id=self.u.id).update(clan2=clan)
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['clan'], 'snapshotclan')
+
+        clan.name = 'renamedclan'
+        clan.save()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['clan'], 'renamedclan')
+
+        clan.delete()
+        self.assertEqual(matcher.get_userinfo_snapshot(self.u.id)['clan'], '')
@@ -1,7 +1,8 @@
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 
-from playerdata.models import BaseCharacter, BaseCharacterAbility2, Character, BaseItem, Item, User
+from playerdata.models import BaseCharacter, BaseCharacterAbility2, Character, BaseItem, Item, User, \
+    base_character_ability_index
 
 class CharacterTestCase(TestCase):
     fixtures = ['playerdata/tests/fixtures.json']
@@ -210,3 +211,34 @@ class BaseCharacterAbilityTestCase(TestCase):
         }
         with self.assertRaises(ValidationError):
             specs.full_clean()
+
+
+class VersionIndexTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.archer = BaseCharacter.objects.get(name='Archer')
+        for v in ['0.0.1', '0.0.10', '0.0.2', '1.0.0']:
+            BaseCharacterAbility2.objects.create(char_type=self.archer, version=v)
+
+    def active_version(self, v=None, inclusive=True):
+        specs = base_character_ability_index.active_under_version(v, inclusive=inclusive)
+        return next(s.version for s in specs if s.char_type_id == self.archer.char_type)
+
+    def test_active_under_version(self):
+        self.assertEqual(self.active_version(), '1.0.0')
+        self.assertEqual(self.active_version('0.0.10'), '0.0.10')
+        self.assertEqual(self.active_version('0.0.9'), '0.0.2')
+        self.assertEqual(self.active_version('0.0.10', inclusive=False), '0.0.2')
+        self.assertFalse(any(s.char_type_id == self.archer.char_type
+                             for s in BaseCharacterAbility2.get_active_under_version('0.0.0')))
+
+    def test_invalidated_on_save(self):
+        self.active_version()
+        BaseCharacterAbility2.objects.create(char_type=self.archer, version='1.0.1')
+        self.assertEqual(self.active_version(), '1.0.1')
+
+    def test_no_queries_when_cached(self):
+        self.active_version()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.active_version('0.0.9'), '0.0.2')
@@ -0,0 +1,22 @@
+from better_profanity import Profanity
+from django.test import SimpleTestCase
+
+from playerdata.profanity_filter import WHITELIST_WORDS, profanity
+
+
+class CompiledProfanityTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.library = Profanity()
+        self.library.load_censor_words(whitelist_words=list(WHITELIST_WORDS))
+
+    def test_matches_library(self):
+        lines = ['hello there', 'what the fuck', 'sh1t happens', 'F*CK this', 'you a$$hole!',
+                 'hand_job', 'omg lol', 'gg wp, damn', '   ', 'shit', 'pot of g0ld', 'b1tch...']
+        for line in lines:
+            self.assertEqual(profanity.censor(line), self.library.censor(line), line)
+
+    def test_whitelist(self):
+        self.assertFalse(profanity.contains_profanity('omg that was stupid'))
+        self.assertTrue(profanity.contains_profanity('sh1t'))
+        self.assertEqual(profanity.censor('oh shit'), 'oh ****')
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from playerdata import constants, purchase_queue
+from playerdata.models import User, InvalidReceipt, PendingPurchase
+from playerdata.tests.fake_store import FakeStoreMixin
+
+GEMS = constants.IAP_GEMS_AMOUNT[constants.GEMS_499]
+
+
+class PurchaseQueueTestCase(FakeStoreMixin, APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.client.force_authenticate(user=self.u)
+        self.gems = self.u.inventory.gems
+
+    def submit(self, receipt, transaction_id):
+        response = self.client.post('/validate/queue/', {'store': 1, 'receipt': receipt, 'transaction_id': transaction_id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['status'])
+        return response.data['pending_purchase']
+
+    def poll(self, pending_id):
+        response = self.client.get('/validate/queue/%d' % pending_id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['pending_purchase']
+
+    def make_due(self, pending_id):
+        PendingPurchase.objects.filter(id=pending_id).update(next_attempt_time=datetime.now(timezone.utc))
+
+    def assertGemsAwarded(self, amount):
+        self.u.inventory.refresh_from_db()
+        self.assertEqual(self.u.inventory.gems, self.gems + amount)
+
+    def test_fulfilled(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1001', 'token1001')
+        pending = self.submit(receipt, 'GPA.1001')
+        self.assertEqual(pending['state'], purchase_queue.PENDING)
+        self.assertGemsAwarded(0)
+
+        purchase_queue.process_pending_purchase(pending['id'])
+
+        pending = self.poll(pending['id'])
+        self.assertEqual(pending['state'], purchase_queue.DONE)
+        self.assertTrue(pending['result']['status'])
+        self.assertGemsAwarded(GEMS)
+
+    def test_fulfilled_once(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1002', 'token1002')
+        pending = self.submit(receipt, 'GPA.1002')
+        purchase_queue.process_pending_purchase(pending['id'])
+
+        # resubmitting finds the finished purchase, processing it again does nothing
+        self.assertEqual(self.submit(receipt, 'GPA.1002')['id'], pending['id'])
+        self.make_due(pending['id'])
+        purchase_queue.process_pending_purchase(pending['id'])
+        self.assertGemsAwarded(GEMS)
+
+    def test_invalid(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1003', 'token1003')
+        del self.store.google_purchases['token1003']
+        pending = self.submit(receipt, 'GPA.1003')
+
+        purchase_queue.process_pending_purchase(pending['id'])
+
+        pending = self.poll(pending['id'])
+        self.assertEqual(pending['state'], purchase_queue.DONE)
+        self.assertEqual(pending['result'], {'status': False, 'reason': 'receipt validation failed'})
+        self.assertTrue(InvalidReceipt.objects.filter(user=self.u, order_number='GPA.1003').exists())
+        self.assertGemsAwarded(0)
+
+    def test_retried(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1004', 'token1004')
+        pending = self.submit(receipt, 'GPA.1004')
+        self.store.fail_next(1)
+
+        purchase_queue.process_pending_purchase(pending['id'])
+        queued = PendingPurchase.objects.get(id=pending['id'])
+        self.assertEqual(queued.state, purchase_queue.PENDING)
+        self.assertEqual(queued.attempts, 1)
+        self.assertGreater(queued.next_attempt_time, datetime.now(timezone.utc))
+
+        # not due yet
+        purchase_queue.process_pending_purchase(pending['id'])
+        self.assertEqual(PendingPurchase.objects.get(id=pending['id']).attempts, 1)
+
+        self.make_due(pending['id'])
+        purchase_queue.process_pending_purchase(pending['id'])
+        self.assertEqual(self.poll(pending['id'])['state'], purchase_queue.DONE)
+        self.assertGemsAwarded(GEMS)
+
+    def test_gives_up(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1005', 'token1005')
+        pending = self.submit(receipt, 'GPA.1005')
+        self.store.fail_next(purchase_queue.MAX_VERIFY_ATTEMPTS)
+
+        for _ in range(purchase_queue.MAX_VERIFY_ATTEMPTS):
+            self.make_due(pending['id'])
+            purchase_queue.process_pending_purchase(pending['id'])
+
+        pending = self.poll(pending['id'])
+        self.assertEqual(pending['state'], purchase_queue.FAILED)
+        self.assertEqual(pending['result'], purchase_queue.STORE_UNAVAILABLE_RESULT)
+        self.assertGemsAwarded(0)
+
+    def test_resubmit_after_giving_up(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1008', 'token1008')
+        pending = self.submit(receipt, 'GPA.1008')
+        self.store.fail_next(purchase_queue.MAX_VERIFY_ATTEMPTS)
+
+        for _ in range(purchase_queue.MAX_VERIFY_ATTEMPTS):
+            self.make_due(pending['id'])
+            purchase_queue.process_pending_purchase(pending['id'])
+        self.assertEqual(self.poll(pending['id'])['state'], purchase_queue.FAILED)
+
+        resubmitted = self.submit(receipt, 'GPA.1008')
+        self.assertEqual(resubmitted['id'], pending['id'])
+        self.assertEqual(resubmitted['state'], purchase_queue.PENDING)
+
+        purchase_queue.process_pending_purchase(pending['id'])
+        self.assertEqual(self.poll(pending['id'])['state'], purchase_queue.DONE)
+        self.assertGemsAwarded(GEMS)
+
+    def test_lease(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1006', 'token1006')
+        pending = self.submit(receipt, 'GPA.1006')
+
+        self.assertIsNotNone(purchase_queue.claim_pending_purchase(pending['id']))
+        self.assertIsNone(purchase_queue.claim_pending_purchase(pending['id']))
+
+        PendingPurchase.objects.filter(id=pending['id']).update(
+            next_attempt_time=datetime.now(timezone.utc) - timedelta(seconds=1))
+        self.assertIsNotNone(purchase_queue.claim_pending_purchase(pending['id']))
+
+    def test_poll_other_user(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.1007', 'token1007')
+        pending = self.submit(receipt, 'GPA.1007')
+
+        self.client.force_authenticate(user=User.objects.exclude(id=self.u.id).first())
+        response = self.client.get('/validate/queue/%d' % pending['id'])
+        self.assertFalse(response.data['status'])
@@ -4,8 +4,9 @@ from rest_framework import status
 from datetime import datetime, timedelta, timezone
 
 from playerdata import constants
-from playerdata.models import User, Character, ActiveDeal, BaseDeal
+from playerdata.models import User, Character, ActiveDeal, BaseDeal, InvalidReceipt, PurchasedTracker
 from playerdata.purchases import generate_and_insert_characters
+from playerdata.tests.fake_store import FakeStoreMixin
 
 
 class GenerateCharactersTestCase(APITestCase):
@@ -92,3 +93,82 @@ class DealsTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIsNotNone(response.data['daily_deals'])
+
+
+class ValidateReceiptTestCase(FakeStoreMixin, APITestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='battlegame')
+        self.client.force_authenticate(user=self.u)
+        self.gems = self.u.inventory.gems
+
+    def validate(self, store, receipt, transaction_id, **kwargs):
+        response = self.client.post('/validate/', {'store': store, 'receipt': receipt,
+                                                   'transaction_id': transaction_id, **kwargs})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def assertGemsAwarded(self, amount):
+        self.u.inventory.refresh_from_db()
+        self.assertEqual(self.u.inventory.gems, self.gems + amount)
+
+    def test_google(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.0001', 'token0001')
+
+        self.assertTrue(self.validate(1, receipt, 'GPA.0001')['status'])
+        self.assertGemsAwarded(constants.IAP_GEMS_AMOUNT[constants.GEMS_499])
+
+        # a resent receipt is only fulfilled once
+        self.assertTrue(self.validate(1, receipt, 'GPA.0001')['status'])
+        self.assertGemsAwarded(constants.IAP_GEMS_AMOUNT[constants.GEMS_499])
+
+    def test_google_invalid(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.0002', 'token0002')
+        del self.store.google_purchases['token0002']
+
+        self.assertFalse(self.validate(1, receipt, 'GPA.0002')['status'])
+        self.assertTrue(InvalidReceipt.objects.filter(user=self.u, order_number='GPA.0002').exists())
+        self.assertGemsAwarded(0)
+
+    def test_google_unavailable(self):
+        receipt = self.store.add_google_purchase(constants.GEMS_499, 'GPA.0003', 'token0003')
+        self.store.fail_next(1)
+
+        # the receipt is good, so it isn't recorded as invalid and can be sent again
+        self.assertFalse(self.validate(1, receipt, 'GPA.0003')['status'])
+        self.assertFalse(InvalidReceipt.objects.filter(user=self.u).exists())
+        self.assertTrue(self.validate(1, receipt, 'GPA.0003')['status'])
+        self.assertGemsAwarded(constants.IAP_GEMS_AMOUNT[constants.GEMS_499])
+
+    def test_apple(self):
+        receipt = self.store.add_apple_purchase(constants.GEMS_999, '1000001', 'receipt0001')
+
+        self.assertTrue(self.validate(0, receipt, '1000001', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')['status'])
+        self.assertGemsAwarded(constants.IAP_GEMS_AMOUNT[constants.GEMS_999])
+        self.assertTrue(PurchasedTracker.objects.filter(user=self.u, transaction_id='1000001').exists())
+
+    def test_apple_sandbox(self):
+        receipt = self.store.add_apple_purchase(constants.GEMS_999, '1000002', 'receipt0002', sandbox=True)
+
+        self.assertTrue(self.validate(0, receipt, '1000002', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')['status'])
+        self.assertGemsAwarded(constants.IAP_GEMS_AMOUNT[constants.GEMS_999])
+
+    def test_apple_production_after_sandbox(self):
+        sandbox_receipt = self.store.add_apple_purchase(constants.GEMS_999, '1000004', 'receipt0004', sandbox=True)
+        receipt = self.store.add_apple_purchase(constants.GEMS_999, '1000005', 'receipt0005')
+        self.assertTrue(self.validate(0, sandbox_receipt, '1000004', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')['status'])
+
+        # the pooled client goes back to production instead of trying the sandbox first
+        self.store.apple_requests.clear()
+        self.assertTrue(self.validate(0, receipt, '1000005', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')['status'])
+        self.assertEqual(self.store.apple_requests, ['/verifyReceipt'])
+
+    def test_apple_invalid(self):
+        receipt = self.store.add_apple_purchase(constants.GEMS_999, '1000003', 'receipt0003')
+
+        response = self.validate(0, '{"Payload": "forged"}', '1000003', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')
+        self.assertFalse(response['status'])
+        response = self.validate(0, receipt, '9999999', new_purchase_token='UD5QKLWvv7fVbnfkCZ2dsUq4wZ')
+        self.assertEqual(response['reason'], 'transaction_id not found')
+        self.assertGemsAwarded(0)
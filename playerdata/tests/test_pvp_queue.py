@@ -0,0 +1,88 @@
+from django.test import TestCase
+from django_redis import get_redis_connection
+
+from playerdata import leaderboards, pvp_queue
+from playerdata.models import User
+
+
+class OpponentIndexTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='testWilson')  # elo 1312
+        self.r = get_redis_connection("default")
+        self.seen_key = pvp_queue.build_recently_seen_key(self.u.id)
+        self.r.delete(leaderboards.pvp_ranking_key(), leaderboards.pvp_bot_ranking_key(), self.seen_key)
+
+    def tearDown(self):
+        self.r.delete(leaderboards.pvp_ranking_key(), leaderboards.pvp_bot_ranking_key(), self.seen_key)
+
+    def test_samples_within_elo(self):
+        near = {user_id: 1300 for user_id in range(1000, 1010)}
+        far = {user_id: 3000 for user_id in range(2000, 2010)}
+        leaderboards.bulk_update_redis_ranking({**near, **far, self.u.id: 1312}, leaderboards.pvp_ranking_key())
+
+        user_ids = pvp_queue.get_opponents_from_index(self.r, self.u, self.seen_key)
+        self.assertEqual(len(user_ids), pvp_queue.NUM_QUEUE_OPPONENTS)
+        self.assertTrue(set(user_ids).issubset(near.keys()))
+
+    def test_excludes_recently_seen(self):
+        near = {user_id: 1300 for user_id in range(1000, 1010)}
+        leaderboards.bulk_update_redis_ranking(near, leaderboards.pvp_ranking_key())
+        self.r.rpush(self.seen_key, 1000, 1001, 1002)
+
+        user_ids = pvp_queue.get_opponents_from_index(self.r, self.u, self.seen_key)
+        self.assertEqual(set(user_ids), set(range(1003, 1010)))
+
+    def test_widens_search(self):
+        leaderboards.bulk_update_redis_ranking({1000: 1500, 1001: 1000, 1002: 2000}, leaderboards.pvp_ranking_key())
+
+        user_ids = pvp_queue.get_opponents_from_index(self.r, self.u, self.seen_key)
+        self.assertEqual(set(user_ids), {1000, 1001, 1002})
+
+    def test_low_elo_bots_only(self):
+        self.u.userinfo.elo = 0
+        leaderboards.bulk_update_redis_ranking({1000: 10, 1001: 20, 1002: 30}, leaderboards.pvp_ranking_key())
+        leaderboards.bulk_update_redis_ranking({1001: 20, 1002: 30}, leaderboards.pvp_bot_ranking_key())
+
+        user_ids = pvp_queue.get_opponents_from_index(self.r, self.u, self.seen_key)
+        self.assertEqual(set(user_ids), {1001, 1002})
+
+
+class PopPvpQueueTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(username='testWilson')
+        self.r = get_redis_connection("default")
+        self.queue_key = pvp_queue.build_opponent_queue_key(self.u.id)
+        self.seen_key = pvp_queue.build_recently_seen_key(self.u.id)
+        self.r.delete(self.queue_key, self.seen_key)
+
+    def tearDown(self):
+        self.r.delete(self.queue_key, self.seen_key)
+
+    def test_pop(self):
+        self.r.rpush(self.queue_key, 14, 15, 22)
+
+        self.assertEqual(pvp_queue.pop_pvp_queue(self.u), 15)
+        self.assertEqual(self.r.lrange(self.seen_key, 0, -1), [b'14'])
+        self.assertEqual(pvp_queue.peek_pvp_queue(self.u), 15)
+        self.assertGreater(self.r.ttl(self.seen_key), 0)
+
+    def test_recently_seen_limit(self):
+        self.r.rpush(self.queue_key, *range(1000, 1020))
+        for _ in range(pvp_queue.RECENTLY_SEEN_QUEUE_LIMIT + 5):
+            pvp_queue.pop_pvp_queue(self.u)
+
+        seen = self.r.lrange(self.seen_key, 0, -1)
+        self.assertEqual(len(seen), pvp_queue.RECENTLY_SEEN_QUEUE_LIMIT)
+        self.assertEqual(int(seen[-1]), 1000 + pvp_queue.RECENTLY_SEEN_QUEUE_LIMIT + 4)
+
+    def test_pop_refills(self):
+        self.r.delete(leaderboards.pvp_ranking_key(), leaderboards.pvp_bot_ranking_key())
+        self.r.rpush(self.queue_key, 14)
+        leaderboards.update_redis_ranking(22, 1337, leaderboards.pvp_ranking_key())
+
+        self.assertEqual(pvp_queue.pop_pvp_queue(self.u), 22)
+        self.r.delete(leaderboards.pvp_ranking_key())
@@ -0,0 +1,110 @@
+from django.test import TestCase
+
+from playerdata import constants
+from playerdata.models import User, BaseQuest, PlayerQuestCumulative2, PlayerQuestDaily, ActiveCumulativeQuest, \
+    QuestRotation, get_expiration_date
+from playerdata.questupdater import QuestUpdater, QuestProgressBatch, get_active_cumulative_quests, \
+    get_all_active_cumulative_quests, current_player_quests, materialize_player_quests
+
+
+class QuestProgressBatchTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(id=21)
+
+    def test_add_progress(self):
+        QuestUpdater.add_progress_by_type(self.u, constants.WIN_QUICKPLAY_GAMES, 1)
+        self.assertTrue(PlayerQuestDaily.objects.get(id=506).completed)
+
+    def test_batch_flushes_on_exit(self):
+        damage_before = self.u.userstats.cumulative_stats.get(str(constants.DAMAGE_DEALT), 0)
+
+        with QuestProgressBatch(self.u):
+            QuestUpdater.add_progress_by_type(self.u, constants.DAMAGE_DEALT, 10000)
+            QuestUpdater.add_progress_by_type(self.u, constants.WIN_QUICKPLAY_GAMES, 1)
+            QuestUpdater.add_progress_by_type(self.u, constants.DAMAGE_DEALT, 10000)
+            QuestUpdater.set_progress_by_type(self.u, constants.WIN_STREAK, 3)
+            self.assertFalse(PlayerQuestDaily.objects.get(id=506).completed)
+
+        daily_quest = PlayerQuestDaily.objects.get(id=506)
+        self.assertTrue(daily_quest.completed)
+        self.assertEqual(daily_quest.progress, 1)
+
+        self.u.userstats.refresh_from_db()
+        self.assertEqual(self.u.userstats.cumulative_stats[str(constants.DAMAGE_DEALT)], damage_before + 20000)
+        self.assertEqual(self.u.userstats.cumulative_stats[str(constants.WIN_STREAK)], 3)
+
+        expected_completed = BaseQuest.objects.filter(activecumulativequest__isnull=False,
+                                                      type=constants.DAMAGE_DEALT,
+                                                      total__lte=damage_before + 20000).values_list('id', flat=True)
+        player_cumulative = PlayerQuestCumulative2.objects.get(user=self.u)
+        self.assertEqual(sorted(player_cumulative.completed_quests), sorted(expected_completed))
+
+    def test_batch_discarded_on_error(self):
+        with self.assertRaises(ValueError):
+            with QuestProgressBatch(self.u):
+                QuestUpdater.add_progress_by_type(self.u, constants.WIN_QUICKPLAY_GAMES, 1)
+                raise ValueError()
+
+        self.assertFalse(PlayerQuestDaily.objects.get(id=506).completed)
+
+
+class ActiveCumulativeQuestsTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.player_cumulative = PlayerQuestCumulative2.objects.get(user_id=21)
+
+    def test_cached(self):
+        quests = get_active_cumulative_quests(constants.DAMAGE_DEALT, self.player_cumulative)
+        self.assertEqual(len(quests), 3)
+
+        with self.assertNumQueries(0):
+            self.player_cumulative.completed_quests = [quests[0].id]
+            self.assertEqual(len(get_active_cumulative_quests(constants.DAMAGE_DEALT, self.player_cumulative)), 2)
+            self.assertEqual(len(get_active_cumulative_quests(constants.WIN_STREAK, self.player_cumulative)), 0)
+
+    def test_new_active_quest(self):
+        get_active_cumulative_quests(constants.WIN_STREAK, self.player_cumulative)
+        base_quest = BaseQuest.objects.create(title='win streak', type=constants.WIN_STREAK, total=5)
+        ActiveCumulativeQuest.objects.create(base_quest=base_quest)
+
+        quests = get_active_cumulative_quests(constants.WIN_STREAK, self.player_cumulative)
+        self.assertEqual([quest.id for quest in quests], [base_quest.id])
+
+    def test_all_in_active_order(self):
+        base_quest = BaseQuest.objects.create(title='win streak', type=constants.WIN_STREAK, total=5)
+        ActiveCumulativeQuest.objects.create(base_quest=base_quest)
+
+        expected = list(ActiveCumulativeQuest.objects.order_by('id').values_list('base_quest_id', flat=True))
+        self.assertEqual([quest.id for quest in get_all_active_cumulative_quests()], expected)
+
+
+class QuestRotationTestCase(TestCase):
+    fixtures = ['playerdata/tests/fixtures.json']
+
+    def setUp(self):
+        self.u = User.objects.get(id=21)
+        base_quest_ids = list(BaseQuest.objects.filter(type=constants.WIN_QUICKPLAY_GAMES).values_list('id', flat=True))
+        self.rotation = QuestRotation.objects.create(days_interval=1, base_quests=base_quest_ids,
+                                                     expiration_date=get_expiration_date(1))
+
+    def test_made_on_first_use(self):
+        num_rows = PlayerQuestDaily.objects.exclude(user=self.u).count()
+        self.assertFalse(current_player_quests(PlayerQuestDaily, self.u).exists())
+
+        QuestUpdater.add_progress_by_type(self.u, constants.WIN_QUICKPLAY_GAMES, 1)
+
+        quests = current_player_quests(PlayerQuestDaily, self.u)
+        self.assertEqual(sorted(quests.values_list('base_quest_id', flat=True)), sorted(self.rotation.base_quests))
+        self.assertTrue(all(quest.progress == 1 for quest in quests))
+        self.assertFalse(PlayerQuestDaily.objects.filter(id=506).exists())
+        self.assertEqual(PlayerQuestDaily.objects.exclude(user=self.u).count(), num_rows)
+
+    def test_made_once(self):
+        player_cumulative = PlayerQuestCumulative2.objects.get(user=self.u)
+        materialize_player_quests(self.u, player_cumulative)
+
+        with self.assertNumQueries(0):
+            materialize_player_quests(self.u, player_cumulative)
@@ -1,8 +1,11 @@
 from datetime import timedelta
+from django.db import transaction
+from django.test import TestCase
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from playerdata import server
 from playerdata.models import ServerStatus
 
 class MatcherAPITestCase(APITestCase):
@@ -32,3 +35,34 @@ class MatcherAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['version'], '1.0.1a')
         self.assertEqual(len(response.data['upcoming_maintenances']), 1)
+
+
+class ServerVersionCacheTestCase(TestCase):
+    def setUp(self):
+        ServerStatus.objects.create(event_type='V', version_number='1.0.0')
+
+    def test_version_cached(self):
+        self.assertTrue(server.is_server_version_higher('0.5.0'))
+        with self.assertNumQueries(0):
+            self.assertTrue(server.is_server_version_higher('0.5.0'))
+            self.assertFalse(server.is_server_version_higher('1.0.0'))
+            self.assertEqual(server.latest_version(), '1.0.0')
+
+    def test_new_version_invalidates(self):
+        self.assertFalse(server.is_server_version_higher('1.0.0'))
+        ServerStatus.objects.create(event_type='V', version_number='1.0.1')
+        self.assertTrue(server.is_server_version_higher('1.0.0'))
+        self.assertEqual(server.get_next_patch(), '1.0.2')
+
+    def test_rolled_back_version_not_cached(self):
+        self.assertEqual(server.latest_version(), '1.0.0')
+
+        try:
+            with transaction.atomic():
+                ServerStatus.objects.create(event_type='V', version_number='2.0.0')
+                self.assertEqual(server.latest_version(), '2.0.0')
+                raise RuntimeError('rolled back')
+        except RuntimeError:
+            pass
+
+        self.assertEqual(server.latest_version(), '1.0.0')
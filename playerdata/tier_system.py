@@ -12,7 +12,7 @@ from rest_framework.views import APIView
 from rest_marshmallow import Schema
 
 from playerdata import constants, chests, formulas, server
-from playerdata.models import EloRewardTracker, SeasonReward, UserInfo, ChampBadgeTracker
+from playerdata.models import EloRewardTracker, SeasonReward, UserInfo, ChampBadgeTracker, invalidate_userinfo_snapshots
 from playerdata.serializers import IntSerializer
 
 ELO_CAP = 6000
@@ -234,6 +234,7 @@ def restart_season():
         elo_trackers.append(tracker)
 
     UserInfo.objects.bulk_update(elo_reset_users, ['elo', 'highest_season_elo'])
+    invalidate_userinfo_snapshots(userinfo.user_id for userinfo in elo_reset_users)
     EloRewardTracker.objects.bulk_update(elo_trackers, ['last_claimed', 'last_completed'])
 
 